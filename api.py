@@ -1,20 +1,40 @@
-'''
 # api.py
 import time
+# taken before any other import, so import_s covers fastapi, pydantic and the rest
+_T_IMPORT = time.perf_counter()
+
+import os
+import json
+import asyncio
 import threading
+from contextlib import asynccontextmanager
+from concurrent.futures import ThreadPoolExecutor
 from typing import List, Dict, Any, Optional
-from fastapi import FastAPI, HTTPException
-from pydantic import BaseModel
+from fastapi import FastAPI, HTTPException, Request
+from fastapi.responses import StreamingResponse, PlainTextResponse, JSONResponse
+from pydantic import BaseModel, Field
 from fastapi.middleware.cors import CORSMiddleware
 
-# Your modules (make sure these exist in the same folder)
-from retriever import Retriever
+# Your modules (make sure these exist in the same folder). Only light ones are
+# imported here: retriever, reindexer and monitor pull in FAISS and are imported
+# where they are used, and torch / transformers load with the first model, so the
+# server binds at once and the models load in the background (see warm_up).
 from detector_healer import DetectorHealer
-from reindexer import build_index
-from monitor import run_monitor_sample
-from index_manager import list_versions
+from probe import RetrievalProbe
+from index_manager import list_versions, rollback_to
+from batcher import MicroBatcher
+from grounding import GroundingScorer
+from model_registry import REGISTRY
+import metrics
+
+@asynccontextmanager
+async def lifespan(app):
+    STARTUP["bind_s"] = round(time.perf_counter() - _T_IMPORT, 3)
+    if WARMUP:
+        start_warm_up()
+    yield
 
-app = FastAPI(title="Self-Healing-RAG API")
+app = FastAPI(title="Self-Healing-RAG API", lifespan=lifespan)
 
 # Allow CORS for all origins (so Streamlit UI can call it)
 app.add_middleware(
@@ -29,23 +49,189 @@ app.add_middleware(
 # -------------------------
 RETRIEVER = None
 HEALER = None
+SEARCH_BATCHER = None
+HEAL_BATCHER = None
+PROBE = None
 RETRIEVER_LOCK = threading.Lock()
+# reindex / rollback jobs write the live index files one at a time
+INDEX_JOB_LOCK = threading.Lock()
+
+# Concurrent /query retrievals are coalesced into one embed + one FAISS call.
+# A wider window gives bigger batches but adds up to that much latency.
+SEARCH_BATCH_SIZE = int(os.getenv("RAG_SEARCH_BATCH_SIZE", "32"))
+SEARCH_BATCH_WAIT_MS = float(os.getenv("RAG_SEARCH_BATCH_WAIT_MS", "5"))
+# Detection/healing runs seconds per batch on CPU, so a longer window is cheap.
+HEAL_BATCH_SIZE = int(os.getenv("RAG_HEAL_BATCH_SIZE", "8"))
+HEAL_BATCH_WAIT_MS = float(os.getenv("RAG_HEAL_BATCH_WAIT_MS", "20"))
+# A micro-batch is searched at the largest top_k in it, so one huge top_k
+# would slow every request batched with it; larger values are rejected (422).
+MAX_TOP_K = int(os.getenv("RAG_MAX_TOP_K", "50"))
+
+# Answers whose weakest sentence scores at least RAG_GROUNDED_THRESHOLD against the
+# retrieved chunks skip the LLM detector; below RAG_UNGROUNDED_THRESHOLD they are
+# flagged without it. Set both to the same value to bypass the LLM, or
+# RAG_GROUNDED_THRESHOLD above 1 to send everything to it.
+GROUNDED_THRESHOLD = float(os.getenv("RAG_GROUNDED_THRESHOLD", "0.75"))
+UNGROUNDED_THRESHOLD = float(os.getenv("RAG_UNGROUNDED_THRESHOLD", "0.35"))
+# How the LLM tier decides (score: yes/no logits, generate: JSON verdict) and, when
+# scoring, the hallucination probability at which an answer is flagged.
+DETECT_MODE = os.getenv("RAG_DETECT_MODE", "score")
+HALLUCINATION_THRESHOLD = float(os.getenv("RAG_HALLUCINATION_THRESHOLD", "0.5"))
+
+# dense (FAISS), sparse (BM25) or hybrid (both, fused with RRF); per request via "mode"
+RETRIEVAL_MODE = os.getenv("RAG_RETRIEVAL_MODE", "dense")
+
+# Golden queries (golden_queries.json) run against the live retriever this often; 0 disables.
+PROBE_INTERVAL_S = float(os.getenv("RAG_PROBE_INTERVAL_S", "60"))
+
+# Load the retriever and models in a background thread at startup and run one
+# dummy inference through each; /ready turns 200 when done, and /query answers
+# 503 until then instead of queueing behind the load. RAG_WARMUP=0 loads them on
+# the first /query instead.
+WARMUP = os.getenv("RAG_WARMUP", "1") != "0"
+WARMUP_RETRY_AFTER_S = 5
+
+# Model calls made from async endpoints run here, off the event loop.
+MODEL_EXECUTOR = ThreadPoolExecutor(max_workers=int(os.getenv("RAG_MODEL_WORKERS", "4")), thread_name_prefix="model")
+
+# seconds since api.py started importing, filled in as startup goes
+STARTUP = {"import_s": None, "bind_s": None, "ready_s": None, "warmup": {}, "error": None,
+           "first_query_s": None, "first_query_ms": None}
+READY = threading.Event()
+WARMUP_THREAD = None
+
+# read at scrape time
+metrics.gauge("rag_batcher_pending", "Items waiting for a micro-batch.", lambda: [
+    ({"batcher": b.name}, b.stats()["pending"]) for b in (SEARCH_BATCHER, HEAL_BATCHER) if b is not None
+])
+metrics.gauge("rag_models_loaded_mb", "Weights of the models held by the model registry.", lambda: [
+    ({}, REGISTRY.stats()["total_mb"])
+])
 
 def get_retriever():
-    global RETRIEVER, HEALER
+    global RETRIEVER, HEALER, SEARCH_BATCHER, HEAL_BATCHER, PROBE
     with RETRIEVER_LOCK:
         if RETRIEVER is None:
-            RETRIEVER = Retriever(top_k=3)
+            from retriever import Retriever
+            RETRIEVER = Retriever(top_k=3, mode=RETRIEVAL_MODE)
         if HEALER is None:
-            HEALER = DetectorHealer()
+            HEALER = DetectorHealer(grounding=GroundingScorer(
+                RETRIEVER.embedder,
+                supported=GROUNDED_THRESHOLD,
+                unsupported=UNGROUNDED_THRESHOLD
+            ), detect_mode=DETECT_MODE, threshold=HALLUCINATION_THRESHOLD)
+        if SEARCH_BATCHER is None:
+            retriever = RETRIEVER
+            SEARCH_BATCHER = MicroBatcher(
+                lambda items: _search_items(retriever, items),
+                max_batch_size=SEARCH_BATCH_SIZE,
+                max_wait_ms=SEARCH_BATCH_WAIT_MS,
+                name="search"
+            )
+        if HEAL_BATCHER is None:
+            healer = HEALER
+            HEAL_BATCHER = MicroBatcher(
+                lambda items: healer.run_batch(*[list(col) for col in zip(*items)]),
+                max_batch_size=HEAL_BATCH_SIZE,
+                max_wait_ms=HEAL_BATCH_WAIT_MS,
+                name="detect_heal"
+            )
+        if PROBE is None and PROBE_INTERVAL_S > 0:
+            batcher = SEARCH_BATCHER
+            PROBE = RetrievalProbe(
+                RETRIEVER,
+                search=lambda q, k: batcher((q, k, None, None)),
+                interval_s=PROBE_INTERVAL_S
+            ).start()
+    if not warming_up():
+        # loaded on demand (warm-up off, or failed and retried by a request)
+        READY.set()
     return RETRIEVER, HEALER
 
+# -------------------------
+# Warm-up
+# -------------------------
+def _timed(fn):
+    t = time.perf_counter()
+    fn()
+    return round(time.perf_counter() - t, 3)
+
+def _warm_retriever():
+    retriever, _ = get_retriever()
+    retriever.search("warm-up", top_k=1)
+
+def warm_up():
+    """
+    Load the retriever (index + embedder) and flan-t5 side by side, run one
+    dummy search and one one-token generation, then mark the API ready.
+    """
+    try:
+        with ThreadPoolExecutor(max_workers=1, thread_name_prefix="warmup") as pool:
+            # flan-t5 is the slowest load by far and needs nothing from the retriever
+            generator = pool.submit(_timed, DetectorHealer().warm_up)
+            STARTUP["warmup"]["retriever_s"] = _timed(_warm_retriever)
+            STARTUP["warmup"]["generator_s"] = generator.result()
+    except Exception as e:
+        STARTUP["error"] = f"{type(e).__name__}: {e}"
+        print("[api] Warm-up failed, models will load on the first /query:", STARTUP["error"])
+        return
+    STARTUP["ready_s"] = round(time.perf_counter() - _T_IMPORT, 3)
+    READY.set()
+    print(f"[api] Cold start: imports {STARTUP['import_s']}s, bound after {STARTUP['bind_s']}s, "
+          f"ready after {STARTUP['ready_s']}s (retriever {STARTUP['warmup']['retriever_s']}s, "
+          f"generator {STARTUP['warmup']['generator_s']}s)")
+
+def start_warm_up():
+    global WARMUP_THREAD
+    WARMUP_THREAD = threading.Thread(target=warm_up, daemon=True, name="warmup")
+    WARMUP_THREAD.start()
+
+def warming_up():
+    return WARMUP_THREAD is not None and WARMUP_THREAD.is_alive()
+
+def _record_first_query(t0):
+    if STARTUP["first_query_ms"] is None:
+        STARTUP["first_query_ms"] = round((time.perf_counter() - t0) * 1000.0, 1)
+        STARTUP["first_query_s"] = round(time.perf_counter() - _T_IMPORT, 3)
+        print(f"[api] First /query took {STARTUP['first_query_ms']}ms, {STARTUP['first_query_s']}s after start")
+
+def _check_query(mode):
+    if warming_up() and not READY.is_set():
+        raise HTTPException(status_code=503, detail="Models are still loading, see /ready",
+                            headers={"Retry-After": str(WARMUP_RETRY_AFTER_S)})
+    from retriever import MODES
+    if mode is not None and mode not in MODES:
+        raise HTTPException(status_code=400, detail=f"mode must be one of {MODES}")
+
+def _search_items(retriever, items):
+    """
+    Search (question, top_k, mode, filters) items, one search_batch call
+    per distinct mode and filters. A bad filter only fails its own group.
+    """
+    results = [None] * len(items)
+    groups = {}
+    for i, (_, _, mode, filters) in enumerate(items):
+        groups.setdefault((mode, json.dumps(filters, sort_keys=True)), []).append(i)
+    for (mode, _), idxs in groups.items():
+        try:
+            found = retriever.search_batch([items[i][0] for i in idxs], [items[i][1] for i in idxs],
+                                           mode=mode, filters=items[idxs[0]][3])
+        except ValueError as e:
+            found = [e] * len(idxs)
+        for i, r in zip(idxs, found):
+            results[i] = r
+    return results
+
 # -------------------------
 # Request / response models
 # -------------------------
 class QueryRequest(BaseModel):
     question: str
-    top_k: int = 3
+    top_k: int = Field(3, gt=0, le=MAX_TOP_K)
+    mode: Optional[str] = None  # dense, sparse or hybrid; defaults to RAG_RETRIEVAL_MODE
+    # e.g. {"doc_id": ["3", "7"]} or {"title": "Release notes"}; values OR-ed, fields AND-ed
+    filters: Optional[Dict[str, Any]] = None
+    timings: bool = False  # include per-stage milliseconds in the response
 
 class QueryResponse(BaseModel):
     question: str
@@ -53,11 +239,23 @@ class QueryResponse(BaseModel):
     final_answer: str
     healed: bool
     heal_reason: Optional[str] = ""  # Fixed for Pydantic v2
+    # sentences rewritten by a partial heal; null when the whole answer was rewritten
+    replaced_sentences: Optional[List[Dict[str, Any]]] = []
+    # chunks best first. "score_kind" says what "score" is: l2_distance (dense on an
+    # L2 index, lower is better), or inner_product (dense), bm25 (sparse) or rrf
+    # (hybrid), which are higher-is-better and on different scales
     retrieved: List[Dict[str, Any]] = []
+    # tokens / chunks of the retrieved context used in the answer prompt vs dropped
+    context: Optional[Dict[str, Any]] = None
+    # stage -> ms; stages batched with other requests report their wait for the batch
+    timings: Optional[Dict[str, float]] = None
 
 class ReindexRequest(BaseModel):
     embedding_model: str = "sentence-transformers/all-MiniLM-L6-v2"
 
+class RollbackRequest(BaseModel):
+    tag: str
+
 # -------------------------
 # Endpoints
 # -------------------------
@@ -67,59 +265,242 @@ def root():
 
 @app.get("/health")
 def health():
-    return {"status": "ok", "ts": time.strftime("%Y%m%dT%H%M%S")}
+    """Liveness: answers as soon as the server is up, models loaded or not."""
+    return {
+        "status": "ok",
+        "ts": time.strftime("%Y%m%dT%H%M%S"),
+        "index_version": RETRIEVER.version if RETRIEVER is not None else None
+    }
+
+@app.get("/ready")
+def ready():
+    """Readiness: 200 once the models are loaded and warmed up, 503 before (or if warm-up failed)."""
+    body = {"ready": READY.is_set(), "warming_up": warming_up(), **STARTUP}
+    if not body["ready"]:
+        return JSONResponse(status_code=503, content=body)
+    return body
 
 @app.post("/query", response_model=QueryResponse)
 def query(req: QueryRequest):
+    t0 = time.perf_counter()
+    _check_query(req.mode)
     retriever, healer = get_retriever()
-    retriever.top_k = req.top_k
 
-    # Retrieve documents
-    retrieved = retriever.search(req.question)
+    with metrics.collect_timings() as timings:
+        with metrics.span("query"):
+            response = _answer(req, healer)
+    if req.timings:
+        response["timings"] = {stage: round(ms, 3) for stage, ms in timings.items()}
+    _record_first_query(t0)
+    return response
+
+def _answer(req, healer):
+    # Retrieve documents (batched with concurrent requests)
+    try:
+        with metrics.span("retrieve"):
+            retrieved = SEARCH_BATCHER((req.question, req.top_k, req.mode, req.filters))
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
     if not retrieved:
         raise HTTPException(status_code=404, detail="No relevant documents found")
 
-    # Generate raw answer
+    # Generate raw answer from the chunks that fit in the model's window
+    context, packing = healer.fit_context(req.question, retrieved)
     try:
-        raw = healer.generate_answer(req.question, "\n\n".join([r["chunk"] for r in retrieved]))
+        raw = healer.generate_answer(req.question, context)
     except AttributeError:
         raw = " ".join([r["chunk"] for r in retrieved])[:400]
 
-    # Run detector/healer
-    result = healer.run(
-        req.question,
-        raw,
-        [{"chunk": r["chunk"], "title": r["title"], "doc_id": r["doc_id"], "score": r["score"]} for r in retrieved]
-    )
+    # Run detector/healer (batched with concurrent requests)
+    with metrics.span("detect_heal"):
+        result = HEAL_BATCHER((
+            req.question,
+            raw,
+            [{"chunk": r["chunk"], "title": r["title"], "doc_id": r["doc_id"], "score": r["score"],
+              "n_tokens": r.get("n_tokens")} for r in retrieved]
+        ))
 
-    response = {
+    return {
         "question": req.question,
         "raw_answer": raw,
         "final_answer": result.get("final_answer", raw),
         "healed": result.get("hallucinated", False),
         "heal_reason": result.get("reason", ""),
-        "retrieved": retrieved
+        "replaced_sentences": result.get("replaced_sentences", []),
+        "retrieved": retrieved,
+        "context": packing
     }
-    return response
 
-@app.post("/reindex")
-def reindex(req: ReindexRequest):
-    def _do_reindex(model_name):
+def _swap_in(tag):
+    # a retriever that is not loaded yet will pick up the new files itself
+    if RETRIEVER is not None:
+        from reindexer import INDEX_OUT, META_OUT, SPARSE_OUT, ATTR_OUT
+        RETRIEVER.reload(INDEX_OUT, META_OUT, version=tag, sparse_file=SPARSE_OUT, attr_file=ATTR_OUT)
+
+def _run_index_job(name, job):
+    def _do():
+        try:
+            with INDEX_JOB_LOCK:
+                job()
+        except Exception as e:
+            print(f"[{name}] error:", e)
+
+    threading.Thread(target=_do, daemon=True).start()
+
+def _sse(event, data):
+    return f"event: {event}\ndata: {json.dumps(data)}\n\n"
+
+@app.post("/query/stream")
+async def query_stream(req: QueryRequest, request: Request):
+    """
+    Same pipeline as /query, streamed as server-sent events as each stage
+    finishes: retrieved, token (repeated), answer, verdict, healed (only
+    if the answer was flagged) and done with the full response. A failing
+    stage ends the stream with an error event instead; generation stops
+    when the client disconnects.
+    """
+    _check_query(req.mode)
+    loop = asyncio.get_running_loop()
+    retriever, healer = await loop.run_in_executor(MODEL_EXECUTOR, get_retriever)
+
+    async def events():
         try:
-            build_index(embedding_model=model_name)
+            retrieved = await loop.run_in_executor(MODEL_EXECUTOR, SEARCH_BATCHER,
+                                                   (req.question, req.top_k, req.mode, req.filters))
+        except ValueError as e:
+            yield _sse("error", {"detail": str(e)})
+            return
+        yield _sse("retrieved", retrieved)
+        if not retrieved:
+            yield _sse("error", {"detail": "No relevant documents found"})
+            return
+
+        stop = threading.Event()
+        try:
+            # Stream raw answer tokens from the generator thread
+            context, packing = await loop.run_in_executor(MODEL_EXECUTOR, healer.fit_context, req.question, retrieved)
+            queue = asyncio.Queue()
+
+            def produce():
+                try:
+                    for piece in healer.generate_answer_stream(req.question, context, stop=stop):
+                        loop.call_soon_threadsafe(queue.put_nowait, piece)
+                finally:
+                    loop.call_soon_threadsafe(queue.put_nowait, None)
+
+            producer = loop.run_in_executor(MODEL_EXECUTOR, produce)
+            pieces = []
+            while (piece := await queue.get()) is not None:
+                if await request.is_disconnected():
+                    print("[api] /query/stream client disconnected, stopping generation")
+                    return
+                pieces.append(piece)
+                yield _sse("token", {"text": piece})
+            await producer
+            raw = "".join(pieces).strip()
+            yield _sse("answer", {"raw_answer": raw})
+
+            # Detect, then heal only if needed
+            chunks = [{"chunk": r["chunk"], "title": r["title"], "doc_id": r["doc_id"], "score": r["score"],
+                       "n_tokens": r.get("n_tokens")} for r in retrieved]
+            verdict = await loop.run_in_executor(MODEL_EXECUTOR, healer.detect_problem, raw, chunks)
+            yield _sse("verdict", verdict)
+            metrics.ANSWERS.inc(outcome="healed" if verdict["hallucination"] else "passed")
+
+            final, replaced = raw, []
+            if verdict["hallucination"]:
+                healed = await loop.run_in_executor(MODEL_EXECUTOR, healer.repair, req.question, raw, chunks)
+                final, replaced = healed["final_answer"], healed["replaced_sentences"]
+                yield _sse("healed", healed)
         except Exception as e:
-            print("[reindex] error:", e)
+            print("[api] /query/stream error:", e)
+            yield _sse("error", {"detail": f"{type(e).__name__}: {e}"})
+            return
+        finally:
+            # also reached when the response is cancelled on disconnect
+            stop.set()
+
+        yield _sse("done", {
+            "question": req.question,
+            "raw_answer": raw,
+            "final_answer": final,
+            "healed": bool(verdict["hallucination"]),
+            "heal_reason": verdict["reason"] if verdict["hallucination"] else None,
+            "replaced_sentences": replaced,
+            "retrieved": retrieved,
+            "context": packing
+        })
+
+    return StreamingResponse(events(), media_type="text/event-stream")
 
-    threading.Thread(target=_do_reindex, args=(req.embedding_model,), daemon=True).start()
+@app.post("/reindex")
+def reindex(req: ReindexRequest):
+    from reindexer import build_index
+    from retriever import EMBED_MODEL
+    if req.embedding_model != EMBED_MODEL:
+        # the live files would be replaced by an index the retriever cannot query
+        raise HTTPException(status_code=400, detail=f"the retriever embeds queries with {EMBED_MODEL}; "
+                                                    f"reindexing with {req.embedding_model} would break search")
+    _run_index_job("reindex", lambda: _swap_in(build_index(embedding_model=req.embedding_model)))
     return {"status": "reindex_started", "embedding_model": req.embedding_model}
 
+@app.post("/rollback")
+def rollback(req: RollbackRequest):
+    if not any(v["tag"] == req.tag for v in list_versions()):
+        raise HTTPException(status_code=404, detail=f"Unknown version {req.tag}")
+
+    def _do_rollback():
+        from reindexer import extra_paths, INDEX_OUT, META_OUT
+        if rollback_to(req.tag, INDEX_OUT, META_OUT, extra_paths=extra_paths(req.tag)):
+            _swap_in(req.tag)
+
+    _run_index_job("rollback", _do_rollback)
+    return {"status": "rollback_started", "tag": req.tag}
+
+@app.post("/reload")
+def reload():
+    """Swap in index files changed outside the API (e.g. manage.py --reindex)."""
+    _run_index_job("reload", lambda: _swap_in(None))
+    return {"status": "reload_started"}
+
 @app.get("/monitor")
 def monitor():
+    """Latest probe snapshot and monitor report; nothing is recomputed here."""
+    from monitor import REPORT_FILE
     try:
-        report = run_monitor_sample()
-        return report
+        report = json.loads(open(REPORT_FILE, encoding="utf-8").read()) if os.path.exists(REPORT_FILE) else None
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
+    return {"probe": PROBE.snapshot() if PROBE is not None else None, "report": report}
+
+@app.post("/monitor/run")
+def monitor_run():
+    """Recompute the monitor report (schema, duplicates, retrieval health) in the background."""
+    from monitor import run_monitor_sample
+    _check_query(None)
+    retriever, _ = get_retriever()
+    _run_index_job("monitor", lambda: run_monitor_sample(retriever=retriever))
+    return {"status": "monitor_started"}
+
+@app.get("/stats")
+def stats():
+    out = {}
+    if SEARCH_BATCHER is not None:
+        out["search_batcher"] = SEARCH_BATCHER.stats()
+    if HEAL_BATCHER is not None:
+        out["heal_batcher"] = HEAL_BATCHER.stats()
+    if HEALER is not None and HEALER.grounding is not None:
+        out["detection_tiers"] = HEALER.grounding.stats()
+    if RETRIEVER is not None:
+        out["embedding_cache"] = RETRIEVER.embedder.cache.stats()
+        out["retrieval_legs"] = RETRIEVER.leg_stats()
+    out["models"] = REGISTRY.stats()
+    return out
+
+@app.get("/metrics", response_class=PlainTextResponse)
+def metrics_endpoint():
+    """Stage latency histograms, answer / detection / token counters and batcher gauges for Prometheus."""
+    return PlainTextResponse(metrics.render(), media_type="text/plain; version=0.0.4")
 
 @app.get("/history")
 def history():
@@ -127,4 +508,5 @@ def history():
         return {"versions": list_versions()}
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
-'''
+
+STARTUP["import_s"] = round(time.perf_counter() - _T_IMPORT, 3)
@@ -1,7 +1,6 @@
 import streamlit as st
 from retriever import Retriever
 from detector_healer import DetectorHealer
-from transformers import pipeline
 
 # ----------------------------------------
 # LOAD MODULES
@@ -10,35 +9,18 @@ from transformers import pipeline
 def load_system():
     retriever = Retriever(top_k=3)
     healer = DetectorHealer()
-    generator = pipeline(
-        "text2text-generation",
-        model="google/flan-t5-large",
-        max_new_tokens=300
-    )
-    return retriever, healer, generator
+    return retriever, healer
 
-retriever, healer, generator = load_system()
+retriever, healer = load_system()
 
 # ----------------------------------------
 # RAG ANSWER GENERATION
 # ----------------------------------------
 def generate_answer(question, retrieved_chunks):
-    context = "\n\n".join([chunk["chunk"] for chunk in retrieved_chunks])
-
-    prompt = f"""
-Answer the user's question using ONLY the provided context.
-Do NOT hallucinate. If the answer is not present, say "Information not found".
-
-QUESTION:
-{question}
-
-CONTEXT:
-{context}
-
-ANSWER:
-"""
-    output = generator(prompt)[0]["generated_text"]
-    return output.strip()
+    # best chunks that fit in flan-t5's input window next to ANSWER_PROMPT,
+    # the prompt healer.generate_answer sends
+    context, _ = healer.fit_context(question, retrieved_chunks)
+    return healer.generate_answer(question, context)
 
 # ----------------------------------------
 # STREAMLIT UI
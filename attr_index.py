@@ -0,0 +1,77 @@
+# attr_index.py
+import os
+import json
+import time
+from array import array
+from pathlib import Path
+import numpy as np
+
+ATTR_FILE = "attr_index.npz"
+ATTR_FIELDS = ("doc_id", "title")
+
+def build_attributes(records, path=ATTR_FILE, fields=ATTR_FIELDS):
+    """
+    Build an inverted index from metadata values to FAISS ids over chunk
+    records (dicts with id and the given fields), e.g. a ChunkStore, and
+    write it to path.
+
+    For each field the ids with value values[v] are
+    ids[ptr[v]:ptr[v + 1]], sorted ascending.
+    """
+    t0 = time.perf_counter()
+    postings = {f: {} for f in fields}
+    for r in records:
+        for f in fields:
+            # values are matched as strings, so doc_id 3 and "3" are the same
+            postings[f].setdefault(str(r.get(f, "")), array("q")).append(int(r["id"]))
+
+    arrays = {}
+    for f, by_value in postings.items():
+        values = sorted(by_value)
+        ptr = np.zeros(len(values) + 1, dtype="int64")
+        np.cumsum([len(by_value[v]) for v in values], out=ptr[1:])
+        ids = [np.sort(np.frombuffer(by_value[v], dtype="int64")) for v in values]
+        arrays[f"{f}__values"] = np.frombuffer(json.dumps(values).encode("utf-8"), dtype="uint8")
+        arrays[f"{f}__ptr"] = ptr
+        arrays[f"{f}__ids"] = np.concatenate(ids) if ids else np.zeros(0, dtype="int64")
+
+    tmp = f"{path}.tmp"
+    with open(tmp, "wb") as f:
+        np.savez(f, **arrays)
+    os.replace(tmp, path)
+    sizes = ", ".join(f"{len(v)} {f} values" for f, v in postings.items())
+    print(f"[attr_index] Indexed {sizes} in {time.perf_counter() - t0:.1f}s")
+    return path
+
+class AttributeIndex:
+    """Resolves metadata filters to the sorted FAISS ids they allow."""
+
+    def __init__(self, path=ATTR_FILE):
+        self.path = Path(path)
+        self.fields = {}
+        with np.load(self.path) as z:
+            for name in z.files:
+                if not name.endswith("__values"):
+                    continue
+                f = name[:-len("__values")]
+                values = json.loads(z[name].tobytes().decode("utf-8"))
+                self.fields[f] = ({v: i for i, v in enumerate(values)}, z[f"{f}__ptr"], z[f"{f}__ids"])
+
+    def ids_for(self, filters):
+        """
+        Sorted ids matching filters, a {field: value or [values]} dict:
+        values of one field are OR-ed, fields are AND-ed. None when there
+        is nothing to filter on.
+        """
+        if not filters:
+            return None
+        allowed = None
+        for f, wanted in filters.items():
+            if f not in self.fields:
+                raise ValueError(f"cannot filter on '{f}', expected one of {sorted(self.fields)}")
+            positions, ptr, ids = self.fields[f]
+            wanted = wanted if isinstance(wanted, (list, tuple, set)) else [wanted]
+            parts = [ids[ptr[i]:ptr[i + 1]] for i in (positions.get(str(v)) for v in wanted) if i is not None]
+            matched = np.unique(np.concatenate(parts)) if parts else np.zeros(0, dtype="int64")
+            allowed = matched if allowed is None else np.intersect1d(allowed, matched, assume_unique=True)
+        return allowed
@@ -0,0 +1,117 @@
+# batcher.py
+import time
+import threading
+from collections import deque
+from concurrent.futures import Future
+
+class MicroBatcher:
+    """
+    Coalesce concurrent calls into batches.
+
+    Items submitted while a batch is forming are handed to handler(items)
+    together, once max_batch_size items are pending or max_wait_ms has
+    passed since the oldest one arrived. handler must return one result per
+    item; each caller gets its own result (or exception) back. Returning
+    an exception instance for an item fails only that caller.
+    A larger window buys throughput at the cost of added latency.
+    """
+
+    def __init__(self, handler, max_batch_size=16, max_wait_ms=5.0, name="batcher"):
+        self.handler = handler
+        self.max_batch_size = max_batch_size
+        self.max_wait_ms = max_wait_ms
+        self.name = name
+
+        self._queue = deque()
+        self._cond = threading.Condition()
+        self._closed = False
+
+        self._stats_lock = threading.Lock()
+        self.batches = 0
+        self.items = 0
+        self.max_seen = 0
+        self.batch_sizes = {}
+        self.wait_ms_total = 0.0
+        self.run_ms_total = 0.0
+
+        self._thread = threading.Thread(target=self._loop, name=name, daemon=True)
+        self._thread.start()
+
+    def submit(self, item):
+        fut = Future()
+        with self._cond:
+            if self._closed:
+                raise RuntimeError(f"{self.name} is closed")
+            self._queue.append((item, fut, time.perf_counter()))
+            self._cond.notify()
+        return fut
+
+    def __call__(self, item):
+        return self.submit(item).result()
+
+    def close(self):
+        with self._cond:
+            self._closed = True
+            self._cond.notify()
+        self._thread.join()
+
+    def _next_batch(self):
+        with self._cond:
+            while not self._queue and not self._closed:
+                self._cond.wait()
+            if not self._queue:
+                return None
+            deadline = self._queue[0][2] + self.max_wait_ms / 1000.0
+            while len(self._queue) < self.max_batch_size and not self._closed:
+                remaining = deadline - time.perf_counter()
+                if remaining <= 0:
+                    break
+                self._cond.wait(remaining)
+            n = min(len(self._queue), self.max_batch_size)
+            return [self._queue.popleft() for _ in range(n)]
+
+    def _loop(self):
+        while True:
+            batch = self._next_batch()
+            if batch is None:
+                return
+            start = time.perf_counter()
+            try:
+                results = self.handler([item for item, _, _ in batch])
+                if len(results) != len(batch):
+                    raise RuntimeError(f"{self.name}: handler returned {len(results)} results for {len(batch)} items")
+            except Exception as e:
+                for _, fut, _ in batch:
+                    fut.set_exception(e)
+                results = None
+            else:
+                for (_, fut, _), res in zip(batch, results):
+                    if isinstance(res, Exception):
+                        fut.set_exception(res)
+                    else:
+                        fut.set_result(res)
+            end = time.perf_counter()
+
+            with self._stats_lock:
+                self.batches += 1
+                self.items += len(batch)
+                self.max_seen = max(self.max_seen, len(batch))
+                self.batch_sizes[len(batch)] = self.batch_sizes.get(len(batch), 0) + 1
+                self.wait_ms_total += sum(start - t for _, _, t in batch) * 1000.0
+                self.run_ms_total += (end - start) * 1000.0
+
+    def stats(self):
+        with self._stats_lock:
+            return {
+                "name": self.name,
+                "max_batch_size": self.max_batch_size,
+                "max_wait_ms": self.max_wait_ms,
+                "pending": len(self._queue),
+                "batches": self.batches,
+                "items": self.items,
+                "avg_batch_size": self.items / self.batches if self.batches else 0.0,
+                "max_batch_seen": self.max_seen,
+                "batch_size_histogram": dict(sorted(self.batch_sizes.items())),
+                "avg_queue_wait_ms": self.wait_ms_total / self.items if self.items else 0.0,
+                "avg_batch_run_ms": self.run_ms_total / self.batches if self.batches else 0.0
+            }
@@ -0,0 +1,154 @@
+# bench_backends.py
+"""
+Compare inference backends (fp32 / int8 / onnx) for the embedder and the
+flan-t5 generator: load time, resident memory, latency and how closely the
+outputs agree with fp32. Each backend runs in a fresh process so memory
+numbers are not mixed up.
+
+    python bench_backends.py --models embedder,generator --backends fp32,int8,onnx
+"""
+import json
+import time
+import argparse
+import difflib
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+import numpy as np
+
+DATA_FILE = "data.jsonl"
+GOLDEN_FILE = "golden_queries.json"
+OUT_FILE = "bench_backends.json"
+
+def _rss_mb():
+    try:
+        with open("/proc/self/status") as f:
+            for line in f:
+                if line.startswith("VmRSS:"):
+                    return int(line.split()[1]) / 1024
+    except OSError:
+        pass
+    import resource
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+def _percentiles(samples):
+    ms = np.asarray(samples) * 1000.0
+    return {"p50_ms": float(np.percentile(ms, 50)), "p95_ms": float(np.percentile(ms, 95))}
+
+def sample_inputs(n):
+    """Chunk texts to embed and answer prompts to generate from, taken from the corpus."""
+    from reindexer import load_docs, chunk_text
+    from detector_healer import DetectorHealer
+    docs = load_docs(DATA_FILE)
+    texts = [c for d in docs for c in chunk_text(d["text"])]
+    texts = (texts * (n // max(1, len(texts)) + 1))[:n]
+    by_id = {str(d["id"]): d["text"] for d in docs}
+    with open(GOLDEN_FILE, "r", encoding="utf-8") as f:
+        golden = json.load(f)
+    healer = DetectorHealer()
+    prompts = []
+    for g in golden:
+        context = "\n\n".join(by_id[i] for i in g.get("expected_doc_ids", []) if i in by_id) or texts[0]
+        prompts.append(healer._answer_prompt(g["query"], context))
+    return texts, prompts[:n]
+
+def _run(kind, backend, texts, prompts):
+    """Runs in a spawned worker: load one model on one backend and time it."""
+    from model_registry import get_model
+    from retriever import EMBED_MODEL
+    from detector_healer import GEN_MODEL, MAX_NEW_TOKENS
+
+    rss0 = _rss_mb()
+    t = time.perf_counter()
+    if kind == "embedder":
+        model = get_model("sentence-embedding", EMBED_MODEL, backend=backend)
+    else:
+        model = get_model("text2text-generation", GEN_MODEL, backend=backend)
+    load_s = time.perf_counter() - t
+    model_mb = _rss_mb() - rss0
+
+    latencies = []
+    if kind == "embedder":
+        model.encode(texts[:4], show_progress_bar=False)  # warm-up
+        for text in texts:
+            t = time.perf_counter()
+            model.encode([text], show_progress_bar=False)
+            latencies.append(time.perf_counter() - t)
+        t = time.perf_counter()
+        outputs = np.asarray(model.encode(texts, batch_size=32, show_progress_bar=False), dtype="float32")
+        per_s = len(texts) / (time.perf_counter() - t)
+    else:
+        model(prompts[0], max_new_tokens=8)  # warm-up
+        outputs = []
+        for prompt in prompts:
+            t = time.perf_counter()
+            outputs.append(model(prompt, max_new_tokens=MAX_NEW_TOKENS)[0]["generated_text"].strip())
+            latencies.append(time.perf_counter() - t)
+        per_s = len(prompts) / sum(latencies)
+    return {
+        "model": kind,
+        "backend": backend,
+        "load_s": load_s,
+        "model_rss_mb": model_mb,
+        "peak_rss_mb": _rss_mb(),
+        **_percentiles(latencies),
+        "items_per_s": per_s,
+    }, outputs
+
+def agreement(kind, outputs, reference):
+    """How close a backend's outputs are to the fp32 ones."""
+    if kind == "embedder":
+        a = outputs / np.linalg.norm(outputs, axis=1, keepdims=True)
+        b = reference / np.linalg.norm(reference, axis=1, keepdims=True)
+        cos = (a * b).sum(axis=1)
+        return {"cosine_mean": float(cos.mean()), "cosine_min": float(cos.min())}
+    ratios = [difflib.SequenceMatcher(None, o, r).ratio() for o, r in zip(outputs, reference)]
+    return {
+        "exact_match": float(np.mean([o == r for o, r in zip(outputs, reference)])),
+        "similarity": float(np.mean(ratios))
+    }
+
+def run_benchmark(models=("embedder", "generator"), backends=("fp32", "int8", "onnx"), n=32):
+    texts, prompts = sample_inputs(n)
+    rows = []
+    ctx = multiprocessing.get_context("spawn")
+    for kind in models:
+        reference = None
+        for backend in ["fp32"] + [b for b in backends if b != "fp32"]:
+            print(f"[bench_backends] {kind} / {backend}...")
+            try:
+                # fresh process per backend so RSS is not shared between them
+                with ProcessPoolExecutor(max_workers=1, mp_context=ctx) as pool:
+                    row, outputs = pool.submit(_run, kind, backend, texts, prompts).result()
+            except Exception as e:
+                print(f"[bench_backends] {kind} / {backend} failed: {e}")
+                rows.append({"model": kind, "backend": backend, "error": str(e)})
+                continue
+            if backend == "fp32":
+                reference = outputs
+            if reference is not None:
+                row.update(agreement(kind, outputs, reference))
+            rows.append(row)
+    return rows
+
+def print_rows(rows):
+    for r in rows:
+        if "error" in r:
+            print(f"{r['model']:<10} {r['backend']:<5} error: {r['error']}")
+            continue
+        agree = " ".join(f"{k}={r[k]:.3f}" for k in ("cosine_mean", "cosine_min", "exact_match", "similarity") if k in r)
+        print(f"{r['model']:<10} {r['backend']:<5} load={r['load_s']:.1f}s rss={r['model_rss_mb']:.0f}MB "
+              f"p50={r['p50_ms']:.1f}ms p95={r['p95_ms']:.1f}ms {r['items_per_s']:.1f}/s {agree}")
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--models", default="embedder,generator")
+    parser.add_argument("--backends", default="fp32,int8,onnx")
+    parser.add_argument("--n", type=int, default=32, help="texts to embed / prompts to generate from")
+    parser.add_argument("--out", default=OUT_FILE)
+    args = parser.parse_args()
+
+    rows = run_benchmark(args.models.split(","), args.backends.split(","), args.n)
+    print_rows(rows)
+    with open(args.out, "w") as f:
+        json.dump(rows, f, indent=2)
+    print("[bench_backends] Results written to", args.out)
@@ -0,0 +1,106 @@
+# bench_detector.py
+"""
+Compare the LLM detector modes: yes/no logit scoring against JSON
+generation. Runs both on answers that are supported by their context
+(the context's own first sentence) and answers that are not (a sentence
+from another document). Reports latency per answer, throughput, agreement
+with the generate mode and accuracy against those labels at several
+thresholds, so RAG_HALLUCINATION_THRESHOLD can be set from it.
+
+    python bench_detector.py --n 64
+"""
+import json
+import time
+import argparse
+import numpy as np
+
+DATA_FILE = "data.jsonl"
+OUT_FILE = "bench_detector.json"
+THRESHOLDS = (0.3, 0.4, 0.5, 0.6, 0.7, 0.8)
+
+def _percentiles(samples):
+    ms = np.asarray(samples) * 1000.0
+    return {"p50_ms": float(np.percentile(ms, 50)), "p95_ms": float(np.percentile(ms, 95))}
+
+def sample_cases(n):
+    """[(answer, chunks, hallucinated)]: half supported by their chunks, half taken from another document."""
+    from reindexer import load_docs, chunk_text
+    from grounding import split_sentences
+    chunks = [c for d in load_docs(DATA_FILE) for c in chunk_text(d["text"])]
+    chunks = [c for c in chunks if split_sentences(c)]
+    if len(chunks) < 2:
+        raise ValueError(f"need at least two chunks in {DATA_FILE}")
+    cases = []
+    for i in range(n):
+        chunk = chunks[(i // 2) % len(chunks)]
+        if i % 2 == 0:
+            answer = split_sentences(chunk)[0]
+        else:
+            # a sentence from the chunk half the corpus away: fluent, but not in the context
+            answer = split_sentences(chunks[(i // 2 + len(chunks) // 2) % len(chunks)])[0]
+        cases.append((answer, [{"chunk": chunk}], i % 2 == 1))
+    return cases
+
+def _run(mode, cases, batch_size):
+    from detector_healer import DetectorHealer
+    healer = DetectorHealer(batch_size=batch_size, detect_mode=mode)
+    healer.warm_up()
+    latencies, verdicts = [], []
+    for answer, chunks, _ in cases:
+        t = time.perf_counter()
+        verdicts.append(healer.detect_problem(answer, chunks))
+        latencies.append(time.perf_counter() - t)
+    t = time.perf_counter()
+    healer.detect_batch([a for a, _, _ in cases], [c for _, c, _ in cases])
+    per_s = len(cases) / (time.perf_counter() - t)
+    return {"mode": mode, **_percentiles(latencies), "batched_per_s": per_s}, verdicts
+
+def run_benchmark(n=64, batch_size=8):
+    cases = sample_cases(n)
+    labels = np.array([h for _, _, h in cases])
+    print(f"[bench_detector] {len(cases)} answers, {int(labels.sum())} not supported by their context")
+
+    row_gen, gen = _run("generate", cases, batch_size)
+    flags_gen = np.array([bool(v["hallucination"]) for v in gen])
+    row_gen.update(
+        accuracy=float((flags_gen == labels).mean()),
+        parse_failures=sum(str(v.get("reason", "")).startswith("Parsing failed") for v in gen)
+    )
+
+    row_score, scored = _run("score", cases, batch_size)
+    probs = np.array([v["probability"] for v in scored])
+    row_score.update(
+        # mean squared error of the probability against the labels; lower is better calibrated
+        brier=float(((probs - labels) ** 2).mean()),
+        by_threshold=[{
+            "threshold": th,
+            "accuracy": float(((probs >= th) == labels).mean()),
+            "agreement": float(((probs >= th) == flags_gen).mean()),
+            "flagged": int((probs >= th).sum())
+        } for th in THRESHOLDS]
+    )
+    return [row_gen, row_score]
+
+def print_rows(rows):
+    for r in rows:
+        print(f"{r['mode']:<9} p50={r['p50_ms']:.1f}ms p95={r['p95_ms']:.1f}ms batched {r['batched_per_s']:.1f}/s", end="")
+        if r["mode"] == "generate":
+            print(f" accuracy={r['accuracy']:.3f} parse_failures={r['parse_failures']}")
+            continue
+        print(f" brier={r['brier']:.3f}")
+        for t in r["by_threshold"]:
+            print(f"  threshold={t['threshold']:.1f} accuracy={t['accuracy']:.3f} "
+                  f"agreement={t['agreement']:.3f} flagged={t['flagged']}")
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--n", type=int, default=64, help="answers to judge, half of them unsupported")
+    parser.add_argument("--batch-size", type=int, default=8)
+    parser.add_argument("--out", default=OUT_FILE)
+    args = parser.parse_args()
+
+    rows = run_benchmark(args.n, args.batch_size)
+    print_rows(rows)
+    with open(args.out, "w") as f:
+        json.dump(rows, f, indent=2)
+    print("[bench_detector] Results written to", args.out)
@@ -0,0 +1,9 @@
+"""
+Scalable benchmarks for indexing, retrieval and /query.
+
+    python -m benchmarks.run --docs 100000 --scenarios build,search,query
+
+corpus.py generates synthetic corpora, fakes.py provides deterministic
+offline stand-ins for the embedder and the LLM, run.py runs the scenarios
+and writes the results as JSON.
+"""
@@ -0,0 +1,68 @@
+# benchmarks/corpus.py
+import json
+import time
+import numpy as np
+
+VOCAB_SIZE = 50_000
+MEAN_WORDS = 300       # mean document length in words
+LENGTH_SIGMA = 0.8     # spread of the log-normal length distribution
+ZIPF_A = 1.1           # word frequency skew, roughly that of natural text
+
+def _vocab(size, rng):
+    # pronounceable fake words, so tokenizers and BM25 see realistic tokens
+    consonants = list("bcdfghjklmnprstvwz")
+    vowels = list("aeiou")
+    words = set()
+    while len(words) < size:
+        n = int(rng.integers(1, 5))
+        words.add("".join(rng.choice(consonants) + rng.choice(vowels) for _ in range(n)))
+    return np.asarray(sorted(words))
+
+def generate_corpus(path, n_docs, mean_words=MEAN_WORDS, length_sigma=LENGTH_SIGMA,
+                    vocab_size=VOCAB_SIZE, seed=0):
+    """
+    Write n_docs synthetic documents to a JSONL file in the data.jsonl
+    format. Document lengths are log-normal around mean_words and words
+    are drawn from a Zipf distribution over a generated vocabulary.
+    Returns the total number of words written.
+    """
+    t0 = time.perf_counter()
+    rng = np.random.default_rng(seed)
+    vocab = _vocab(vocab_size, rng)
+    # log-normal with the requested mean
+    mu = np.log(mean_words) - length_sigma ** 2 / 2
+    lengths = np.maximum(1, rng.lognormal(mu, length_sigma, n_docs).astype("int64"))
+    total = 0
+    with open(path, "w", encoding="utf-8") as f:
+        for i, n in enumerate(lengths):
+            ranks = np.minimum(rng.zipf(ZIPF_A, n), vocab_size) - 1
+            words = vocab[ranks]
+            # sentences of 8-20 words, so sentence splitting has something to do
+            cuts = np.cumsum(rng.integers(8, 21, n // 8 + 1))
+            sentences = [" ".join(s) for s in np.split(words, cuts[cuts < n]) if len(s)]
+            text = ". ".join(s.capitalize() for s in sentences) + "."
+            title = " ".join(vocab[np.minimum(rng.zipf(ZIPF_A, 3), vocab_size) - 1]).title()
+            f.write(json.dumps({"id": str(i), "title": title, "text": text}) + "\n")
+            total += int(n)
+    print(f"[benchmarks] Wrote {n_docs} docs ({total} words) to {path} in {time.perf_counter() - t0:.1f}s")
+    return total
+
+def sample_queries(path, n, words=(3, 10), seed=1):
+    """n queries made of short word runs taken from random documents of a corpus."""
+    rng = np.random.default_rng(seed)
+    with open(path, "rb") as f:
+        n_docs = sum(1 for _ in f)
+    picks = np.sort(rng.choice(n_docs, n))
+    queries = []
+    with open(path, "r", encoding="utf-8") as f:
+        # one pass over the file, however large it is
+        j = 0
+        for i, line in enumerate(f):
+            while j < n and picks[j] == i:
+                tokens = json.loads(line)["text"].replace(".", "").split()
+                m = int(rng.integers(words[0], words[1] + 1))
+                start = int(rng.integers(0, max(1, len(tokens) - m)))
+                queries.append(" ".join(tokens[start:start + m]))
+                j += 1
+    rng.shuffle(queries)
+    return queries
@@ -0,0 +1,131 @@
+# benchmarks/fakes.py
+import re
+import time
+import types
+import zlib
+import numpy as np
+
+_WORD_RE = re.compile(r"\w+")
+_SENTENCE_RE = re.compile(r"(?<=[.!?])\s+")
+
+class HashEmbedder:
+    """
+    Deterministic SentenceTransformer stand-in: signed feature hashing of
+    words and word bigrams into dim buckets, L2-normalised. Texts sharing
+    words get similar vectors, so retrieval results are meaningful, and
+    the same text always maps to the same vector on any machine.
+    """
+
+    def __init__(self, dim=384, latency_ms=0.0):
+        self.dim = dim
+        self.latency_ms = latency_ms  # simulated model cost per text
+
+    def get_sentence_embedding_dimension(self):
+        return self.dim
+
+    def _bucket(self, token):
+        h = zlib.crc32(token.encode("utf-8"))
+        return h % self.dim, 1.0 if (h >> 31) & 1 else -1.0
+
+    def encode(self, sentences, batch_size=32, show_progress_bar=False, convert_to_numpy=True, **kwargs):
+        single = isinstance(sentences, str)
+        texts = [sentences] if single else list(sentences)
+        out = np.zeros((len(texts), self.dim), dtype="float32")
+        for row, text in enumerate(texts):
+            words = _WORD_RE.findall(text.lower())
+            for token in words + [f"{a} {b}" for a, b in zip(words, words[1:])]:
+                col, sign = self._bucket(token)
+                out[row, col] += sign
+        out /= np.maximum(np.linalg.norm(out, axis=1, keepdims=True), 1e-12)
+        if self.latency_ms:
+            time.sleep(self.latency_ms * len(texts) / 1000.0)
+        return out[0] if single else out
+
+VOCAB_SIZE = 32128  # flan-t5's
+
+class _WhitespaceTokenizer:
+    """One hashed id per whitespace-separated word; return_tensors="pt" pads into torch tensors."""
+
+    def _ids(self, text):
+        return [zlib.crc32(w.encode("utf-8")) % (VOCAB_SIZE - 1) + 1 for w in text.split()]
+
+    def __call__(self, texts, return_tensors=None, max_length=None, **kwargs):
+        single = isinstance(texts, str)
+        ids = [self._ids(t)[:max_length] for t in ([texts] if single else texts)]
+        if return_tensors != "pt":
+            return {"input_ids": ids[0] if single else ids}
+        import torch
+        width = max(1, max(map(len, ids)))
+        return {
+            "input_ids": torch.tensor([i + [0] * (width - len(i)) for i in ids], dtype=torch.long),
+            "attention_mask": torch.tensor([[1] * len(i) + [0] * (width - len(i)) for i in ids], dtype=torch.long)
+        }
+
+class _FakeSeq2Seq:
+    """Forward pass for the detector's yes/no scoring: the first decoder step always favours "yes"."""
+
+    class config:
+        decoder_start_token_id = 0
+
+    def __init__(self, tokenizer):
+        self.yes = tokenizer("yes")["input_ids"][0]
+
+    def __call__(self, input_ids=None, decoder_input_ids=None, **kwargs):
+        import torch
+        logits = torch.zeros((input_ids.shape[0], decoder_input_ids.shape[1], VOCAB_SIZE))
+        logits[:, :, self.yes] = 4.0
+        return types.SimpleNamespace(logits=logits)
+
+class FakeLLM:
+    """
+    Deterministic text2text pipeline stand-in that recognises the
+    DetectorHealer prompts: answers and rewrites are the first sentence
+    of the context, detection always returns a "no hallucination" verdict
+    (as JSON, or as yes/no logits through .model). latency_ms is slept per
+    prompt to simulate generation cost.
+    """
+
+    def __init__(self, latency_ms=0.0):
+        self.latency_ms = latency_ms
+        self.tokenizer = _WhitespaceTokenizer()
+        self.model = _FakeSeq2Seq(self.tokenizer)
+
+    @staticmethod
+    def _section(prompt, header):
+        part = prompt.split(header, 1)[1] if header in prompt else prompt
+        return part.strip()
+
+    def _reply(self, prompt):
+        if "hallucination detector" in prompt:
+            return '{"hallucination": False, "reason": "supported by the context"}'
+        for header in ("RETRIEVED CONTEXT:", "CONTEXT:"):
+            if header in prompt:
+                context = self._section(prompt, header)
+                context = context.split("ANSWER:")[0].split("REWRITTEN SENTENCE:")[0].split("Return only")[0]
+                sentences = _SENTENCE_RE.split(context.strip())
+                return sentences[0] if sentences and sentences[0] else "Information not found"
+        return "Information not found"
+
+    def __call__(self, prompts, batch_size=1, **kwargs):
+        single = isinstance(prompts, str)
+        outputs = []
+        for prompt in [prompts] if single else prompts:
+            if self.latency_ms:
+                time.sleep(self.latency_ms / 1000.0)
+            outputs.append([{"generated_text": self._reply(prompt)}])
+        return outputs[0] if single else outputs
+
+def install_fakes(embed_latency_ms=0.0, llm_latency_ms=0.0):
+    """
+    Register the stand-ins (and the LLM's tokenizer, used for chunking) in
+    the model registry under the real model names, so build_index,
+    Retriever, DetectorHealer and the API pick them up without downloading
+    anything. Embeddings are cached by model name: only do this in a
+    scratch working directory.
+    """
+    from model_registry import REGISTRY
+    from retriever import EMBED_MODEL
+    from detector_healer import GEN_MODEL
+    REGISTRY.put("sentence-embedding", EMBED_MODEL, HashEmbedder(latency_ms=embed_latency_ms), pin=True)
+    llm = REGISTRY.put("text2text-generation", GEN_MODEL, FakeLLM(latency_ms=llm_latency_ms), pin=True)
+    REGISTRY.put("tokenizer", GEN_MODEL, llm.tokenizer, pin=True)
@@ -0,0 +1,243 @@
+# benchmarks/run.py
+"""
+End-to-end benchmark: build_index throughput, Retriever.search latency per
+top_k, peak RSS and /query throughput under concurrency, on a synthetic
+corpus. Everything runs in a scratch working directory with offline
+stand-in models unless --real-models is given.
+
+    python -m benchmarks.run --docs 100000 --scenarios build,search,query
+    python -m benchmarks.run --docs 1000000 --index-type ivf --scenarios build,search
+"""
+import os
+import sys
+import json
+import time
+import shutil
+import argparse
+import platform
+import importlib.util
+import resource
+import tempfile
+import subprocess
+from pathlib import Path
+from concurrent.futures import ThreadPoolExecutor
+import numpy as np
+
+REPO_DIR = Path(__file__).resolve().parents[1]
+RESULTS_DIR = REPO_DIR / "benchmarks" / "results"
+SCENARIOS = ("build", "search", "query")
+TOP_KS = (1, 5, 10, 50)
+CONCURRENCY = (1, 8, 32)
+
+# the repo modules resolve their files against the working directory
+sys.path.insert(0, str(REPO_DIR))
+
+def rss_mb():
+    try:
+        with open("/proc/self/status") as f:
+            for line in f:
+                if line.startswith("VmRSS:"):
+                    return int(line.split()[1]) / 1024
+    except OSError:
+        pass
+    return peak_rss_mb()
+
+def peak_rss_mb():
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # kilobytes on Linux, bytes on macOS
+    return peak / 1024 / 1024 if sys.platform == "darwin" else peak / 1024
+
+def latency_stats(samples):
+    ms = np.asarray(samples) * 1000.0
+    return {
+        "n": len(ms),
+        "p50_ms": float(np.percentile(ms, 50)),
+        "p99_ms": float(np.percentile(ms, 99)),
+        "mean_ms": float(ms.mean())
+    }
+
+def _git_commit():
+    try:
+        return subprocess.check_output(["git", "rev-parse", "--short", "HEAD"], cwd=REPO_DIR,
+                                       stderr=subprocess.DEVNULL, text=True).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+# ------------------------------------------------
+# SCENARIOS
+# ------------------------------------------------
+def bench_build(index_type, batch_size, workers):
+    from reindexer import build_index
+    from chunk_store import load_chunks
+    rss0 = rss_mb()
+    t = time.perf_counter()
+    build_index(index_type=index_type, batch_size=batch_size, workers=workers)
+    elapsed = time.perf_counter() - t
+    n_chunks = len(load_chunks())
+    return {
+        "index_type": index_type,
+        "n_chunks": n_chunks,
+        "seconds": elapsed,
+        "chunks_per_s": n_chunks / elapsed,
+        "index_mb": os.path.getsize("vector.index") / 1e6,
+        "rss_delta_mb": rss_mb() - rss0,
+        "peak_rss_mb": peak_rss_mb()
+    }
+
+def bench_search(queries, top_ks, nprobe=None, ef_search=None):
+    from retriever import Retriever
+    from index_factory import index_kind
+    retriever = Retriever(nprobe=nprobe, ef_search=ef_search)
+    retriever.search(queries[0])  # warm-up
+    rows = []
+    per_k = len(queries) // len(top_ks)
+    for n, k in enumerate(top_ks):
+        # fresh queries per top_k, so the embedding cache does not flatter later rows
+        latencies = []
+        for q in queries[n * per_k:(n + 1) * per_k]:
+            t = time.perf_counter()
+            retriever.search(q, top_k=k)
+            latencies.append(time.perf_counter() - t)
+        rows.append({"top_k": k, **latency_stats(latencies)})
+    return {"index": index_kind(retriever.index), "ntotal": int(retriever.index.ntotal), "by_top_k": rows,
+            "peak_rss_mb": peak_rss_mb()}
+
+def bench_query(queries, concurrency, top_k=3):
+    # no background probe: it would compete with the measured requests
+    os.environ.setdefault("RAG_PROBE_INTERVAL_S", "0")
+    from fastapi.testclient import TestClient
+    import api
+
+    rows = []
+    with TestClient(api.app) as client:
+        # the models load in the background warm-up; /query answers 503 until it is done
+        while api.warming_up():
+            time.sleep(0.05)
+        client.post("/query", json={"question": queries[0], "top_k": top_k})
+        startup = dict(api.STARTUP)
+        per_level = len(queries) // len(concurrency)
+        for n, c in enumerate(concurrency):
+            batch = queries[n * per_level:(n + 1) * per_level]
+            errors = []
+
+            def one(q):
+                t = time.perf_counter()
+                resp = client.post("/query", json={"question": q, "top_k": top_k})
+                if resp.status_code != 200:
+                    errors.append(resp.status_code)
+                return time.perf_counter() - t
+
+            t = time.perf_counter()
+            with ThreadPoolExecutor(max_workers=c) as pool:
+                latencies = list(pool.map(one, batch))
+            elapsed = time.perf_counter() - t
+            rows.append({
+                "concurrency": c,
+                "requests_per_s": len(batch) / elapsed,
+                "errors": len(errors),
+                **latency_stats(latencies)
+            })
+        batchers = {name: b.stats() for name, b in (("search", api.SEARCH_BATCHER), ("detect_heal", api.HEAL_BATCHER))
+                    if b is not None}
+    return {"startup": startup, "by_concurrency": rows, "batchers": batchers, "peak_rss_mb": peak_rss_mb()}
+
+# ------------------------------------------------
+# RUN
+# ------------------------------------------------
+def run(args):
+    from benchmarks.corpus import generate_corpus, sample_queries
+
+    workdir = Path(args.workdir or tempfile.mkdtemp(prefix="rag_bench_")).resolve()
+    workdir.mkdir(parents=True, exist_ok=True)
+    out_path = Path(args.out).resolve() if args.out else RESULTS_DIR / f"{time.strftime('%Y%m%dT%H%M%S')}.json"
+    os.chdir(workdir)
+    print("[benchmarks] Working directory:", workdir)
+
+    if not args.real_models:
+        from benchmarks.fakes import install_fakes
+        install_fakes(args.embed_latency_ms, args.llm_latency_ms)
+        if importlib.util.find_spec("torch") is None:
+            # the logit-scored detector runs a torch forward pass, even on the stand-in
+            print("[benchmarks] torch is not installed, using the generate detector mode")
+            os.environ.setdefault("RAG_DETECT_MODE", "generate")
+        if args.workers > 1:
+            # worker processes would load the real embedder
+            print("[benchmarks] --workers needs --real-models, embedding in-process")
+            args.workers = 1
+
+    result = {
+        "meta": {
+            "ts": time.strftime("%Y-%m-%dT%H:%M:%S"),
+            "commit": _git_commit(),
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "cpus": os.cpu_count(),
+            "models": "real" if args.real_models else "fake",
+            "docs": args.docs,
+            "mean_words": args.mean_words,
+            "index_type": args.index_type,
+            "seed": args.seed
+        }
+    }
+    scenarios = args.scenarios.split(",")
+    if "build" in scenarios or not os.path.exists("vector.index"):
+        t = time.perf_counter()
+        result["meta"]["words"] = generate_corpus("data.jsonl", args.docs, mean_words=args.mean_words, seed=args.seed)
+        result["meta"]["corpus_s"] = time.perf_counter() - t
+        result["build"] = bench_build(args.index_type, args.batch_size, args.workers)
+    top_ks = [int(k) for k in args.top_k.split(",")]
+    concurrency = [int(c) for c in args.concurrency.split(",")]
+    if "search" in scenarios:
+        queries = sample_queries("data.jsonl", args.queries * len(top_ks), seed=args.seed + 1)
+        result["search"] = bench_search(queries, top_ks, args.nprobe, args.ef_search)
+    if "query" in scenarios:
+        queries = sample_queries("data.jsonl", args.queries * len(concurrency), seed=args.seed + 2)
+        result["query"] = bench_query(queries, concurrency)
+    result["meta"]["peak_rss_mb"] = peak_rss_mb()
+
+    out_path.parent.mkdir(parents=True, exist_ok=True)
+    with open(out_path, "w") as f:
+        json.dump(result, f, indent=2)
+    print_result(result)
+    print("[benchmarks] Results written to", out_path)
+    if not args.keep and not args.workdir:
+        os.chdir(REPO_DIR)
+        shutil.rmtree(workdir, ignore_errors=True)
+    return result
+
+def print_result(result):
+    if "build" in result:
+        b = result["build"]
+        print(f"build   {b['index_type']:<6} {b['n_chunks']} chunks in {b['seconds']:.1f}s "
+              f"({b['chunks_per_s']:.0f} chunks/s), index {b['index_mb']:.0f}MB")
+    for r in result.get("search", {}).get("by_top_k", []):
+        print(f"search  top_k={r['top_k']:<4} p50={r['p50_ms']:.2f}ms p99={r['p99_ms']:.2f}ms")
+    if "query" in result:
+        s = result["query"]["startup"]
+        print(f"startup ready after {s['ready_s']}s, first /query {s['first_query_ms']}ms")
+    for r in result.get("query", {}).get("by_concurrency", []):
+        print(f"query   c={r['concurrency']:<4} {r['requests_per_s']:.1f} req/s p50={r['p50_ms']:.1f}ms "
+              f"p99={r['p99_ms']:.1f}ms errors={r['errors']}")
+    print(f"peak RSS {result['meta']['peak_rss_mb']:.0f}MB")
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--docs", type=int, default=10_000)
+    parser.add_argument("--mean-words", type=int, default=300, help="mean document length (log-normal)")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--scenarios", default=",".join(SCENARIOS))
+    parser.add_argument("--index-type", default="flat")
+    parser.add_argument("--batch-size", type=int, default=256)
+    parser.add_argument("--workers", type=int, default=1, help="embedding processes (real models only)")
+    parser.add_argument("--queries", type=int, default=200, help="queries per top_k / concurrency level")
+    parser.add_argument("--top-k", default=",".join(map(str, TOP_KS)))
+    parser.add_argument("--concurrency", default=",".join(map(str, CONCURRENCY)))
+    parser.add_argument("--nprobe", type=int)
+    parser.add_argument("--ef-search", type=int)
+    parser.add_argument("--real-models", action="store_true", help="download and use the real embedder / LLM")
+    parser.add_argument("--embed-latency-ms", type=float, default=0.0, help="simulated cost per embedded text")
+    parser.add_argument("--llm-latency-ms", type=float, default=0.0, help="simulated cost per generation")
+    parser.add_argument("--workdir", help="reuse this directory (and its index) instead of a temporary one")
+    parser.add_argument("--keep", action="store_true", help="keep the temporary working directory")
+    parser.add_argument("--out", help="results file (default benchmarks/results/<timestamp>.json)")
+    run(parser.parse_args())
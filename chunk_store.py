@@ -0,0 +1,205 @@
+# chunk_store.py
+import os
+import json
+import struct
+from pathlib import Path
+import numpy as np
+
+META_FILE = "chunks.bin"
+LEGACY_META_FILE = "metadata.json"
+
+MAGIC = b"RAGCHNK1"
+# magic, record count, byte offset of the id/offset tables
+HEADER = struct.Struct("<8sQQ")
+
+class ChunkStoreWriter:
+    """
+    Stream chunk records into a chunk store.
+
+    File layout:
+      header | record blob | ids (int64 x n) | offsets (uint64 x n+1)
+    Each record is compact JSON; record i spans blob[offsets[i]:offsets[i+1]].
+    Records must be added in increasing id order so readers can binary
+    search the id table. The ids/offsets are spooled to side files, so
+    memory use does not grow with the number of records. The store is
+    written under a temporary name and moved into place on close().
+
+    checkpoint() returns a state from which a new writer can resume the
+    same partial store after a crash.
+    """
+
+    def __init__(self, path, state=None):
+        self.path = Path(path)
+        self.tmp_path = self.path.with_name(self.path.name + ".tmp")
+        self.ids_path = self.path.with_name(self.path.name + ".tmp.ids")
+        self.offsets_path = self.path.with_name(self.path.name + ".tmp.offsets")
+        if state is None:
+            self.f = open(self.tmp_path, "w+b")
+            self.f.write(HEADER.pack(MAGIC, 0, 0))
+            self.ids = open(self.ids_path, "w+b")
+            self.offsets = open(self.offsets_path, "w+b")
+            self.offsets.write(np.uint64(0).tobytes())
+            self.n, self.pos, self.last_id = 0, 0, None
+        else:
+            # drop anything written after the checkpoint
+            self.n, self.pos, self.last_id = state["n"], state["pos"], state["last_id"]
+            self.f = self._reopen(self.tmp_path, HEADER.size + self.pos)
+            self.ids = self._reopen(self.ids_path, 8 * self.n)
+            self.offsets = self._reopen(self.offsets_path, 8 * (self.n + 1))
+
+    @staticmethod
+    def _reopen(path, size):
+        f = open(path, "r+b")
+        f.truncate(size)
+        f.seek(size)
+        return f
+
+    def checkpoint(self):
+        for f in (self.f, self.ids, self.offsets):
+            f.flush()
+            os.fsync(f.fileno())
+        return {"n": self.n, "pos": self.pos, "last_id": self.last_id}
+
+    def add(self, records):
+        ids = []
+        ends = []
+        for r in records:
+            rid = int(r["id"])
+            if self.last_id is not None and rid <= self.last_id:
+                raise ValueError(f"chunk ids must be increasing, got {rid} after {self.last_id}")
+            self.last_id = rid
+            data = json.dumps(r, ensure_ascii=False, separators=(",", ":")).encode("utf-8")
+            self.f.write(data)
+            self.pos += len(data)
+            ids.append(rid)
+            ends.append(self.pos)
+        self.ids.write(np.asarray(ids, dtype="<i8").tobytes())
+        self.offsets.write(np.asarray(ends, dtype="<u8").tobytes())
+        self.n += len(ids)
+
+    def close(self):
+        # align the tables so they can be viewed as int64 arrays
+        pad = -(HEADER.size + self.pos) % 8
+        self.f.write(b"\0" * pad)
+        table_offset = HEADER.size + self.pos + pad
+        for spool in (self.ids, self.offsets):
+            spool.seek(0)
+            while True:
+                block = spool.read(1 << 20)
+                if not block:
+                    break
+                self.f.write(block)
+            spool.close()
+        os.unlink(self.ids_path)
+        os.unlink(self.offsets_path)
+        self.f.seek(0)
+        self.f.write(HEADER.pack(MAGIC, self.n, table_offset))
+        self.f.flush()
+        os.fsync(self.f.fileno())
+        self.f.close()
+        # readers that have the old file mapped keep seeing the old inode
+        os.replace(self.tmp_path, self.path)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        if exc_type is None:
+            self.close()
+        else:
+            self.abort()
+
+    def abort(self):
+        for f, path in ((self.f, self.tmp_path), (self.ids, self.ids_path), (self.offsets, self.offsets_path)):
+            f.close()
+            path.unlink(missing_ok=True)
+
+def write_chunks(path, records):
+    """Write records (dicts with an 'id') to a chunk store, sorted by id."""
+    with ChunkStoreWriter(path) as w:
+        w.add(sorted(records, key=lambda r: r["id"]))
+
+class ChunkStore:
+    """
+    Memory-mapped, read-only view of a chunk store. Only the rows that are
+    asked for are decoded; the rest of the file stays on disk / in the page
+    cache shared between processes.
+    """
+
+    def __init__(self, path):
+        self.path = Path(path)
+        self.mm = np.memmap(self.path, dtype="uint8", mode="r")
+        magic, n, table_offset = HEADER.unpack(self.mm[:HEADER.size].tobytes())
+        if magic != MAGIC:
+            raise ValueError(f"{path} is not a chunk store")
+        self.n = n
+        self.ids = np.frombuffer(self.mm, dtype="<i8", count=n, offset=table_offset)
+        self.offsets = np.frombuffer(self.mm, dtype="<u8", count=n + 1, offset=table_offset + 8 * n)
+
+    def __len__(self):
+        return self.n
+
+    def _row(self, row):
+        start = HEADER.size + int(self.offsets[row])
+        end = HEADER.size + int(self.offsets[row + 1])
+        return json.loads(self.mm[start:end].tobytes())
+
+    def get(self, chunk_id):
+        """Record with the given FAISS id, or None."""
+        row = int(np.searchsorted(self.ids, chunk_id))
+        if row >= self.n or self.ids[row] != chunk_id:
+            return None
+        return self._row(row)
+
+    def get_many(self, chunk_ids):
+        return [self.get(i) for i in chunk_ids]
+
+    def __iter__(self):
+        for row in range(self.n):
+            yield self._row(row)
+
+class JsonChunks:
+    """Same interface over a legacy metadata.json list (loaded in memory)."""
+
+    def __init__(self, path):
+        self.path = Path(path)
+        with open(self.path, "r", encoding="utf-8") as f:
+            records = json.load(f)
+        # older files are positional, newer ones carry their FAISS id
+        self.by_id = {r.get("id", i): r for i, r in enumerate(records)}
+
+    def __len__(self):
+        return len(self.by_id)
+
+    def get(self, chunk_id):
+        return self.by_id.get(chunk_id)
+
+    def get_many(self, chunk_ids):
+        return [self.get(i) for i in chunk_ids]
+
+    def __iter__(self):
+        return iter(self.by_id.values())
+
+def is_chunk_store(path):
+    with open(path, "rb") as f:
+        return f.read(len(MAGIC)) == MAGIC
+
+def resolve_meta_file(path=None):
+    """The chunk store if it exists, else the legacy metadata.json."""
+    if path is not None:
+        return str(path)
+    return META_FILE if Path(META_FILE).exists() else LEGACY_META_FILE
+
+def load_chunks(path=None):
+    path = resolve_meta_file(path)
+    return ChunkStore(path) if is_chunk_store(path) else JsonChunks(path)
+
+def convert_json(json_path=LEGACY_META_FILE, out_path=META_FILE):
+    """Convert a metadata.json file into a chunk store."""
+    with open(json_path, "r", encoding="utf-8") as f:
+        records = json.load(f)
+    for i, r in enumerate(records):
+        r.setdefault("id", i)
+    write_chunks(out_path, records)
+    print(f"[chunk_store] Converted {len(records)} chunks: {json_path} -> {out_path}")
+    return out_path
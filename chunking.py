@@ -0,0 +1,114 @@
+# chunking.py
+from model_registry import get_model
+from grounding import split_sentences, content_words
+
+# Sizes are in tokens of the generator's tokenizer, since chunks end up in
+# its prompts. Chunks also stay under the embedder's 256-token limit.
+TOKENIZER_MODEL = "google/flan-t5-large"
+CHUNK_TOKENS = 200
+CHUNK_OVERLAP = 32       # at most this many tokens of whole sentences are repeated
+MAX_INPUT_TOKENS = 512   # flan-t5 input window
+DEDUP_SIMILARITY = 0.8   # content-word Jaccard above which a chunk counts as a duplicate
+
+def get_tokenizer(model_name=TOKENIZER_MODEL):
+    return get_model("tokenizer", model_name)
+
+def count_tokens(texts, tokenizer=None):
+    """Token count of each text, without special tokens."""
+    if not texts:
+        return []
+    tokenizer = tokenizer or get_tokenizer()
+    ids = tokenizer(list(texts), add_special_tokens=False, verbose=False)["input_ids"]
+    return [len(i) for i in ids]
+
+# ------------------------------------------------
+# CHUNKING
+# ------------------------------------------------
+def _pieces(text, max_tokens, tokenizer):
+    """(sentence, tokens) pairs; sentences longer than max_tokens are cut at word boundaries."""
+    sentences = split_sentences(text)
+    pieces = []
+    for sentence, n in zip(sentences, count_tokens(sentences, tokenizer)):
+        if n <= max_tokens:
+            pieces.append((sentence, n))
+            continue
+        words = sentence.split()
+        part, size = [], 0
+        for word, m in zip(words, count_tokens(words, tokenizer)):
+            if part and size + m > max_tokens:
+                pieces.append((" ".join(part), size))
+                part, size = [], 0
+            part.append(word)
+            size += m
+        if part:
+            pieces.append((" ".join(part), size))
+    return pieces
+
+def split_chunks(text, chunk_tokens=CHUNK_TOKENS, overlap=CHUNK_OVERLAP, tokenizer=None):
+    """
+    [(chunk, tokens)] for a document: whole sentences packed up to
+    chunk_tokens, each chunk starting with the last sentences of the
+    previous one, up to overlap tokens. Token counts add up the sentences,
+    so they can be off by a token or two from tokenizing the chunk.
+    """
+    tokenizer = tokenizer or get_tokenizer()
+    chunks = []
+    current, size = [], 0
+    for piece, n in _pieces(text, chunk_tokens, tokenizer):
+        if current and size + n > chunk_tokens:
+            chunks.append((" ".join(p for p, _ in current), size))
+            # carry whole trailing sentences over, never more than overlap tokens
+            carry, carried = [], 0
+            for p, m in reversed(current):
+                if carried + m > overlap or carried + m + n > chunk_tokens:
+                    break
+                carry.insert(0, (p, m))
+                carried += m
+            current, size = carry, carried
+        current.append((piece, n))
+        size += n
+    if current:
+        chunks.append((" ".join(p for p, _ in current), size))
+    return chunks
+
+def chunk_text(text, chunk_tokens=CHUNK_TOKENS, overlap=CHUNK_OVERLAP, tokenizer=None):
+    return [c for c, _ in split_chunks(text, chunk_tokens, overlap, tokenizer)]
+
+# ------------------------------------------------
+# CONTEXT PACKING
+# ------------------------------------------------
+def pack_context(chunks, budget, tokenizer=None, dedup_similarity=DEDUP_SIMILARITY):
+    """
+    Fill a token budget with retrieved chunks (dicts with "chunk", best
+    first, optionally carrying "n_tokens" from the index). Near-duplicates
+    of a chunk already packed are skipped; chunks that do not fit are
+    skipped in favour of later ones that still do. Returns (packed chunks,
+    stats with tokens used and dropped).
+    """
+    missing = [c["chunk"] for c in chunks if c.get("n_tokens") is None]
+    counted = iter(count_tokens(missing, tokenizer))
+    sizes = [c["n_tokens"] if c.get("n_tokens") is not None else next(counted) for c in chunks]
+
+    packed, kept_words = [], []
+    used = dropped = duplicates = 0
+    # chunks are joined with a blank line, about one token each
+    for c, n in zip(chunks, sizes):
+        words = content_words(c["chunk"])
+        if any(len(words & w) / max(1, len(words | w)) >= dedup_similarity for w in kept_words):
+            duplicates += 1
+            dropped += n
+            continue
+        if used + n + (1 if packed else 0) > budget:
+            dropped += n
+            continue
+        used += n + (1 if packed else 0)
+        packed.append(c)
+        kept_words.append(words)
+    return packed, {
+        "budget": budget,
+        "tokens_used": used,
+        "tokens_dropped": dropped,
+        "chunks_used": len(packed),
+        "chunks_dropped": len(chunks) - len(packed),
+        "duplicates": duplicates
+    }
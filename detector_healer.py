@@ -1,28 +1,73 @@
 import re
-from transformers import pipeline
+import ast
+import json
+import time
+import threading
+import numpy as np
+from model_registry import get_model
+from chunking import CHUNK_TOKENS, MAX_INPUT_TOKENS, count_tokens, get_tokenizer, pack_context
+import metrics
 
-class DetectorHealer:
+GEN_MODEL = "google/flan-t5-large"
+MAX_NEW_TOKENS = 256
+PARTIAL_TOP_CHUNKS = 2  # chunks given to the model when rewriting one sentence
+SENTENCE_MAX_NEW_TOKENS = 64
+# a long answer is cut for the heal prompt so that at least one chunk fits next to it
+HEAL_CONTEXT_TOKENS = CHUNK_TOKENS
 
-    def __init__(self):
-        print("Loading LLM for detector & healer module...")
-        self.model = pipeline(
-            "text2text-generation",
-            model="google/flan-t5-large",
-            max_new_tokens=256
-        )
+# How the LLM tier reaches a verdict:
+#   score    - one encoder pass and one decoder step, P("no") vs P("yes") to
+#              "is the answer supported?"; a reason is generated only when flagged
+#   generate - the model writes a JSON verdict (slower, and unparseable replies pass)
+# Compare them with bench_detector.py.
+DETECT_MODES = ("score", "generate")
+HALLUCINATION_THRESHOLD = 0.5  # score mode: flag at or above this probability
+REASON_MAX_NEW_TOKENS = 48
 
-    # -------------------------------------------------
-    # 1. DETECTOR
-    # -------------------------------------------------
-    def detect_problem(self, answer, retrieved_chunks):
-        """
-        Detect hallucinations, unsupported claims, contradictions,
-        and missing information.
+# ------------------------------------------------
+# PROMPTS
+# ------------------------------------------------
+# Filled with str.format; {context} is the retrieved chunks that fit in the
+# model's window next to the rest of the prompt (see DetectorHealer._fit).
+ANSWER_PROMPT = """
+You are an AI assistant. 
+Answer the user's question using ONLY the provided context. 
+Do NOT hallucinate. If the answer is not present, say "Information not found".
+
+QUESTION:
+{question}
+
+CONTEXT:
+{context}
+
+ANSWER:
+    """
+
+VERDICT_PROMPT = """
+Context:
+
+{context}
+
+Answer:
+
+{answer}
+
+Is every claim in the answer supported by the context? Reply yes or no.
         """
 
-        context = "\n\n".join([c["chunk"] for c in retrieved_chunks])
+REASON_PROMPT = """
+Context:
+
+{context}
 
-        prompt = f"""
+Answer:
+
+{answer}
+
+Which claim in the answer is not supported by the context? Reply in one short sentence.
+        """
+
+DETECT_PROMPT = """
 You are a hallucination detector. 
 Given the retrieved context and the model's answer, identify if the answer contains:
 
@@ -46,27 +91,7 @@ Context:
 {context}
         """
 
-        response = self.model(prompt)[0]["generated_text"]
-
-        # Extract JSON using regex
-        try:
-            match = re.search(r"\{.*\}", response, re.DOTALL)
-            return eval(match.group())
-        except:
-            return {"hallucination": False, "reason": "Parsing failed -> assume OK"}
-
-    # -------------------------------------------------
-    # 2. HEALER
-    # -------------------------------------------------
-    def heal_answer(self, question, answer, retrieved_chunks):
-        """
-        Rewrite the answer using retrieved context,
-        ensuring no hallucinations.
-        """
-
-        context = "\n\n".join([c["chunk"] for c in retrieved_chunks])
-
-        prompt = f"""
+HEAL_PROMPT = """
 You are a RAG Healer.
 
 Rewrite the answer using ONLY the retrieved context below.  
@@ -90,31 +115,426 @@ RETRIEVED CONTEXT:
 Return only the corrected answer. 
         """
 
-        healed = self.model(prompt)[0]["generated_text"]
-        return healed.strip()
+SENTENCE_PROMPT = """
+Rewrite the sentence below so that it is supported by the context.
+Keep it to one sentence. If the context says nothing about it, reply REMOVE.
+
+QUESTION:
+{question}
+
+SENTENCE:
+{sentence}
+
+CONTEXT:
+{context}
+
+REWRITTEN SENTENCE:
+        """
+
+class DetectorHealer:
+
+    def __init__(self, batch_size=8, grounding=None, model_name=GEN_MODEL, detect_mode="score",
+                 threshold=HALLUCINATION_THRESHOLD):
+        if detect_mode not in DETECT_MODES:
+            raise ValueError(f"detect_mode must be one of {DETECT_MODES}, got '{detect_mode}'")
+        # generator, detector and healer share one registry instance,
+        # loaded on first use
+        self.model_name = model_name
+        self.batch_size = batch_size
+        # optional GroundingScorer: settles clear cases before the LLM
+        self.grounding = grounding
+        self.detect_mode = detect_mode
+        self.threshold = threshold
+        self._template_tokens = {}  # prompt template -> tokens of its fixed text
+
+    @property
+    def model(self):
+        return get_model("text2text-generation", self.model_name)
+
+    @property
+    def tokenizer(self):
+        return get_tokenizer(self.model_name)
+
+    def warm_up(self):
+        """Load the tokenizer and model and run a one-token generation, so the first request pays for neither."""
+        count_tokens(["warm-up"], self.tokenizer)
+        self.model("warm-up", max_new_tokens=1)
+
+    def _fit(self, chunks, template, **fields):
+        """
+        Context string of the best chunks that fit in the model's input
+        window next to the rest of the template filled with fields (e.g. the
+        question, which is never truncated). The template's own tokens are
+        counted once; only the fields are tokenized per prompt. Returns
+        (context, packing stats).
+        """
+        tokenizer = self.tokenizer
+        # +1 for the end-of-sequence token
+        budget = (MAX_INPUT_TOKENS - self._fixed_tokens(template, fields)
+                  - sum(count_tokens(list(fields.values()), tokenizer)) - 1)
+        packed, stats = pack_context(chunks, max(0, budget), tokenizer)
+        metrics.CONTEXT_TOKENS.inc(stats["tokens_used"], kind="used")
+        metrics.CONTEXT_TOKENS.inc(stats["tokens_dropped"], kind="dropped")
+        return "\n\n".join(c["chunk"] for c in packed), stats
+
+    def _fixed_tokens(self, template, fields):
+        fixed = self._template_tokens.get(template)
+        if fixed is None:
+            empty = template.format(context="", **{name: "" for name in fields})
+            fixed = self._template_tokens[template] = count_tokens([empty], self.tokenizer)[0]
+        return fixed
+
+    def _shorten(self, template, field, reserve, **fields):
+        """
+        fields, with fields[field] cut at a word boundary if needed so that
+        reserve tokens are left for the context next to the rest of the
+        template. Other fields are never cut.
+        """
+        tokenizer = self.tokenizer
+        others = sum(count_tokens([v for k, v in fields.items() if k != field], tokenizer))
+        room = MAX_INPUT_TOKENS - self._fixed_tokens(template, fields) - others - 1 - reserve
+        if count_tokens([fields[field]], tokenizer)[0] <= room:
+            return fields
+        words = fields[field].split()
+        sizes = np.cumsum(count_tokens(words, tokenizer))
+        keep = int(np.searchsorted(sizes, max(room, 0), side="right"))
+        return {**fields, field: " ".join(words[:keep])}
+
+    def _prompt(self, template, chunks, **fields):
+        return template.format(context=self._fit(chunks, template, **fields)[0], **fields)
+
+    def fit_context(self, question, chunks):
+        """Context for the answer prompt from retrieved chunks (best first), and packing stats."""
+        return self._fit(chunks, ANSWER_PROMPT, question=question)
+
+    def _generate(self, prompts, **gen_kwargs):
+        """
+        Run many prompts through the model in padded batches. Prompts are
+        sorted by token length so each batch pads to similar lengths;
+        outputs are returned in input order.
+        """
+        if not prompts:
+            return []
+        model = self.model
+        gen_kwargs.setdefault("max_new_tokens", MAX_NEW_TOKENS)
+        lengths = [len(ids) for ids in model.tokenizer(prompts)["input_ids"]]
+        order = sorted(range(len(prompts)), key=lambda i: lengths[i])
+        outputs = model([prompts[i] for i in order], batch_size=self.batch_size, **gen_kwargs)
+
+        results = [None] * len(prompts)
+        for i, out in zip(order, outputs):
+            if isinstance(out, list):
+                out = out[0]
+            results[i] = out["generated_text"]
+        metrics.TOKENS.inc(sum(lengths), direction="input")
+        metrics.TOKENS.inc(sum(len(ids) for ids in model.tokenizer(results)["input_ids"]), direction="output")
+        return results
+
+    # -------------------------------------------------
+    # 0. ANSWER GENERATION
+    # -------------------------------------------------
+    def _answer_prompt(self, question, context):
+        return ANSWER_PROMPT.format(question=question, context=context)
+
+    def generate_answer(self, question, context):
+        with metrics.span("generate"):
+            return self._generate([self._answer_prompt(question, context)])[0].strip()
+
+    def generate_answer_stream(self, question, context, max_new_tokens=MAX_NEW_TOKENS, stop=None):
+        """
+        Yield the answer text piece by piece as tokens are generated.
+        Generation runs in a helper thread feeding a TextIteratorStreamer;
+        setting the optional stop event ends it after the current token.
+        """
+        # imported here so importing this module (and the API) stays cheap
+        from transformers import StoppingCriteria, StoppingCriteriaList, TextIteratorStreamer
+
+        import torch
+
+        class _Stop(StoppingCriteria):
+            def __call__(self, input_ids, scores, **kwargs):
+                done = stop is not None and stop.is_set()
+                return torch.full((input_ids.shape[0],), done, dtype=torch.bool, device=input_ids.device)
+
+        t0 = time.perf_counter()
+        model = self.model
+        tokenizer = model.tokenizer
+        inputs = tokenizer(self._answer_prompt(question, context), return_tensors="pt", truncation=True)
+        streamer = TextIteratorStreamer(tokenizer, skip_prompt=True, skip_special_tokens=True)
+        errors = []
+
+        def _run():
+            try:
+                model.model.generate(**inputs, streamer=streamer, max_new_tokens=max_new_tokens,
+                                     stopping_criteria=StoppingCriteriaList([_Stop()]))
+            except Exception as e:
+                errors.append(e)
+                streamer.end()
+
+        thread = threading.Thread(target=_run, daemon=True)
+        thread.start()
+        pieces = []
+        for text in streamer:
+            if text:
+                pieces.append(text)
+                yield text
+        thread.join()
+        if errors:
+            raise errors[0]
+        metrics.record("generate", time.perf_counter() - t0)
+        metrics.TOKENS.inc(int(inputs["input_ids"].shape[-1]), direction="input")
+        metrics.TOKENS.inc(len(tokenizer("".join(pieces))["input_ids"]), direction="output")
+
+    # -------------------------------------------------
+    # 1. DETECTOR
+    # -------------------------------------------------
+    def detect_problem(self, answer, retrieved_chunks):
+        """
+        Detect hallucinations, unsupported claims, contradictions,
+        and missing information.
+        """
+        return self.detect_batch([answer], [retrieved_chunks])[0]
+
+    def detect_batch(self, answers, retrieved_chunks_list):
+        """
+        With a grounding scorer, only the answers it cannot settle are
+        sent to the LLM detector.
+        """
+        if self.grounding is not None:
+            with metrics.span("grounding"):
+                verdicts = [self.grounding.score(a, c) for a, c in zip(answers, retrieved_chunks_list)]
+        else:
+            verdicts = [None] * len(answers)
+        todo = [i for i, v in enumerate(verdicts) if v is None]
+        if todo:
+            llm = self._score_verdicts if self.detect_mode == "score" else self._generate_verdicts
+            with metrics.span("detect"):
+                found = llm([answers[i] for i in todo], [retrieved_chunks_list[i] for i in todo])
+            for i, v in zip(todo, found):
+                verdicts[i] = {**v, "tier": "llm"}
+        for v in verdicts:
+            metrics.DETECTIONS.inc(tier=v["tier"])
+        return verdicts
+
+    def _generate_verdicts(self, answers, retrieved_chunks_list):
+        prompts = [self._detect_prompt(a, c) for a, c in zip(answers, retrieved_chunks_list)]
+        return [self._parse_verdict(r) for r in self._generate(prompts)]
+
+    def _score_verdicts(self, answers, retrieved_chunks_list):
+        """
+        Hallucination probability of each answer from a single decoder step,
+        P("no") / (P("yes") + P("no")); a short reason is generated only for
+        answers at or above the threshold.
+        """
+        probs = self._no_probability([self._verdict_prompt(a, c) for a, c in zip(answers, retrieved_chunks_list)])
+        flagged = [i for i, p in enumerate(probs) if p >= self.threshold]
+        reasons = self._generate(
+            [self._reason_prompt(answers[i], retrieved_chunks_list[i]) for i in flagged],
+            max_new_tokens=REASON_MAX_NEW_TOKENS
+        )
+        verdicts = [{"hallucination": False, "reason": None, "probability": round(p, 4)} for p in probs]
+        for i, reason in zip(flagged, reasons):
+            verdicts[i].update(hallucination=True,
+                               reason=reason.strip() or f"Answer not supported by the context (p={probs[i]:.2f})")
+        return verdicts
+
+    def _no_probability(self, prompts):
+        """
+        P("no") among {"yes", "no"} as the first token of the reply to each
+        prompt: one encoder pass and one decoder step, batched by length.
+        """
+        import torch
+        pipe = self.model
+        tokenizer, model = pipe.tokenizer, pipe.model
+        yes, no = (tokenizer(w, add_special_tokens=False)["input_ids"][0] for w in ("yes", "no"))
+        lengths = [len(ids) for ids in tokenizer(prompts)["input_ids"]]
+        order = sorted(range(len(prompts)), key=lambda i: lengths[i])
+
+        probs = [None] * len(prompts)
+        for start in range(0, len(order), self.batch_size):
+            idx = order[start:start + self.batch_size]
+            inputs = tokenizer([prompts[i] for i in idx], return_tensors="pt", padding=True,
+                               truncation=True, max_length=MAX_INPUT_TOKENS)
+            decoder_input_ids = torch.full((len(idx), 1), model.config.decoder_start_token_id, dtype=torch.long)
+            with torch.inference_mode():
+                logits = model(**inputs, decoder_input_ids=decoder_input_ids).logits[:, -1, [yes, no]]
+            for i, p in zip(idx, torch.softmax(logits.float(), dim=-1)[:, 1].tolist()):
+                probs[i] = p
+        metrics.TOKENS.inc(sum(lengths), direction="input")
+        metrics.TOKENS.inc(len(prompts), direction="output")
+        return probs
+
+    def _verdict_prompt(self, answer, retrieved_chunks):
+        return self._prompt(VERDICT_PROMPT, retrieved_chunks, answer=answer)
+
+    def _reason_prompt(self, answer, retrieved_chunks):
+        return self._prompt(REASON_PROMPT, retrieved_chunks, answer=answer)
+
+    def _detect_prompt(self, answer, retrieved_chunks):
+        return self._prompt(DETECT_PROMPT, retrieved_chunks, answer=answer)
+
+    def _parse_verdict(self, response):
+        """
+        The {...} object in the model's reply, read as JSON or, for Python
+        style True/False and quotes, as a literal; never evaluated, since
+        the reply can echo retrieved text.
+        """
+        match = re.search(r"\{.*\}", response, re.DOTALL)
+        verdict = None
+        for parse in (json.loads, ast.literal_eval) if match else ():
+            try:
+                verdict = parse(match.group())
+                break
+            except (ValueError, TypeError, SyntaxError, MemoryError, RecursionError):
+                continue
+        if not isinstance(verdict, dict) or "hallucination" not in verdict:
+            return {"hallucination": False, "reason": "Parsing failed -> assume OK"}
+        flag = verdict["hallucination"]
+        if isinstance(flag, str):
+            flag = flag.strip().lower() == "true"
+        return {"hallucination": bool(flag), "reason": str(verdict.get("reason", ""))}
+
+    # -------------------------------------------------
+    # 2. HEALER
+    # -------------------------------------------------
+    def heal_answer(self, question, answer, retrieved_chunks):
+        """
+        Rewrite the answer using retrieved context,
+        ensuring no hallucinations.
+        """
+        return self.heal_batch([question], [answer], [retrieved_chunks])[0]
+
+    def heal_batch(self, questions, answers, retrieved_chunks_list):
+        """
+        Rewrite answers in one batched pass. Answers with no room for any
+        context next to the question are returned unchanged rather than
+        rewritten from nothing.
+        """
+        prompts = [self._heal_prompt(q, a, c) for q, a, c in zip(questions, answers, retrieved_chunks_list)]
+        todo = [i for i, p in enumerate(prompts) if p is not None]
+        results = list(answers)
+        for i, text in zip(todo, self._generate([prompts[i] for i in todo])):
+            results[i] = text.strip()
+        return results
+
+    def _heal_prompt(self, question, answer, retrieved_chunks):
+        """The heal prompt, the old answer cut if it crowds out the context; None when no chunk fits."""
+        fields = self._shorten(HEAL_PROMPT, "answer", HEAL_CONTEXT_TOKENS, question=question, answer=answer)
+        context, stats = self._fit(retrieved_chunks, HEAL_PROMPT, **fields)
+        if retrieved_chunks and not stats["chunks_used"]:
+            print("[detector_healer] No context fits next to the question, leaving the answer unhealed")
+            return None
+        return HEAL_PROMPT.format(context=context, **fields)
+
+    def _sentence_prompt(self, question, sentence, chunks):
+        return self._prompt(SENTENCE_PROMPT, chunks, question=question, sentence=sentence)
+
+    def repair_batch(self, questions, answers, retrieved_chunks_list):
+        """
+        Heal flagged answers sentence by sentence where possible. With a
+        grounding scorer, sentences scoring below its supported threshold
+        are regenerated on their own, each with only its most similar
+        chunks; the rest of the answer is kept. Answers where no sentence
+        (or every sentence) looks unsupported are rewritten in full.
+        Returns dicts with final_answer and replaced_sentences.
+        """
+        results = [None] * len(answers)
+        jobs = []  # (answer index, sentence index, prompt)
+        partial = {}
+        for i, (q, a, chunks) in enumerate(zip(questions, answers, retrieved_chunks_list)):
+            if self.grounding is None:
+                continue
+            sentences, scores, sims = self.grounding.sentence_support(a, chunks)
+            weak = [j for j, v in enumerate(scores) if v < self.grounding.supported]
+            if not weak or len(weak) == len(sentences):
+                continue
+            partial[i] = (sentences, scores)
+            for j in weak:
+                top = np.argsort(-sims[j])[:PARTIAL_TOP_CHUNKS]
+                jobs.append((i, j, self._sentence_prompt(q, sentences[j], [chunks[t] for t in top])))
+
+        rewrites = self._generate([p for _, _, p in jobs], max_new_tokens=SENTENCE_MAX_NEW_TOKENS)
+        replaced = {i: {} for i in partial}
+        for (i, j, _), text in zip(jobs, rewrites):
+            replaced[i][j] = text.strip()
+        for i, (sentences, scores) in partial.items():
+            out, report = [], []
+            for j, sentence in enumerate(sentences):
+                if j not in replaced[i]:
+                    out.append(sentence)
+                    continue
+                new = replaced[i][j]
+                removed = not new or new.upper().startswith("REMOVE")
+                if not removed:
+                    out.append(new)
+                report.append({
+                    "index": j,
+                    "original": sentence,
+                    "replacement": None if removed else new,
+                    "score": round(float(scores[j]), 4)
+                })
+            results[i] = {"final_answer": " ".join(out), "replaced_sentences": report}
+
+        full = [i for i in range(len(answers)) if results[i] is None]
+        healed = self.heal_batch(
+            [questions[i] for i in full],
+            [answers[i] for i in full],
+            [retrieved_chunks_list[i] for i in full]
+        )
+        for i, text in zip(full, healed):
+            results[i] = {"final_answer": text, "replaced_sentences": None}
+        return results
+
+    def repair(self, question, answer, retrieved_chunks):
+        with metrics.span("heal"):
+            return self.repair_batch([question], [answer], [retrieved_chunks])[0]
 
     # -------------------------------------------------
     # 3. SELF-HEAL FULL EXECUTION
     # -------------------------------------------------
     def run(self, question, raw_answer, retrieved_chunks):
-        result = self.detect_problem(raw_answer, retrieved_chunks)
-
-        if result["hallucination"]:
-            print("\n⚠️ Hallucination detected:", result["reason"])
-            print("🔧 Healing answer...\n")
-            healed = self.heal_answer(question, raw_answer, retrieved_chunks)
-            return {
-                "final_answer": healed,
-                "hallucinated": True,
-                "reason": result["reason"]
-            }
+        return self.run_batch([question], [raw_answer], [retrieved_chunks])[0]
 
-        else:
-            return {
-                "final_answer": raw_answer,
-                "hallucinated": False,
-                "reason": None
-            }
+    def run_batch(self, questions, raw_answers, retrieved_chunks_list):
+        """
+        Detect all answers in one batched pass, then heal the flagged ones
+        in a second batched pass.
+        """
+        verdicts = self.detect_batch(raw_answers, retrieved_chunks_list)
+
+        flagged = [i for i, v in enumerate(verdicts) if v["hallucination"]]
+        for i in flagged:
+            print("\n⚠️ Hallucination detected:", verdicts[i]["reason"])
+        healed = {}
+        if flagged:
+            print(f"🔧 Healing {len(flagged)} answer(s)...\n")
+            with metrics.span("heal"):
+                healed = dict(zip(flagged, self.repair_batch(
+                    [questions[i] for i in flagged],
+                    [raw_answers[i] for i in flagged],
+                    [retrieved_chunks_list[i] for i in flagged]
+                )))
+        metrics.ANSWERS.inc(len(flagged), outcome="healed")
+        metrics.ANSWERS.inc(len(raw_answers) - len(flagged), outcome="passed")
+
+        results = []
+        for i, raw_answer in enumerate(raw_answers):
+            if i in healed:
+                results.append({
+                    "final_answer": healed[i]["final_answer"],
+                    "hallucinated": True,
+                    "reason": verdicts[i]["reason"],
+                    # None when the whole answer was rewritten
+                    "replaced_sentences": healed[i]["replaced_sentences"]
+                })
+            else:
+                results.append({
+                    "final_answer": raw_answer,
+                    "hallucinated": False,
+                    "reason": None,
+                    "replaced_sentences": []
+                })
+        return results
 
 
 # Test
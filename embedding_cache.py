@@ -0,0 +1,264 @@
+# embedding_cache.py
+import os
+import re
+import hashlib
+import threading
+from collections import OrderedDict
+from contextlib import contextmanager
+from pathlib import Path
+import numpy as np
+
+try:
+    import fcntl
+except ImportError:  # Windows: single-process use only
+    fcntl = None
+
+CACHE_DIR = Path("embedding_cache")
+KEY_BYTES = 20  # sha1 digest
+
+def text_key(text):
+    return hashlib.sha1(text.encode("utf-8")).digest()
+
+class EmbeddingCache:
+    """
+    Persistent embedding cache keyed by (model name, sha1 of the text).
+
+    Every model gets its own directory with two append-only files:
+      - vectors.f32: a flat float32 array, memory-mapped for reads
+      - keys.bin:    the offset index, the digest of row i at byte i*20
+    Writers serialise on a lock file, so several processes can share one
+    cache. A small in-memory LRU sits in front of the mmap. When the store
+    grows past max_entries it is compacted, keeping this process's recently
+    used vectors and then the newest rows.
+    """
+
+    def __init__(self, model_name, cache_dir=CACHE_DIR, max_entries=1_000_000, lru_size=4096):
+        self.model_name = model_name
+        self.dir = Path(cache_dir) / re.sub(r"[^A-Za-z0-9_.-]+", "__", model_name)
+        self.dir.mkdir(parents=True, exist_ok=True)
+        self.keys_path = self.dir / "keys.bin"
+        self.vecs_path = self.dir / "vectors.f32"
+        self.lock_path = self.dir / "lock"
+        self.max_entries = max_entries
+        self.lru_size = lru_size
+
+        self.lru = OrderedDict()
+        self.rows = {}
+        self.n_rows = 0
+        self.dim = None
+        self._inode = None
+        self._mm = None
+        self._lock = threading.RLock()
+
+        self.hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+        with self._flock(shared=True):
+            self._refresh()
+
+    # -------------------------
+    # Storage
+    # -------------------------
+    @contextmanager
+    def _flock(self, shared=False):
+        if fcntl is None:
+            yield
+            return
+        with open(self.lock_path, "a") as f:
+            fcntl.flock(f, fcntl.LOCK_SH if shared else fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(f, fcntl.LOCK_UN)
+
+    def _refresh(self):
+        """Pick up rows appended (or a compaction done) by other processes."""
+        if not self.keys_path.exists():
+            return
+        st = os.stat(self.keys_path)
+        if st.st_ino != self._inode:
+            self.rows, self.n_rows, self._mm = {}, 0, None
+            self._inode = st.st_ino
+        total = st.st_size // KEY_BYTES
+        if total <= self.n_rows:
+            return
+        with open(self.keys_path, "rb") as f:
+            f.seek(self.n_rows * KEY_BYTES)
+            data = f.read((total - self.n_rows) * KEY_BYTES)
+        for i in range(len(data) // KEY_BYTES):
+            self.rows[data[i * KEY_BYTES:(i + 1) * KEY_BYTES]] = self.n_rows + i
+        self.n_rows = total
+        if self.dim is None and total:
+            self.dim = os.path.getsize(self.vecs_path) // (4 * total)
+        self._mm = None
+
+    def _mmap(self):
+        if self._mm is None and self.n_rows:
+            # another process may have compacted since our last refresh:
+            # map under the lock, after re-reading the keys, never with a stale row count
+            with self._flock(shared=True):
+                self._refresh()
+                self._mm = self._map_vectors()
+        return self._mm
+
+    def _map_vectors(self):
+        """Map vectors.f32 as it is on disk; the caller holds the file lock."""
+        if not self.n_rows:
+            return None
+        n = min(self.n_rows, os.path.getsize(self.vecs_path) // (4 * self.dim))
+        return np.memmap(self.vecs_path, dtype="float32", mode="r", shape=(n, self.dim))
+
+    def _append(self, keys, vecs):
+        with self._flock():
+            self._refresh()
+            if self.dim is None:
+                self.dim = vecs.shape[1]
+            # another thread or process may have embedded some of them meanwhile
+            fresh = [i for i, k in enumerate(keys) if k not in self.rows]
+            if not fresh:
+                return
+            keys, vecs = [keys[i] for i in fresh], vecs[fresh]
+            # drop vectors left behind by a writer that died before its keys
+            with open(self.vecs_path, "ab") as f:
+                f.truncate(self.n_rows * self.dim * 4)
+                f.write(np.ascontiguousarray(vecs, dtype="float32").tobytes())
+            with open(self.keys_path, "ab") as f:
+                f.write(b"".join(keys))
+            self._refresh()
+            if self.n_rows > self.max_entries:
+                self._compact()
+
+    def _compact(self):
+        keep_n = max(1, int(self.max_entries * 0.8))
+        keep = np.zeros(self.n_rows, dtype=bool)
+        hot = [self.rows[k] for k in reversed(self.lru) if k in self.rows][:keep_n]
+        keep[hot] = True
+        newest = np.flatnonzero(~keep)[::-1][:keep_n - len(hot)]
+        keep[newest] = True
+        rows = np.flatnonzero(keep)
+
+        by_row = {r: k for k, r in self.rows.items()}
+        vecs = np.asarray(self._map_vectors()[rows])
+        tmp_vecs = self.vecs_path.with_suffix(".tmp")
+        tmp_keys = self.keys_path.with_suffix(".tmp")
+        vecs.tofile(tmp_vecs)
+        with open(tmp_keys, "wb") as f:
+            f.write(b"".join(by_row[int(r)] for r in rows))
+        # vectors first: a reader that sees the new keys must see the new vectors
+        os.replace(tmp_vecs, self.vecs_path)
+        os.replace(tmp_keys, self.keys_path)
+        self.evictions += self.n_rows - len(rows)
+        self._inode = None
+        self._refresh()
+        print(f"[embedding_cache] Compacted {self.model_name}: kept {len(rows)} vectors")
+
+    # -------------------------
+    # Public API
+    # -------------------------
+    def get(self, text):
+        """Return the cached vector for text (a read-only view), or None."""
+        key = text_key(text)
+        with self._lock:
+            return self._get(key)
+
+    def _get(self, key):
+        vec = self.lru.get(key)
+        if vec is not None:
+            self.lru.move_to_end(key)
+            self.hits += 1
+            return vec
+        if key not in self.rows:
+            return None
+        mm = self._mmap()
+        # mapping may have refreshed the rows after a compaction elsewhere
+        row = self.rows.get(key)
+        if mm is None or row is None or row >= len(mm):
+            return None
+        vec = mm[row]
+        self.disk_hits += 1
+        self._remember(key, vec)
+        return vec
+
+    def _remember(self, key, vec):
+        self.lru[key] = vec
+        self.lru.move_to_end(key)
+        while len(self.lru) > self.lru_size:
+            self.lru.popitem(last=False)
+
+    def encode(self, embedder, texts, **encode_kwargs):
+        """
+        Embed texts through the cache: only texts that were never seen are
+        passed to embedder.encode, in a single call. The lock is not held
+        while encoding, so other threads' lookups and encodes go on meanwhile.
+        """
+        keys = [text_key(t) for t in texts]
+        with self._lock:
+            found = {}
+            missing = {}
+            for k, t in zip(keys, texts):
+                if k in found or k in missing:
+                    continue
+                vec = self._get(k)
+                if vec is None:
+                    missing[k] = t
+                else:
+                    found[k] = vec
+
+            if missing:
+                # another process may have embedded them meanwhile
+                with self._flock(shared=True):
+                    self._refresh()
+                for k in list(missing):
+                    vec = self._get(k)
+                    if vec is not None:
+                        found[k] = vec
+                        del missing[k]
+
+            self.misses += len(missing)
+
+        if missing:
+            new = np.asarray(embedder.encode(list(missing.values()), **encode_kwargs), dtype="float32")
+            with self._lock:
+                self._append(list(missing), new)
+                for k, vec in zip(missing, new):
+                    found[k] = vec
+                    self._remember(k, vec)
+
+        if not keys:
+            return np.zeros((0, self.dim or 0), dtype="float32")
+        return np.stack([found[k] for k in keys])
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.disk_hits + self.misses
+            return {
+                "model": self.model_name,
+                "entries": self.n_rows,
+                "max_entries": self.max_entries,
+                "lru_entries": len(self.lru),
+                "hits": self.hits,
+                "disk_hits": self.disk_hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "hit_rate": (self.hits + self.disk_hits) / lookups if lookups else 0.0
+            }
+
+class CachedEmbedder:
+    """
+    Drop-in wrapper around a SentenceTransformer whose encode() goes
+    through an EmbeddingCache. Other attributes are forwarded.
+    """
+
+    def __init__(self, embedder, model_name, cache=None):
+        self.embedder = embedder
+        self.cache = cache or EmbeddingCache(model_name)
+
+    def encode(self, sentences, **kwargs):
+        if isinstance(sentences, str):
+            return self.cache.encode(self.embedder, [sentences], **kwargs)[0]
+        return self.cache.encode(self.embedder, list(sentences), **kwargs)
+
+    def __getattr__(self, name):
+        return getattr(self.embedder, name)
@@ -0,0 +1,113 @@
+# grounding.py
+import re
+import threading
+import numpy as np
+
+# Answer-level score = weakest sentence. At or above SUPPORTED the answer is
+# accepted without the LLM detector, below UNSUPPORTED it is flagged
+# without it; anything in between goes to the LLM.
+SUPPORTED_THRESHOLD = 0.75
+UNSUPPORTED_THRESHOLD = 0.35
+SEMANTIC_WEIGHT = 0.6  # rest of the sentence score is lexical overlap
+
+_SENTENCE_RE = re.compile(r"(?<=[.!?])\s+")
+_WORD_RE = re.compile(r"[a-z0-9]+")
+_STOPWORDS = frozenset("""
+a an the and or but if then of to in on at by for with from as is are was were be been being
+it its this that these those there their they them he she his her we our you your i my me
+do does did done not no so such than too very can could will would should may might must
+has have had into over about which who whom what when where why how also just only
+""".split())
+_NOT_FOUND = ("information not found", "not found in the context", "i don't know")
+
+def split_sentences(text):
+    return [s.strip() for s in _SENTENCE_RE.split(text.strip()) if s.strip()]
+
+def content_words(text):
+    return {w for w in _WORD_RE.findall(text.lower()) if len(w) > 2 and w not in _STOPWORDS}
+
+class GroundingScorer:
+    """
+    Cheap first tier of hallucination detection. Each answer sentence gets
+        SEMANTIC_WEIGHT * max cosine(sentence, chunk) + (1 - SEMANTIC_WEIGHT) * lexical overlap
+    where lexical overlap is the share of its content words found in the
+    retrieved chunks. Clear cases get a verdict; ambiguous ones return None
+    so the caller can escalate to the LLM detector.
+
+    Chunk vectors come through the embedding cache (they were embedded at
+    index time); answer sentences are encoded directly so they do not fill it.
+    """
+
+    def __init__(self, embedder, supported=SUPPORTED_THRESHOLD, unsupported=UNSUPPORTED_THRESHOLD,
+                 semantic_weight=SEMANTIC_WEIGHT):
+        self.embedder = embedder
+        self.supported = supported
+        self.unsupported = unsupported
+        self.semantic_weight = semantic_weight
+        self._lock = threading.Lock()
+        self.tiers = {"grounded": 0, "ungrounded": 0, "llm": 0}
+
+    def _encode(self, texts, cached):
+        if not texts:
+            return np.zeros((0, 0), dtype="float32")
+        embedder = self.embedder if cached else getattr(self.embedder, "embedder", self.embedder)
+        vecs = np.asarray(embedder.encode(texts, show_progress_bar=False), dtype="float32")
+        return vecs / np.maximum(np.linalg.norm(vecs, axis=1, keepdims=True), 1e-12)
+
+    def sentence_support(self, answer, chunks):
+        """
+        (sentences, scores, sims) for one answer: the score of each sentence
+        and the sentence x chunk cosine matrix, from one matrix product.
+        """
+        sentences = split_sentences(answer)
+        texts = [c["chunk"] for c in chunks]
+        if not sentences or not texts:
+            return sentences, np.zeros(len(sentences)), np.zeros((len(sentences), len(texts)))
+        sims = self._encode(sentences, cached=False) @ self._encode(texts, cached=True).T
+        context = content_words(" ".join(texts))
+        lexical = []
+        for sentence in sentences:
+            words = content_words(sentence)
+            lexical.append(len(words & context) / len(words) if words else 1.0)
+        scores = self.semantic_weight * sims.max(axis=1) + (1 - self.semantic_weight) * np.asarray(lexical)
+        return sentences, scores, sims
+
+    def sentence_scores(self, answer, chunks):
+        """[(sentence, score)] for one answer against its retrieved chunks."""
+        sentences, scores, _ = self.sentence_support(answer, chunks)
+        return [(s, float(v)) for s, v in zip(sentences, scores)]
+
+    def score(self, answer, chunks):
+        """
+        Verdict dict like the LLM detector's, plus "tier" and "score", or
+        None when the answer is ambiguous.
+        """
+        if not answer.strip() or answer.strip().lower().startswith(_NOT_FOUND):
+            verdict = {"hallucination": False, "reason": None, "tier": "grounded", "score": None}
+        else:
+            scores = self.sentence_scores(answer, chunks)
+            sentence, worst = min(scores, key=lambda s: s[1])
+            if worst >= self.supported:
+                verdict = {"hallucination": False, "reason": None, "tier": "grounded", "score": worst}
+            elif worst < self.unsupported:
+                verdict = {
+                    "hallucination": True,
+                    "reason": f"Sentence not supported by the context (grounding {worst:.2f}): {sentence}",
+                    "tier": "ungrounded",
+                    "score": worst
+                }
+            else:
+                verdict = None
+        with self._lock:
+            self.tiers["llm" if verdict is None else verdict["tier"]] += 1
+        return verdict
+
+    def stats(self):
+        with self._lock:
+            total = sum(self.tiers.values())
+            return {
+                **self.tiers,
+                "llm_share": self.tiers["llm"] / total if total else 0.0,
+                "supported_threshold": self.supported,
+                "unsupported_threshold": self.unsupported
+            }
@@ -0,0 +1,284 @@
+# index_factory.py
+import os
+import time
+import numpy as np
+import faiss
+
+DEFAULT_INDEX = "flat"
+INDEX_TYPES = ("flat", "ivf", "ivfpq", "hnsw")
+TRAIN_SIZE = 100_000  # max vectors used to train IVF / PQ
+MIN_POINTS_PER_CENTROID = 39  # FAISS warns about k-means below this
+PQ_CENTROIDS = 256  # per sub-quantizer, PQ{m}x8
+EXACT_FILTER_BLOCK = 200_000  # allowed vectors reconstructed at a time by the exact fallback of a filtered search
+
+# ------------------------------------------------
+# BUILD
+# ------------------------------------------------
+def factory_string(spec, n, dim, n_train=None):
+    """
+    Turn a short index name into a FAISS factory string sized for n vectors,
+    trained on n_train of them (default all):
+      flat  -> Flat                 (exact, O(N) per query)
+      ivf   -> IVF{nlist},Flat      (tune with nprobe)
+      ivfpq -> IVF{nlist},PQ{m}x8   (compressed, tune with nprobe; IVF-Flat
+                                     below 39*256 training vectors)
+      hnsw  -> HNSW32               (graph, tune with efSearch)
+    Anything else is treated as a raw factory string.
+    """
+    name = spec.lower()
+    n_train = n if n_train is None else min(n, n_train)
+    # ~4*sqrt(N) lists, but at least 39 training points per centroid
+    nlist = max(1, min(int(4 * np.sqrt(n)), n_train // MIN_POINTS_PER_CENTROID))
+    if name == "flat":
+        return "Flat"
+    if name == "ivf":
+        return f"IVF{nlist},Flat"
+    if name == "ivfpq":
+        # every sub-quantizer runs k-means with 256 centroids on all training points
+        if n_train < MIN_POINTS_PER_CENTROID * PQ_CENTROIDS:
+            print(f"[index_factory] {n_train} training vectors are too few for PQ, using IVF-Flat")
+            return f"IVF{nlist},Flat"
+        m = next(m for m in (dim // 8, dim // 4, dim // 2, dim) if m and dim % m == 0)
+        return f"IVF{nlist},PQ{m}x8"
+    if name == "hnsw":
+        return "HNSW32"
+    return spec
+
+def needs_training(spec, dim):
+    return not faiss.index_factory(dim, factory_string(spec, TRAIN_SIZE, dim)).is_trained
+
+def create_index(spec, dim, train_vectors=None, n_hint=None, train_size=TRAIN_SIZE, seed=0):
+    """
+    Create an empty ID-mapped index, trained on a random sample of
+    train_vectors when the index type needs training.
+    """
+    n_given = len(train_vectors) if train_vectors is not None else 0
+    n_train = min(n_given, train_size)
+    n = n_hint or n_given
+    factory = factory_string(spec, n, dim, n_train=n_train or None)
+    inner = faiss.index_factory(dim, factory)
+    if not inner.is_trained:
+        if train_vectors is None or len(train_vectors) == 0:
+            raise ValueError(f"index '{factory}' needs training vectors")
+        sample = train_vectors
+        if len(sample) > train_size:
+            rng = np.random.default_rng(seed)
+            sample = sample[rng.choice(len(sample), train_size, replace=False)]
+        print(f"[index_factory] Training {factory} on {len(sample)} vectors...")
+        inner.train(np.ascontiguousarray(sample, dtype="float32"))
+    return faiss.IndexIDMap2(inner)
+
+def make_index(vectors, ids, spec=DEFAULT_INDEX, **kwargs):
+    index = create_index(spec, vectors.shape[1], train_vectors=vectors, **kwargs)
+    index.add_with_ids(vectors, ids)
+    return index
+
+def write_index(index, path):
+    """Write an index under a temporary name and rename it into place."""
+    tmp = f"{path}.tmp"
+    faiss.write_index(index, tmp)
+    os.replace(tmp, path)
+
+def index_kind(index):
+    """Short name of the index type behind an (optionally ID-mapped) index."""
+    inner = faiss.downcast_index(index.index) if isinstance(index, faiss.IndexIDMap) else index
+    if isinstance(inner, faiss.IndexHNSW):
+        return "hnsw"
+    if isinstance(inner, faiss.IndexIVFPQ):
+        return "ivfpq"
+    if isinstance(inner, faiss.IndexIVF):
+        return "ivf"
+    if isinstance(inner, faiss.IndexFlat):
+        return "flat"
+    return type(inner).__name__
+
+def index_vectors(index):
+    """
+    Read every stored vector in bulk. Returns (vectors, ids); ids are the
+    external ids for ID-mapped indexes. PQ indexes return their lossy
+    reconstructions.
+    """
+    if isinstance(index, faiss.IndexIDMap):
+        inner = faiss.downcast_index(index.index)
+        ids = faiss.vector_to_array(index.id_map).astype("int64")
+    else:
+        inner = index
+        ids = np.arange(index.ntotal, dtype="int64")
+    if index.ntotal == 0:
+        return np.zeros((0, index.d), dtype="float32"), ids
+    if isinstance(inner, faiss.IndexIVF):
+        inner.make_direct_map()
+        try:
+            vecs = inner.reconstruct_n(0, inner.ntotal)
+        finally:
+            # the array direct map blocks remove_ids, so do not keep it
+            inner.make_direct_map(False)
+    else:
+        vecs = inner.reconstruct_n(0, inner.ntotal)
+    return vecs, ids
+
+def iter_index_vectors(index, block_size=65536, start=0):
+    """
+    Like index_vectors, but yields (vectors, ids) blocks of at most
+    block_size rows, from row start on. Passes over one index may nest.
+    """
+    if isinstance(index, faiss.IndexIDMap):
+        inner = faiss.downcast_index(index.index)
+        ids = faiss.vector_to_array(index.id_map).astype("int64")
+    else:
+        inner = index
+        ids = np.arange(index.ntotal, dtype="int64")
+    # an enclosing pass may already hold the direct map; only drop our own
+    own_map = isinstance(inner, faiss.IndexIVF) and inner.direct_map.no()
+    if own_map:
+        inner.make_direct_map()
+    try:
+        for row in range(start, inner.ntotal, block_size):
+            n = min(block_size, inner.ntotal - row)
+            yield inner.reconstruct_n(row, n), ids[row:row + n]
+    finally:
+        if own_map:
+            inner.make_direct_map(False)
+
+def search_params(index, nprobe=None, ef_search=None, sel=None):
+    """
+    Per-query search parameters for IVF (nprobe) and HNSW (efSearch)
+    indexes, optionally restricted to the ids accepted by selector sel.
+    """
+    kind = index_kind(index)
+    inner = faiss.downcast_index(index.index) if isinstance(index, faiss.IndexIDMap) else index
+    # parameter objects carry their own defaults, so start from the index's
+    if kind in ("ivf", "ivfpq") and (nprobe or sel is not None):
+        params = faiss.SearchParametersIVF(nprobe=int(nprobe or inner.nprobe))
+    elif kind == "hnsw" and (ef_search or sel is not None):
+        params = faiss.SearchParametersHNSW(efSearch=int(ef_search or inner.hnsw.efSearch))
+    elif sel is not None:
+        params = faiss.SearchParameters()
+    else:
+        return None
+    if sel is not None:
+        params.sel = sel
+        params.referenced_objects = [sel]
+    return params
+
+def id_selector(ids):
+    """
+    FAISS selector accepting a sorted array of (external) ids: a bitmap
+    when the ids are dense enough, a hash set otherwise.
+    """
+    ids = np.asarray(ids, dtype="int64")
+    n_bytes = (int(ids[-1]) >> 3) + 1 if len(ids) else 1
+    # a bitmap costs one bit per possible id, the set roughly 8 bytes per id
+    if n_bytes <= 8 * len(ids):
+        bitmap = np.zeros(n_bytes, dtype="uint8")
+        np.bitwise_or.at(bitmap, ids >> 3, (1 << (ids & 7)).astype("uint8"))
+        sel = faiss.IDSelectorBitmap(n_bytes, faiss.swig_ptr(bitmap))
+        # the selector only points at the bitmap memory
+        sel.referenced_objects = [bitmap]
+        return sel
+    return faiss.IDSelectorBatch(ids)
+
+def filtered_search(index, queries, k, ids, nprobe=None, ef_search=None):
+    """
+    Search only among the given sorted ids. IVF probes and HNSW graph
+    walks can run out of allowed neighbours before finding k; those
+    queries are repeated over every IVF list, or exactly over the allowed
+    vectors in blocks of EXACT_FILTER_BLOCK, so each query gets
+    min(k, len(ids)) results.
+    """
+    sel = id_selector(ids)
+    distances, indices = index.search(queries, k, params=search_params(index, nprobe, ef_search, sel))
+    want = min(k, len(ids))
+    short = np.where((indices >= 0).sum(axis=1) < want)[0]
+    if not len(short):
+        return distances, indices
+
+    kind = index_kind(index)
+    if kind in ("ivf", "ivfpq"):
+        params = search_params(index, faiss.downcast_index(index.index).nlist, None, sel)
+        distances[short], indices[short] = index.search(queries[short], k, params=params)
+    else:
+        distances[short, :want], indices[short, :want] = _exact_search(index, queries[short], want, ids)
+    return distances, indices
+
+def _exact_search(index, queries, k, ids):
+    """Exact top k among the given ids, scanning their reconstructed vectors block by block."""
+    descending = index.metric_type == faiss.METRIC_INNER_PRODUCT
+    best_d = np.full((len(queries), k), -np.inf if descending else np.inf, dtype="float32")
+    best_i = np.full((len(queries), k), -1, dtype="int64")
+    for start in range(0, len(ids), EXACT_FILTER_BLOCK):
+        block = ids[start:start + EXACT_FILTER_BLOCK]
+        exact = faiss.IndexFlat(index.d, index.metric_type)
+        exact.add(index.reconstruct_batch(block))
+        d, i = exact.search(queries, min(k, len(block)))
+        # merge the block's top k into the running top k
+        d = np.hstack([best_d, d])
+        i = np.hstack([best_i, np.where(i >= 0, block[np.maximum(i, 0)], -1)])
+        order = np.argsort(-d if descending else d, axis=1, kind="stable")[:, :k]
+        best_d, best_i = np.take_along_axis(d, order, axis=1), np.take_along_axis(i, order, axis=1)
+    return best_d, best_i
+
+# ------------------------------------------------
+# BENCHMARK
+# ------------------------------------------------
+def _percentile_ms(samples, q):
+    return float(np.percentile(samples, q) * 1000.0)
+
+def benchmark(vectors, specs=INDEX_TYPES, k=10, n_queries=200,
+              nprobes=(1, 4, 16, 64), ef_searches=(16, 64, 256), seed=0):
+    """
+    Compare index types on the given corpus vectors. Queries are corpus
+    vectors with a little noise; recall@k is measured against exact
+    IndexFlatL2 results and latency is per single-query search.
+    """
+    vectors = np.ascontiguousarray(vectors, dtype="float32")
+    n, dim = vectors.shape
+    rng = np.random.default_rng(seed)
+    queries = vectors[rng.choice(n, min(n_queries, n), replace=False)]
+    queries = queries + rng.normal(0, 0.01 * vectors.std(), queries.shape).astype("float32")
+    k = min(k, n)
+
+    exact = faiss.IndexFlatL2(dim)
+    exact.add(vectors)
+    _, truth = exact.search(queries, k)
+
+    ids = np.arange(n, dtype="int64")
+    rows = []
+    for spec in specs:
+        t0 = time.perf_counter()
+        index = make_index(vectors, ids, spec)
+        build_s = time.perf_counter() - t0
+
+        kind = index_kind(index)
+        if kind in ("ivf", "ivfpq"):
+            settings = [{"nprobe": p} for p in nprobes if p <= faiss.downcast_index(index.index).nlist]
+        elif kind == "hnsw":
+            settings = [{"ef_search": e} for e in ef_searches]
+        else:
+            settings = [{}]
+
+        for setting in settings:
+            params = search_params(index, **setting)
+            latencies = []
+            hits = 0
+            for qi in range(len(queries)):
+                t = time.perf_counter()
+                _, found = index.search(queries[qi:qi + 1], k, params=params)
+                latencies.append(time.perf_counter() - t)
+                hits += len(np.intersect1d(found[0], truth[qi]))
+            rows.append({
+                "index": spec,
+                "factory": factory_string(spec, n, dim, n_train=TRAIN_SIZE),
+                **setting,
+                f"recall@{k}": hits / (k * len(queries)),
+                "p50_ms": _percentile_ms(latencies, 50),
+                "p99_ms": _percentile_ms(latencies, 99),
+                "build_s": build_s
+            })
+    return rows
+
+def print_benchmark(rows):
+    for r in rows:
+        setting = " ".join(f"{key}={r[key]}" for key in ("nprobe", "ef_search") if key in r)
+        recall = next(v for key, v in r.items() if key.startswith("recall@"))
+        print(f"{r['factory']:<24} {setting:<14} recall={recall:.3f} p50={r['p50_ms']:.3f}ms p99={r['p99_ms']:.3f}ms build={r['build_s']:.2f}s")
@@ -3,37 +3,144 @@ import os
 import json
 import time
 import shutil
+import hashlib
 from pathlib import Path
+from chunk_store import is_chunk_store, convert_json
+
+try:
+    import fcntl
+except ImportError:  # Windows: plain copies only
+    fcntl = None
+
+FICLONE = 0x40049409  # Linux ioctl: share extents copy-on-write (btrfs, XFS, ...)
 
 INDEX_DIR = Path("index_versions")
 MANIFEST = INDEX_DIR / "manifest.json"
+BLOB_DIR = INDEX_DIR / "blobs"
+KEEP_LAST = 5  # default retention for gc_versions
 
 INDEX_DIR.mkdir(exist_ok=True)
 
 def _now_tag():
     return time.strftime("%Y%m%dT%H%M%S")
 
-def save_version(index_path: str, metadata_path: str):
+def _read_manifest():
+    if MANIFEST.exists():
+        return json.loads(MANIFEST.read_text())
+    return {"versions": []}
+
+def _write_manifest(manifest):
+    # a crash mid-write must not leave a truncated manifest behind
+    tmp = MANIFEST.with_name(MANIFEST.name + ".tmp")
+    with open(tmp, "w") as f:
+        json.dump(manifest, f, indent=2)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp, MANIFEST)
+
+def atomic_copy(src, dest):
+    """
+    Copy src over dest via a temporary file and a rename, so a process that
+    has dest open (or memory-mapped) keeps reading the old file.
+    """
+    tmp = Path(dest).with_name(Path(dest).name + ".tmp")
+    shutil.copy2(src, tmp)
+    os.replace(tmp, dest)
+
+# ------------------------------------------------
+# BLOBS
+# ------------------------------------------------
+def file_hash(path):
+    h = hashlib.sha256()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(1 << 20), b""):
+            h.update(block)
+    return h.hexdigest()
+
+def blob_path(digest):
+    return BLOB_DIR / digest
+
+def _clone(src, dest):
     """
-    Atomically save a copy of the index and metadata to a new version folder.
+    Copy src to a new file dest, as a reflink where the filesystem supports
+    it (no data is copied) and a byte copy otherwise. Never a hardlink: the
+    two paths must not share an inode, or writing one would change the other.
+    """
+    with open(src, "rb") as fsrc, open(dest, "wb") as fdest:
+        if fcntl is not None:
+            try:
+                fcntl.ioctl(fdest.fileno(), FICLONE, fsrc.fileno())
+                return
+            except OSError:
+                pass  # other filesystem, or no reflink support
+        shutil.copyfileobj(fsrc, fdest, 1 << 20)
+
+def store_blob(path):
+    """
+    Add a file to the blob store under its sha256 and return the digest.
+    Identical files are stored once. The blob is its own copy (a reflink
+    where supported), so the live file stays writable and a later write to
+    it cannot change a saved version.
+    """
+    BLOB_DIR.mkdir(parents=True, exist_ok=True)
+    digest = file_hash(path)
+    blob = blob_path(digest)
+    if not blob.exists():
+        tmp = blob.with_name(digest + ".tmp")
+        tmp.unlink(missing_ok=True)
+        _clone(path, tmp)
+        if os.name == "posix":
+            # Windows refuses to rename over read-only files
+            os.chmod(tmp, 0o444)
+        os.replace(tmp, blob)
+    return digest
+
+def link_blob(digest, dest):
+    """
+    Put a copy of a blob (a reflink where supported) on dest under a
+    temporary name, then rename it over dest. Readers that still have the
+    old dest open or mapped keep their file, and dest is writable without
+    touching the blob.
+    """
+    tmp = Path(dest).with_name(Path(dest).name + ".tmp")
+    tmp.unlink(missing_ok=True)
+    _clone(blob_path(digest), tmp)
+    os.replace(tmp, dest)
+
+# ------------------------------------------------
+# VERSIONS
+# ------------------------------------------------
+def save_version(index_path: str, metadata_path: str, extra_files=None, info=None):
+    """
+    Record the current index and metadata as a new version. Files are kept
+    once in the content-addressed blob store; the manifest maps each version
+    to its blobs. extra_files maps further roles (e.g. "sparse") to paths
+    that belong to the same build; info (e.g. the embedding model) is
+    stored with the version.
     """
     tag = _now_tag()
-    version_folder = INDEX_DIR / tag
-    version_folder.mkdir(parents=True, exist_ok=False)
-    shutil.copy2(index_path, version_folder / Path(index_path).name)
-    shutil.copy2(metadata_path, version_folder / Path(metadata_path).name)
+    manifest = _read_manifest()
+    taken = {v["tag"] for v in manifest["versions"]}
+    # incremental builds can finish within the same second
+    n = 1
+    while tag in taken or (INDEX_DIR / tag).exists():
+        tag = f"{_now_tag()}-{n}"
+        n += 1
+    blobs = {"index": store_blob(index_path), "meta": store_blob(metadata_path)}
+    for role, path in (extra_files or {}).items():
+        blobs[role] = store_blob(path)
 
-    manifest = {"versions": []}
-    if MANIFEST.exists():
-        manifest = json.loads(MANIFEST.read_text())
+    manifest["active"] = tag
     manifest["versions"].append({
         "tag": tag,
-        "index_file": str(version_folder / Path(index_path).name),
-        "meta_file": str(version_folder / Path(metadata_path).name),
-        "ts": tag
+        "index_file": str(blob_path(blobs["index"])),
+        "meta_file": str(blob_path(blobs["meta"])),
+        "blobs": blobs,
+        "ts": tag,
+        **(info or {})
     })
-    MANIFEST.write_text(json.dumps(manifest, indent=2))
-    print(f"[index_manager] Saved version {tag}")
+    _write_manifest(manifest)
+    print(f"[index_manager] Saved version {tag} (index {blobs['index'][:12]}, meta {blobs['meta'][:12]})")
     return tag
 
 def list_versions():
@@ -42,13 +149,115 @@ def list_versions():
     manifest = json.loads(MANIFEST.read_text())
     return manifest.get("versions", [])
 
-def rollback_to(tag: str, dest_index_path: str, dest_meta_path: str):
-    manifest = json.loads(MANIFEST.read_text()) if MANIFEST.exists() else {}
+def active_version():
+    """Tag of the version currently on the live paths (None if unknown)."""
+    return _read_manifest().get("active")
+
+def version_info(tag):
+    """Manifest entry of a version ({} if unknown)."""
+    for v in list_versions():
+        if v["tag"] == tag:
+            return v
+    return {}
+
+def pin_version(tag: str, pinned=True):
+    """Pinned versions are never removed by gc_versions."""
+    manifest = _read_manifest()
+    for v in manifest.get("versions", []):
+        if v["tag"] == tag:
+            if pinned:
+                v["pinned"] = True
+            else:
+                v.pop("pinned", None)
+            _write_manifest(manifest)
+            print(f"[index_manager] {'Pinned' if pinned else 'Unpinned'} {tag}")
+            return True
+    print(f"[index_manager] Tag {tag} not found")
+    return False
+
+def _legacy_path(path):
+    # older manifests were written on Windows
+    return path if os.path.exists(path) else path.replace("\\", "/")
+
+def _restore_meta(src, dest):
+    # versions saved before the chunk store hold a metadata.json
+    if Path(dest).suffix != ".json" and not is_chunk_store(src):
+        convert_json(src, dest)
+    else:
+        atomic_copy(src, dest)
+
+def rollback_to(tag: str, dest_index_path: str, dest_meta_path: str, extra_paths=None):
+    """
+    Put a saved version back on the live paths. extra_paths maps the extra
+    roles passed to save_version to their live paths; a role the version
+    does not have is removed, so no file from another build is left behind.
+    """
+    manifest = _read_manifest()
     for v in manifest.get("versions", []):
         if v["tag"] == tag:
-            shutil.copy2(v["index_file"], dest_index_path)
-            shutil.copy2(v["meta_file"], dest_meta_path)
+            blobs = v.get("blobs")
+            if blobs:
+                link_blob(blobs["index"], dest_index_path)
+                if Path(dest_meta_path).suffix != ".json" and not is_chunk_store(blob_path(blobs["meta"])):
+                    convert_json(blob_path(blobs["meta"]), dest_meta_path)
+                else:
+                    link_blob(blobs["meta"], dest_meta_path)
+            else:
+                # versions saved as full copies before the blob store
+                atomic_copy(_legacy_path(v["index_file"]), dest_index_path)
+                _restore_meta(_legacy_path(v["meta_file"]), dest_meta_path)
+            for role, path in (extra_paths or {}).items():
+                if blobs and role in blobs:
+                    link_blob(blobs[role], path)
+                else:
+                    Path(path).unlink(missing_ok=True)
+            manifest["active"] = tag
+            _write_manifest(manifest)
             print(f"[index_manager] Rolled back to {tag}")
             return True
     print(f"[index_manager] Tag {tag} not found")
     return False
+
+def _remove(path):
+    path = Path(path)
+    if path.is_dir():
+        shutil.rmtree(path, onerror=lambda fn, p, _: (os.chmod(p, 0o644), fn(p)))
+    elif path.exists():
+        os.chmod(path, 0o644)
+        path.unlink()
+
+def gc_versions(keep_last=KEEP_LAST, dry_run=False):
+    """
+    Drop all but the newest keep_last versions. Pinned versions and the
+    active one are always kept. Blobs no longer referenced by any kept
+    version are deleted. Returns (removed tags, freed bytes).
+    """
+    manifest = _read_manifest()
+    versions = manifest.get("versions", [])
+    recent = {v["tag"] for v in versions[-keep_last:]} if keep_last > 0 else set()
+    keep = [v for v in versions
+            if v["tag"] in recent or v.get("pinned") or v["tag"] == manifest.get("active")]
+    drop = [v for v in versions if v not in keep]
+
+    live_blobs = {d for v in keep for d in v.get("blobs", {}).values()}
+    garbage = [INDEX_DIR / v["tag"] for v in drop if (INDEX_DIR / v["tag"]).exists()]
+    if BLOB_DIR.exists():
+        garbage += [p for p in BLOB_DIR.iterdir() if p.name not in live_blobs]
+
+    freed = 0
+    for p in garbage:
+        files = p.rglob("*") if p.is_dir() else [p]
+        # blobs hardlinked to a live path by older saves free nothing when unlinked here
+        freed += sum(f.stat().st_size for f in files if f.is_file() and f.stat().st_nlink == 1)
+    tags = [v["tag"] for v in drop]
+    if dry_run:
+        print(f"[index_manager] Would remove {len(tags)} versions, {len(garbage)} files/folders, {freed / 1e6:.1f} MB")
+        return tags, freed
+
+    # update the manifest first: a crash then only leaves unreferenced files
+    manifest["versions"] = keep
+    _write_manifest(manifest)
+    for p in garbage:
+        _remove(p)
+    print(f"[index_manager] Removed {len(tags)} versions, freed {freed / 1e6:.1f} MB; kept {len(keep)}")
+    return tags, freed
@@ -1,71 +1,25 @@
-import json
-import os
-import faiss
-import numpy as np
-from sentence_transformers import SentenceTransformer
+from index_factory import DEFAULT_INDEX
+from chunk_store import META_FILE
+from reindexer import build_index, DATA_FILE
+from sparse_index import SPARSE_FILE
+from attr_index import ATTR_FILE
 
-# Paths
-DATA_FILE = "data.jsonl"
+# Paths (DATA_FILE comes from reindexer)
 INDEX_FILE = "vector.index"
-META_FILE = "metadata.json"
+INDEX_TYPE = DEFAULT_INDEX  # flat, ivf, ivfpq, hnsw or a FAISS factory string
+EMBED_MODEL = "sentence-transformers/all-MiniLM-L6-v2"
 
-# Load embedding model
-print("Loading embedding model...")
-embedder = SentenceTransformer("sentence-transformers/all-MiniLM-L6-v2")
-
-# Load data
-print("Loading JSONL data...")
-docs = []
-with open(DATA_FILE, "r", encoding="utf-8") as f:
-    for line in f:
-        docs.append(json.loads(line))
-
-# Create chunks (simple version)
-def chunk_text(text, chunk_size=200):
-    words = text.split()
-    for i in range(0, len(words), chunk_size):
-        yield " ".join(words[i : i + chunk_size])
-
-# Build chunks and metadata
-chunks = []
-metadata = []
-
-print("Chunking documents...")
-for doc in docs:
-    for chunk in chunk_text(doc["text"]):
-        chunks.append(chunk)
-        metadata.append({
-            "doc_id": doc["id"],
-            "title": doc["title"],
-            "chunk": chunk
-        })
-
-print(f"Total chunks created: {len(chunks)}")
-
-# Embed all chunks
-print("Embedding chunks...")
-embeddings = embedder.encode(chunks, show_progress_bar=True)
-embeddings = np.array(embeddings).astype("float32")
-
-# Build FAISS index
-dim = embeddings.shape[1]
-index = faiss.IndexFlatL2(dim)
-
-print("Adding vectors to FAISS index...")
-index.add(embeddings)
-
-# Save index
-faiss.write_index(index, INDEX_FILE)
-
-# Save metadata
-with open(META_FILE, "w", encoding="utf-8") as f:
-    json.dump(metadata, f, indent=2)
+# Same pipeline as manage.py --reindex: stream documents -> chunks ->
+# embedded batches -> index + chunk store, then the sparse and attribute
+# indexes, and a version recording the embedding model
+print("Indexing JSONL data from", DATA_FILE)
+tag = build_index(EMBED_MODEL, persist_index_file=INDEX_FILE, persist_meta_file=META_FILE,
+                  index_type=INDEX_TYPE, persist_sparse_file=SPARSE_FILE, persist_attr_file=ATTR_FILE)
 
 print("✓ Indexing complete")
 print("Saved:")
 print(" -", INDEX_FILE)
 print(" -", META_FILE)
-
-from index_manager import save_version
-save_version("vector.index", "metadata.json")
-print("✓ Versioned copy saved.")
\ No newline at end of file
+print(" -", SPARSE_FILE)
+print(" -", ATTR_FILE)
+print("✓ Versioned copy saved:", tag)
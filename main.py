@@ -1,6 +1,5 @@
 from retriever import Retriever
 from detector_healer import DetectorHealer
-from transformers import pipeline
 
 # ------------------------------------------------
 # LOAD MODULES
@@ -10,37 +9,16 @@ print("\nInitializing system...")
 retriever = Retriever(top_k=3)
 healer = DetectorHealer()
 
-print("Loading LLM for answer generation...")
-generator = pipeline(
-    "text2text-generation",
-    model="google/flan-t5-large",
-    max_new_tokens=300
-)
-
 print("\nSystem Ready ✔\n")
 
 # ------------------------------------------------
 # RAG ANSWER GENERATION
 # ------------------------------------------------
 def generate_answer(question, retrieved_chunks):
-    context = "\n\n".join([chunk["chunk"] for chunk in retrieved_chunks])
-
-    prompt = f"""
-You are an AI assistant. 
-Answer the user's question using ONLY the provided context. 
-Do NOT hallucinate. If the answer is not present, say "Information not found".
-
-QUESTION:
-{question}
-
-CONTEXT:
-{context}
-
-ANSWER:
-    """
-
-    output = generator(prompt)[0]["generated_text"]
-    return output.strip()
+    # best chunks that fit in flan-t5's input window next to ANSWER_PROMPT,
+    # the prompt healer.generate_answer sends
+    context, _ = healer.fit_context(question, retrieved_chunks)
+    return healer.generate_answer(question, context)
 
 # ------------------------------------------------
 # MAIN LOOP
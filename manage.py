@@ -1,27 +1,58 @@
 # manage.py
 import argparse
-from reindexer import build_index
+from reindexer import build_index, extra_paths, INDEX_OUT, META_OUT
 from monitor import run_monitor_sample
 from self_debug_agent import summarize_and_suggest, load_report
-from index_manager import list_versions, rollback_to
+from index_manager import list_versions, rollback_to, pin_version, gc_versions, KEEP_LAST
 
 parser = argparse.ArgumentParser()
 parser.add_argument("--reindex", action="store_true")
+parser.add_argument("--incremental", action="store_true", help="with --reindex: only embed added/changed chunks")
+parser.add_argument("--workers", type=int, default=1, help="with --reindex: embedding worker processes")
+parser.add_argument("--batch-size", type=int, default=256, help="with --reindex: chunks embedded per batch")
+parser.add_argument("--resume", action="store_true", help="with --reindex: continue a crashed build from its checkpoint")
+parser.add_argument("--shards", type=int, default=1, help="with --reindex: also split the index into this many shards")
+parser.add_argument("--index-type", default="flat", help="with --reindex: flat, ivf, ivfpq, hnsw or a FAISS factory string")
+parser.add_argument("--bench-index", type=str, help="comma-separated index types to benchmark against flat, e.g. ivf,ivfpq,hnsw")
+parser.add_argument("--bench-k", type=int, default=10)
 parser.add_argument("--monitor", action="store_true")
 parser.add_argument("--advice", action="store_true")
 parser.add_argument("--list-versions", action="store_true")
 parser.add_argument("--rollback", type=str, help="rollback to tag")
+parser.add_argument("--pin", type=str, help="keep this tag through --gc")
+parser.add_argument("--unpin", type=str)
+parser.add_argument("--gc", action="store_true", help="remove old versions and unreferenced blobs")
+parser.add_argument("--keep-last", type=int, default=KEEP_LAST, help="with --gc: versions to keep besides pinned/active")
+parser.add_argument("--dry-run", action="store_true", help="with --gc: only report what would be removed")
+parser.add_argument("--convert-meta", action="store_true", help="convert metadata.json into the chunk store")
 
-args = parser.parse_args()
-if args.reindex:
-    build_index()
-if args.monitor:
-    run_monitor_sample()
-if args.advice:
-    from self_debug_agent import load_report, summarize_and_suggest
-    r = load_report()
-    print(summarize_and_suggest(r))
-if args.list_versions:
-    print(list_versions())
-if args.rollback:
-    rollback_to(args.rollback, "vector.index", "metadata.json")
+if __name__ == "__main__":
+    args = parser.parse_args()
+    if args.reindex:
+        build_index(incremental=args.incremental, index_type=args.index_type,
+                    batch_size=args.batch_size, resume=args.resume, workers=args.workers,
+                    shards=args.shards)
+    if args.bench_index:
+        import faiss
+        from index_factory import benchmark, print_benchmark, index_vectors
+        vectors, _ = index_vectors(faiss.read_index("vector.index"))
+        print_benchmark(benchmark(vectors, ["flat"] + args.bench_index.split(","), k=args.bench_k))
+    if args.monitor:
+        run_monitor_sample()
+    if args.advice:
+        from self_debug_agent import load_report, summarize_and_suggest
+        r = load_report()
+        print(summarize_and_suggest(r))
+    if args.list_versions:
+        print(list_versions())
+    if args.rollback:
+        rollback_to(args.rollback, INDEX_OUT, META_OUT, extra_paths=extra_paths(args.rollback))
+    if args.pin:
+        pin_version(args.pin)
+    if args.unpin:
+        pin_version(args.unpin, pinned=False)
+    if args.gc:
+        gc_versions(keep_last=args.keep_last, dry_run=args.dry_run)
+    if args.convert_meta:
+        from chunk_store import convert_json
+        convert_json()
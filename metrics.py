@@ -0,0 +1,155 @@
+# metrics.py
+import time
+import bisect
+import threading
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+# seconds; wide enough for a sub-millisecond FAISS search and a 30 s generation
+BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+_METRICS = {}
+_METRICS_LOCK = threading.Lock()
+# stage -> milliseconds for the request being served on this thread, if collected
+_TIMINGS = ContextVar("rag_timings", default=None)
+
+def _labels(key):
+    return ",".join(f'{k}="{v}"' for k, v in key)
+
+def _fmt(value):
+    return repr(float(value)) if value != float("inf") else "+Inf"
+
+class Counter:
+    def __init__(self, name, doc):
+        self.name = name
+        self.doc = doc
+        self._lock = threading.Lock()
+        self._values = {}
+
+    def inc(self, amount=1, **labels):
+        key = tuple(sorted(labels.items()))
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.doc}", f"# TYPE {self.name} counter"]
+        with self._lock:
+            for key, value in sorted(self._values.items()):
+                lines.append(f"{self.name}{{{_labels(key)}}} {_fmt(value)}" if key else f"{self.name} {_fmt(value)}")
+        return lines
+
+class Histogram:
+    """Cumulative-bucket histogram; observe() is one bisect and a few adds under a lock."""
+
+    def __init__(self, name, doc, buckets=BUCKETS):
+        self.name = name
+        self.doc = doc
+        self.buckets = tuple(buckets)
+        self._lock = threading.Lock()
+        self._series = {}  # labels -> [bucket counts..., +Inf count, sum]
+
+    def observe(self, value, **labels):
+        key = tuple(sorted(labels.items()))
+        i = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            series = self._series.get(key)
+            if series is None:
+                series = self._series[key] = [0] * (len(self.buckets) + 1) + [0.0]
+            series[i] += 1
+            series[-1] += value
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.doc}", f"# TYPE {self.name} histogram"]
+        with self._lock:
+            series = sorted((key, list(s)) for key, s in self._series.items())
+        for key, s in series:
+            prefix = _labels(key) + "," if key else ""
+            total = 0
+            for bound, n in zip(self.buckets + (float("inf"),), s[:-1]):
+                total += n
+                lines.append(f'{self.name}_bucket{{{prefix}le="{_fmt(bound)}"}} {total}')
+            suffix = f"{{{_labels(key)}}}" if key else ""
+            lines.append(f"{self.name}_sum{suffix} {_fmt(s[-1])}")
+            lines.append(f"{self.name}_count{suffix} {total}")
+        return lines
+
+class Gauge:
+    """Value read from fn() at scrape time; fn returns [(labels dict, value)]."""
+
+    def __init__(self, name, doc, fn):
+        self.name = name
+        self.doc = doc
+        self.fn = fn
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.doc}", f"# TYPE {self.name} gauge"]
+        try:
+            samples = self.fn()
+        except Exception:
+            samples = []
+        for labels, value in samples:
+            key = tuple(sorted(labels.items()))
+            lines.append(f"{self.name}{{{_labels(key)}}} {_fmt(value)}" if key else f"{self.name} {_fmt(value)}")
+        return lines
+
+def _register(metric):
+    with _METRICS_LOCK:
+        return _METRICS.setdefault(metric.name, metric)
+
+def counter(name, doc):
+    return _register(Counter(name, doc))
+
+def histogram(name, doc, buckets=BUCKETS):
+    return _register(Histogram(name, doc, buckets))
+
+def gauge(name, doc, fn):
+    with _METRICS_LOCK:
+        _METRICS[name] = Gauge(name, doc, fn)
+    return _METRICS[name]
+
+def render():
+    """All metrics in the Prometheus text exposition format."""
+    with _METRICS_LOCK:
+        metrics = list(_METRICS.values())
+    lines = []
+    for m in metrics:
+        lines.extend(m.render())
+    return "\n".join(lines) + "\n"
+
+# ------------------------------------------------
+# PIPELINE METRICS
+# ------------------------------------------------
+STAGE_SECONDS = histogram("rag_stage_seconds", "Wall time of each pipeline stage.")
+ANSWERS = counter("rag_answers_total", "Answers by detector outcome (passed or healed).")
+DETECTIONS = counter("rag_detections_total", "Detector verdicts by tier (grounded, ungrounded, llm).")
+TOKENS = counter("rag_model_tokens_total", "Generator tokens by direction (input or output).")
+CONTEXT_TOKENS = counter("rag_context_tokens_total", "Retrieved-chunk tokens packed into prompts (used) or left out (dropped).")
+
+def record(stage, seconds):
+    """Add a stage duration to the histogram and to the current request's timings."""
+    STAGE_SECONDS.observe(seconds, stage=stage)
+    timings = _TIMINGS.get()
+    if timings is not None:
+        timings[stage] = timings.get(stage, 0.0) + seconds * 1000.0
+
+@contextmanager
+def span(stage):
+    t = time.perf_counter()
+    try:
+        yield
+    finally:
+        record(stage, time.perf_counter() - t)
+
+@contextmanager
+def collect_timings():
+    """
+    Collect the spans recorded on this thread (and its context) into a
+    {stage: ms} dict. Stages that run inside a micro-batch on another
+    thread only show up as the time spent waiting for the batch.
+    """
+    timings = {}
+    token = _TIMINGS.set(timings)
+    try:
+        yield timings
+    finally:
+        _TIMINGS.reset(token)
@@ -0,0 +1,216 @@
+# model_registry.py
+import gc
+import os
+import time
+import threading
+import importlib.util
+from pathlib import Path
+from collections import OrderedDict
+
+# Resident size of unpinned models above which the least recently used ones
+# are dropped. 0 means no limit.
+MEMORY_BUDGET_MB = float(os.getenv("RAG_MODEL_MEMORY_MB", "0"))
+
+# Inference backend per model:
+#   fp32 - plain PyTorch
+#   int8 - PyTorch with dynamic int8 quantization of the Linear layers
+#   onnx - ONNX Runtime session (needs optimum[onnxruntime])
+# RAG_MODEL_BACKEND sets the default, RAG_MODEL_BACKENDS overrides it per model,
+# e.g. "google/flan-t5-large=int8,sentence-transformers/all-MiniLM-L6-v2=onnx".
+# Compare them first with bench_backends.py.
+BACKENDS = ("fp32", "int8", "onnx")
+DEFAULT_BACKEND = os.getenv("RAG_MODEL_BACKEND", "fp32")
+MODEL_BACKENDS = dict(
+    item.strip().rsplit("=", 1) for item in os.getenv("RAG_MODEL_BACKENDS", "").split(",") if "=" in item
+)
+ONNX_DIR = Path("onnx_models")  # exported seq2seq models, reused across runs
+
+# transformers reads safetensors checkpoints (both default models ship them)
+# through mmap; with accelerate installed, low_cpu_mem_usage also skips the
+# random init and the extra copy of every weight, which roughly halves load time.
+FAST_LOAD = {"low_cpu_mem_usage": True} if importlib.util.find_spec("accelerate") else {}
+
+def backend_for(model_name):
+    backend = MODEL_BACKENDS.get(model_name, DEFAULT_BACKEND)
+    if backend not in BACKENDS:
+        raise ValueError(f"unknown backend '{backend}' for {model_name}, expected one of {BACKENDS}")
+    return backend
+
+def model_key(model_name, backend=None):
+    """
+    Name to key cached embeddings and chunk hashes by: vectors from a
+    quantized or ONNX model differ slightly from fp32 ones.
+    """
+    backend = backend or backend_for(model_name)
+    return model_name if backend == "fp32" else f"{model_name}@{backend}"
+
+def _quantize(module):
+    import torch
+    return torch.ao.quantization.quantize_dynamic(module, {torch.nn.Linear}, dtype=torch.qint8, inplace=True)
+
+def _load_pipeline(task, model_name, backend):
+    from transformers import pipeline
+    if backend == "onnx":
+        try:
+            from optimum.onnxruntime import ORTModelForSeq2SeqLM
+        except ImportError as e:
+            raise ImportError("the onnx backend needs optimum[onnxruntime]") from e
+        from transformers import AutoTokenizer
+        export_dir = ONNX_DIR / model_name.replace("/", "__")
+        if export_dir.exists():
+            model = ORTModelForSeq2SeqLM.from_pretrained(export_dir)
+        else:
+            print(f"[model_registry] Exporting {model_name} to ONNX in {export_dir}...")
+            model = ORTModelForSeq2SeqLM.from_pretrained(model_name, export=True)
+            model.save_pretrained(export_dir)
+        return pipeline(task, model=model, tokenizer=AutoTokenizer.from_pretrained(model_name))
+    pipe = pipeline(task, model=model_name, model_kwargs=dict(FAST_LOAD))
+    if backend == "int8":
+        pipe.model = _quantize(pipe.model)
+    return pipe
+
+def _load_sentence_transformer(task, model_name, backend):
+    from sentence_transformers import SentenceTransformer
+    if backend == "onnx":
+        return SentenceTransformer(model_name, backend="onnx")
+    model = SentenceTransformer(model_name, model_kwargs=dict(FAST_LOAD))
+    return _quantize(model) if backend == "int8" else model
+
+def _load_tokenizer(task, model_name, backend):
+    # backend-independent, but keyed like the rest
+    from transformers import AutoTokenizer
+    return AutoTokenizer.from_pretrained(model_name)
+
+LOADERS = {
+    "sentence-embedding": _load_sentence_transformer,
+    "tokenizer": _load_tokenizer,
+}
+
+def _tensor_bytes(value):
+    if hasattr(value, "element_size"):
+        return value.numel() * value.element_size()
+    if isinstance(value, (tuple, list)):
+        # quantized Linear layers keep (weight, bias) packed together
+        return sum(_tensor_bytes(v) for v in value)
+    return 0
+
+def model_bytes(model):
+    """Size of the torch weights behind a model or pipeline (0 if unknown, e.g. ONNX)."""
+    module = getattr(model, "model", model)
+    try:
+        state = module.state_dict()
+    except (AttributeError, TypeError):
+        return 0
+    return sum(_tensor_bytes(v) for v in state.values())
+
+class ModelRegistry:
+    """
+    Process-wide cache of loaded models keyed by (task, model name, backend).
+
+    get() loads a model on first use and returns the same instance to
+    every caller afterwards. Loads of different models run in parallel;
+    concurrent requests for the same one wait for a single load.
+    unload() drops a model; with a memory budget, the least recently used
+    unpinned models are dropped after each load until the rest fits.
+    Memory is only released once callers stop holding the instance, so
+    long-lived holders should pin what they keep and others should call
+    get() per use.
+    """
+
+    def __init__(self, budget_mb=MEMORY_BUDGET_MB):
+        self.budget_bytes = int(budget_mb * 1e6)
+        self._lock = threading.Lock()
+        self._key_locks = {}
+        self._models = OrderedDict()  # key -> entry, least recently used first
+        self.loads = 0
+        self.evictions = 0
+
+    def get(self, task, model_name, pin=False, backend=None):
+        backend = backend or backend_for(model_name)
+        key = (task, model_name, backend)
+        with self._lock:
+            entry = self._touch(key, pin)
+            if entry is not None:
+                return entry["model"]
+            key_lock = self._key_locks.setdefault(key, threading.Lock())
+
+        with key_lock:
+            with self._lock:
+                entry = self._touch(key, pin)
+                if entry is not None:
+                    return entry["model"]
+            print(f"[model_registry] Loading {task} model {model_name} ({backend})...")
+            t = time.perf_counter()
+            model = LOADERS.get(task, _load_pipeline)(task, model_name, backend)
+            size = model_bytes(model)
+            print(f"[model_registry] Loaded {model_name} in {time.perf_counter() - t:.1f}s ({size / 1e6:.0f} MB)")
+            with self._lock:
+                self._models[key] = {"model": model, "bytes": size, "pinned": pin, "last_used": time.time()}
+                self.loads += 1
+                self._evict(keep=key)
+        return model
+
+    def put(self, task, model_name, model, pin=False, backend=None):
+        """Register an already built model (e.g. an offline stand-in) so get() returns it."""
+        key = (task, model_name, backend or backend_for(model_name))
+        with self._lock:
+            self._models[key] = {"model": model, "bytes": model_bytes(model), "pinned": pin, "last_used": time.time()}
+            self._models.move_to_end(key)
+            self._evict(keep=key)
+        return model
+
+    def _touch(self, key, pin):
+        entry = self._models.get(key)
+        if entry is not None:
+            self._models.move_to_end(key)
+            entry["last_used"] = time.time()
+            entry["pinned"] = entry["pinned"] or pin
+        return entry
+
+    def _evict(self, keep):
+        if not self.budget_bytes:
+            return
+        unpinned = lambda: [k for k, e in self._models.items() if not e["pinned"] and k != keep]
+        total = lambda: sum(e["bytes"] for e in self._models.values() if not e["pinned"])
+        while total() > self.budget_bytes and unpinned():
+            key = unpinned()[0]
+            del self._models[key]
+            self.evictions += 1
+            print(f"[model_registry] Evicted {key[1]} ({key[0]}, {key[2]}) to stay under {self.budget_bytes / 1e6:.0f} MB")
+        gc.collect()
+
+    def unload(self, task, model_name, backend=None):
+        with self._lock:
+            entry = self._models.pop((task, model_name, backend or backend_for(model_name)), None)
+        if entry is None:
+            return False
+        del entry
+        gc.collect()
+        print(f"[model_registry] Unloaded {model_name} ({task})")
+        return True
+
+    def stats(self):
+        with self._lock:
+            now = time.time()
+            return {
+                "models": [{
+                    "task": task,
+                    "model": name,
+                    "backend": backend,
+                    "mb": round(e["bytes"] / 1e6, 1),
+                    "pinned": e["pinned"],
+                    "idle_s": round(now - e["last_used"], 1)
+                } for (task, name, backend), e in self._models.items()],
+                "total_mb": round(sum(e["bytes"] for e in self._models.values()) / 1e6, 1),
+                "budget_mb": self.budget_bytes / 1e6 or None,
+                "loads": self.loads,
+                "evictions": self.evictions
+            }
+
+REGISTRY = ModelRegistry()
+
+def get_model(task, model_name, pin=False, backend=None):
+    return REGISTRY.get(task, model_name, pin=pin, backend=backend)
+
+def unload_model(task, model_name, backend=None):
+    return REGISTRY.unload(task, model_name, backend=backend)
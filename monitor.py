@@ -1,19 +1,17 @@
 # monitor.py
 import json
 import numpy as np
-from sentence_transformers import SentenceTransformer
 import faiss
 from pathlib import Path
-from sklearn.metrics.pairwise import cosine_similarity
+from chunk_store import load_chunks
+from index_factory import iter_index_vectors, search_params
 import time
 
-META_FILE = "metadata.json"
 INDEX_FILE = "vector.index"
 REPORT_FILE = "monitor_report.json"
 
 def load_meta():
-    with open(META_FILE, "r", encoding="utf-8") as f:
-        return json.load(f)
+    return load_chunks()
 
 def check_schema(expected_keys=("doc_id","title","chunk")):
     meta = load_meta()
@@ -24,51 +22,163 @@ def check_schema(expected_keys=("doc_id","title","chunk")):
                 problems.append({"idx": i, "missing_key": k, "meta": m})
     return problems
 
-def detect_duplicate_embeddings(sample_n=500, sim_threshold=0.93):
+class _Clusters:
+    """Union-find over chunk ids, merging pairs as they arrive and keeping each cluster's highest similarity."""
+
+    def __init__(self):
+        self.parent = {}
+        self.best = {}
+
+    def find(self, x):
+        parent = self.parent
+        root = x
+        while parent.setdefault(root, root) != root:
+            root = parent[root]
+        while parent[x] != root:
+            parent[x], x = root, parent[x]
+        return root
+
+    def add(self, ids_a, ids_b, sims):
+        for i, j, sim in zip(ids_a, ids_b, sims):
+            ri, rj = self.find(i), self.find(j)
+            if ri != rj:
+                self.parent[ri] = rj
+                sim = max(sim, self.best.pop(ri, 0.0))
+            self.best[rj] = max(self.best.get(rj, 0.0), sim)
+
+    def groups(self):
+        """[(sorted member ids, max similarity)] per cluster."""
+        groups = {}
+        for x in self.parent:
+            groups.setdefault(self.find(x), []).append(x)
+        return [(sorted(members), self.best[r]) for r, members in groups.items()]
+
+def _normalized(vecs):
+    vecs = np.array(vecs, dtype="float32")
+    faiss.normalize_L2(vecs)
+    return vecs
+
+def _exact_pairs(idx, sim_threshold, block_size, found):
+    """Every pair at or above sim_threshold, comparing two blocks of vectors at a time."""
+    rows = range(0, idx.ntotal, block_size)
+    for start, (a, ids_a) in zip(rows, iter_index_vectors(idx, block_size)):
+        a = _normalized(a)
+        # blocks before this one were compared against it already
+        for b, ids_b in iter_index_vectors(idx, block_size, start=start):
+            block = faiss.IndexFlatIP(idx.d)
+            block.add(_normalized(b))
+            lims, sims, nbrs = block.range_search(a, sim_threshold)
+            src = ids_a[np.repeat(np.arange(len(a)), np.diff(lims).astype("int64"))]
+            nbrs = ids_b[nbrs]
+            keep = src != nbrs
+            found.add(src[keep].tolist(), nbrs[keep].tolist(), sims[keep].tolist())
+
+def _neighbour_pairs(idx, sim_threshold, block_size, k, nprobe, found):
+    """
+    Pairs among each vector's k nearest neighbours, searched in the index
+    itself. Cosine similarity comes from the returned distances and the
+    vectors' norms, so it is as approximate as the index.
     """
-    Load up to sample_n vectors from FAISS by reconstructing them.
-    FAISS IndexFlatL2 supports reconstruct(i) to get vectors.
+    ids = np.empty(idx.ntotal, dtype="int64")
+    norms = np.empty(idx.ntotal, dtype="float32")
+    for start, (vecs, block_ids) in zip(range(0, idx.ntotal, block_size), iter_index_vectors(idx, block_size)):
+        ids[start:start + len(block_ids)] = block_ids
+        norms[start:start + len(block_ids)] = np.linalg.norm(vecs, axis=1)
+    order = np.argsort(ids)
+    ids, norms = ids[order], norms[order]
+
+    params = search_params(idx, nprobe=nprobe, ef_search=max(64, 2 * k))
+    for vecs, block_ids in iter_index_vectors(idx, block_size):
+        vecs = np.ascontiguousarray(vecs, dtype="float32")
+        dist, nbrs = idx.search(vecs, min(k + 1, idx.ntotal), params=params)
+        na = np.linalg.norm(vecs, axis=1)[:, None]
+        nb = norms[np.searchsorted(ids, np.maximum(nbrs, 0))]
+        if idx.metric_type == faiss.METRIC_INNER_PRODUCT:
+            dots = dist
+        else:
+            # squared L2: |a - b|^2 = |a|^2 + |b|^2 - 2 a.b
+            dots = (na ** 2 + nb ** 2 - dist) / 2
+        sims = dots / np.maximum(na * nb, 1e-12)
+        src = np.broadcast_to(block_ids[:, None], nbrs.shape)
+        # neighbour lists are not symmetric, so a pair may only be found from
+        # one side; repeats from the other side are no-ops in the union-find
+        keep = (nbrs >= 0) & (sims >= sim_threshold) & (src != nbrs)
+        found.add(src[keep].tolist(), nbrs[keep].tolist(), sims[keep].tolist())
+
+def detect_duplicate_embeddings(sim_threshold=0.93, block_size=16384, exact_limit=200_000,
+                                k=10, nprobe=16, max_clusters=100, index_file=INDEX_FILE):
+    """
+    Find clusters of near-duplicate chunks (cosine similarity >= sim_threshold)
+    over the whole index.
+
+    Up to exact_limit vectors every pair is compared: each block of
+    normalised vectors is range-searched against every later block. Beyond
+    that each block is searched against the index itself for its k nearest
+    neighbours (nprobe lists for IVF). Pairs go straight into a union-find.
+
+    Vectors are streamed from the index, memory-mapped where FAISS supports
+    it, so besides the index only O(block_size * d) floats are held, plus
+    12 bytes per vector of norms for the neighbour search and the
+    union-find over duplicated ids.
     """
-    idx = faiss.read_index(INDEX_FILE)
-    ntotal = idx.ntotal
-    n = min(sample_n, ntotal)
-    duplicates = []
-    if n <= 1:
-        return duplicates
-
-    # pick evenly spaced ids
-    ids = np.linspace(0, ntotal-1, n).astype(int)
-    vecs = np.array([idx.reconstruct(int(i)) for i in ids]).astype("float32")
-    sims = cosine_similarity(vecs)
-    # only check upper triangle
-    for i in range(n):
-        for j in range(i+1, n):
-            if sims[i,j] > sim_threshold:
-                duplicates.append({"i": int(ids[i]), "j": int(ids[j]), "sim": float(sims[i,j])})
-    return duplicates
-
-def retrieval_health_check(queries, top_k=3, embed_model="sentence-transformers/all-MiniLM-L6-v2"):
-    from retriever import Retriever
-    r = Retriever(top_k=top_k)
+    t0 = time.perf_counter()
+    idx = faiss.read_index(index_file, faiss.IO_FLAG_MMAP)
+    n = idx.ntotal
+    exact = n <= exact_limit
+    found = _Clusters()
+    if exact:
+        _exact_pairs(idx, sim_threshold, block_size, found)
+    else:
+        _neighbour_pairs(idx, sim_threshold, block_size, k, nprobe, found)
+    del idx
+
+    clusters = sorted(found.groups(), key=lambda c: (-len(c[0]), -c[1]))
+    meta = load_meta()
+    report = {
+        "n_vectors": n,
+        "threshold": sim_threshold,
+        "method": "exact" if exact else "neighbours",
+        "n_clusters": len(clusters),
+        # chunks that could be dropped, keeping one per cluster
+        "n_redundant": sum(len(m) - 1 for m, _ in clusters),
+        "clusters": [{
+            "ids": members,
+            "doc_ids": sorted({str((meta.get(i) or {}).get("doc_id")) for i in members}),
+            "max_sim": round(sim, 4)
+        } for members, sim in clusters[:max_clusters]],
+        "runtime_s": round(time.perf_counter() - t0, 3)
+    }
+    print(f"[monitor] {report['n_clusters']} duplicate clusters among {n} vectors "
+          f"({report['method']}, {report['runtime_s']}s)")
+    return report
+
+def retrieval_health_check(queries, top_k=3, embed_model="sentence-transformers/all-MiniLM-L6-v2", retriever=None):
+    """Pass the serving retriever to avoid loading a second model and index."""
+    if retriever is None:
+        from retriever import Retriever
+        retriever = Retriever(top_k=top_k)
     results = {}
     for q in queries:
-        res = r.search(q)
-        # simple metric: average distance
+        t = time.perf_counter()
+        res = retriever.search(q, top_k=top_k)
+        ms = (time.perf_counter() - t) * 1000.0
+        # simple metric: average score, meaningful only next to its kind
         avg = sum([r["score"] for r in res]) / max(1, len(res))
-        results[q] = {"avg_score": avg, "top_k": len(res)}
+        results[q] = {"avg_score": avg, "score_kind": res[0]["score_kind"] if res else None,
+                      "top_k": len(res), "latency_ms": ms}
     return results
 
-def run_monitor_sample():
+def run_monitor_sample(retriever=None):
     out = {"ts": time.strftime("%Y%m%dT%H%M%S")}
     out["schema_problems"] = check_schema()
-    out["duplicates_sample"] = detect_duplicate_embeddings()
+    out["duplicates"] = detect_duplicate_embeddings()
     # example queries to test retrieval health
     sample_queries = [
         "What is photosynthesis?",
         "Explain neural networks",
         "What is blockchain?"
     ]
-    out["retrieval_health"] = retrieval_health_check(sample_queries)
+    out["retrieval_health"] = retrieval_health_check(sample_queries, retriever=retriever)
     Path(REPORT_FILE).write_text(json.dumps(out, indent=2))
     print("[monitor] Report written to", REPORT_FILE)
     return out
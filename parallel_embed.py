@@ -0,0 +1,71 @@
+# parallel_embed.py
+import os
+import time
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+import numpy as np
+
+_embedder = None
+
+def _init_worker(model_name, threads):
+    global _embedder
+    import torch
+    from model_registry import get_model
+    # workers x threads should not exceed the cores we have
+    torch.set_num_threads(threads)
+    # same backend as the parent (configured through the environment)
+    _embedder = get_model("sentence-embedding", model_name)
+
+def _embed_shard(texts):
+    t = time.perf_counter()
+    vecs = _embedder.encode(texts, show_progress_bar=False)
+    return os.getpid(), np.asarray(vecs, dtype="float32"), time.perf_counter() - t
+
+class ParallelEmbedder:
+    """
+    encode()-compatible embedder that splits each call into one shard per
+    worker process. Every worker holds its own copy of the model; shard
+    results are concatenated in input order, so the output is the same as
+    a single-process encode().
+    """
+
+    def __init__(self, model_name, workers, threads_per_worker=None):
+        self.model_name = model_name
+        self.workers = workers
+        threads = threads_per_worker or max(1, (os.cpu_count() or 1) // workers)
+        print(f"[parallel_embed] Starting {workers} workers x {threads} torch threads for {model_name}")
+        # torch does not survive fork() reliably
+        self.pool = ProcessPoolExecutor(
+            max_workers=workers,
+            mp_context=multiprocessing.get_context("spawn"),
+            initializer=_init_worker,
+            initargs=(model_name, threads)
+        )
+        self.dim = None
+        self.per_worker = {}
+
+    def encode(self, texts, **kwargs):
+        texts = list(texts)
+        if not texts:
+            return np.zeros((0, self.dim or 0), dtype="float32")
+        shard = -(-len(texts) // self.workers)
+        shards = [texts[i:i + shard] for i in range(0, len(texts), shard)]
+        parts = []
+        # map() yields results in submission order
+        for pid, vecs, secs in self.pool.map(_embed_shard, shards):
+            n, total = self.per_worker.get(pid, (0, 0.0))
+            self.per_worker[pid] = (n + len(vecs), total + secs)
+            parts.append(vecs)
+        out = np.concatenate(parts)
+        self.dim = out.shape[1]
+        return out
+
+    def get_sentence_embedding_dimension(self):
+        return self.dim
+
+    def report(self):
+        for i, (pid, (n, secs)) in enumerate(sorted(self.per_worker.items())):
+            print(f"[parallel_embed] worker {i} (pid {pid}): {n} chunks, {n / max(secs, 1e-9):.1f} chunks/s")
+
+    def close(self):
+        self.pool.shutdown()
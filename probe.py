@@ -0,0 +1,125 @@
+# probe.py
+import json
+import time
+import threading
+from collections import deque
+from pathlib import Path
+import numpy as np
+
+GOLDEN_FILE = "golden_queries.json"
+PROBE_INTERVAL_S = 60
+WINDOW = 1000  # latency samples kept for the rolling percentiles
+
+def load_golden(path=GOLDEN_FILE):
+    """
+    Golden queries: a JSON list of {"query": ..., "expected_doc_ids": [...]}.
+    Queries without expected_doc_ids only count towards latency.
+    """
+    if not Path(path).exists():
+        print(f"[probe] {path} not found, probe has no queries")
+        return []
+    with open(path, "r", encoding="utf-8") as f:
+        return json.load(f)
+
+class RetrievalProbe:
+    """
+    Run the golden queries against the live retriever every interval_s
+    seconds on a background thread, and keep rolling latency percentiles
+    and recall@k against the expected doc_ids. snapshot() only reads the
+    stored numbers, so it is cheap to call from a request handler.
+
+    search(query, top_k) defaults to retriever.search; the API passes its
+    batched search so the probe sees the same path as /query. The windows
+    restart when the retriever swaps to another index version.
+    """
+
+    def __init__(self, retriever, search=None, golden_file=GOLDEN_FILE,
+                 interval_s=PROBE_INTERVAL_S, top_k=3, window=WINDOW):
+        self.retriever = retriever
+        self.search = search or (lambda q, k: retriever.search(q, top_k=k))
+        self.golden = load_golden(golden_file)
+        self.interval_s = interval_s
+        self.top_k = top_k
+
+        self._lock = threading.Lock()
+        self.latencies = deque(maxlen=window)
+        self.recalls = deque(maxlen=max(1, window // max(1, len(self.golden))))
+        self.rounds = 0
+        self.errors = 0
+        self.version = None
+        self.last = None
+
+        self._stop = threading.Event()
+        self._thread = None
+
+    def start(self):
+        if self._thread is None and self.golden:
+            self._thread = threading.Thread(target=self._loop, name="retrieval_probe", daemon=True)
+            self._thread.start()
+        return self
+
+    def stop(self):
+        self._stop.set()
+
+    def _loop(self):
+        while not self._stop.is_set():
+            try:
+                self.run_once()
+            except Exception as e:
+                print("[probe] error:", e)
+            self._stop.wait(self.interval_s)
+
+    def run_once(self):
+        version = self.retriever.version
+        latencies, recalls, misses, errors = [], [], [], 0
+        for g in self.golden:
+            t = time.perf_counter()
+            try:
+                results = self.search(g["query"], self.top_k)
+            except Exception as e:
+                print(f"[probe] query {g['query']!r} failed:", e)
+                errors += 1
+                continue
+            latencies.append(time.perf_counter() - t)
+            expected = {str(d) for d in g.get("expected_doc_ids", [])}
+            if expected:
+                found = {str(r["doc_id"]) for r in results}
+                recall = len(expected & found) / len(expected)
+                recalls.append(recall)
+                if recall < 1.0:
+                    misses.append({"query": g["query"], "expected": sorted(expected), "found": sorted(found)})
+
+        with self._lock:
+            if version != self.version:
+                self.latencies.clear()
+                self.recalls.clear()
+                self.version = version
+            self.latencies.extend(latencies)
+            if recalls:
+                self.recalls.append(float(np.mean(recalls)))
+            self.rounds += 1
+            self.errors += errors
+            self.last = {
+                "ts": time.strftime("%Y%m%dT%H%M%S"),
+                f"recall@{self.top_k}": float(np.mean(recalls)) if recalls else None,
+                "misses": misses,
+                "errors": errors
+            }
+        return self.last
+
+    def snapshot(self):
+        with self._lock:
+            lat = np.asarray(self.latencies) * 1000.0
+            return {
+                "index_version": self.version,
+                "queries": len(self.golden),
+                "interval_s": self.interval_s,
+                "rounds": self.rounds,
+                "errors": self.errors,
+                "latency_ms": {
+                    "n": len(lat),
+                    **{f"p{q}": float(np.percentile(lat, q)) if len(lat) else None for q in (50, 95, 99)}
+                },
+                f"recall@{self.top_k}_avg": float(np.mean(self.recalls)) if self.recalls else None,
+                "last_round": self.last
+            }
@@ -1,55 +1,351 @@
 # reindexer.py
+import os
 import json
+import time
+import hashlib
 import numpy as np
 import faiss
-from sentence_transformers import SentenceTransformer
 from pathlib import Path
-from index_manager import save_version
+from index_manager import save_version, list_versions
+from embedding_cache import CachedEmbedder
+from parallel_embed import ParallelEmbedder
+from model_registry import get_model, model_key
+from index_factory import DEFAULT_INDEX, TRAIN_SIZE, create_index, index_kind, needs_training, write_index
+from chunk_store import META_FILE, ChunkStoreWriter, load_chunks, write_chunks
+from chunking import chunk_text, split_chunks, get_tokenizer
+from sparse_index import SPARSE_FILE, build_sparse
+from attr_index import ATTR_FILE, build_attributes
+from sharded_retriever import SHARDS_FILE, build_shards, remove_shards, read_shards, shard_roles
 
 DATA_FILE = "data.jsonl"
-META_OUT = "metadata.json"
+META_OUT = META_FILE
 INDEX_OUT = "vector.index"
+SPARSE_OUT = SPARSE_FILE
+ATTR_OUT = ATTR_FILE
+SHARDS_OUT = SHARDS_FILE
+BATCH_SIZE = 256        # chunks embedded and added per step
+CHECKPOINT_EVERY = 20   # batches between resumable checkpoints
 
-def load_docs(path=DATA_FILE):
-    docs = []
-    with open(path, "r", encoding="utf-8") as f:
+def iter_docs(path=DATA_FILE, start=0):
+    """Yield (byte offset, doc) for each line of a JSONL file, from byte start."""
+    with open(path, "rb") as f:
+        f.seek(start)
+        offset = start
         for line in f:
-            docs.append(json.loads(line))
-    return docs
+            if line.strip():
+                yield offset, json.loads(line)
+            offset += len(line)
+
+def load_docs(path=DATA_FILE):
+    return [d for _, d in iter_docs(path)]
 
-def chunk_text(text, chunk_size=200):
-    words = text.split()
-    for i in range(0, len(words), chunk_size):
-        yield " ".join(words[i:i+chunk_size])
+def chunk_hash(embedding_model, doc_id, title, chunk, occurrence=0):
+    """
+    Content hash of a chunk. The embedding model is part of the key so that
+    switching models invalidates every stored vector.
+    """
+    h = hashlib.sha1()
+    for part in (embedding_model, str(doc_id), title, chunk, str(occurrence)):
+        h.update(part.encode("utf-8"))
+        h.update(b"\0")
+    return h.hexdigest()
 
-def build_index(embedding_model="sentence-transformers/all-MiniLM-L6-v2", persist_index_file=INDEX_OUT, persist_meta_file=META_OUT):
-    print("[reindexer] Loading embedder:", embedding_model)
-    embedder = SentenceTransformer(embedding_model)
+def iter_chunks(docs, embedding_model):
+    """
+    Yield (position, record) for every chunk of (offset, doc) pairs. The
+    position (doc offset, chunk number) is what a checkpoint resumes from.
+    """
+    tokenizer = get_tokenizer()
+    for offset, d in docs:
+        seen = {}
+        title = d.get("title", "")
+        for n_in_doc, (c, n_tokens) in enumerate(split_chunks(d["text"], tokenizer=tokenizer)):
+            # identical chunks inside one document still need distinct keys
+            n = seen.get(c, 0)
+            seen[c] = n + 1
+            yield (offset, n_in_doc), {
+                "doc_id": d["id"],
+                "title": title,
+                "chunk": c,
+                "n_tokens": n_tokens,
+                "hash": chunk_hash(embedding_model, d["id"], title, c, n)
+            }
+
+def build_chunks(docs, embedding_model):
+    return [m for _, m in iter_chunks(((0, d) for d in docs), embedding_model)]
+
+def batched(iterable, n):
+    batch = []
+    for item in iterable:
+        batch.append(item)
+        if len(batch) == n:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+def load_previous(index_file, meta_file):
+    """
+    Load the last build if it can be updated in place, i.e. it is an ID-mapped
+    index whose metadata carries an id and hash for every vector.
+    Returns (index, metadata) or (None, None).
+    """
+    if not (Path(index_file).exists() and Path(meta_file).exists()):
+        return None, None
+    index = faiss.read_index(index_file)
+    metadata = list(load_chunks(meta_file))
+    if not isinstance(index, faiss.IndexIDMap):
+        return None, None
+    if len(metadata) != index.ntotal or any("id" not in m or "hash" not in m for m in metadata):
+        return None, None
+    return index, metadata
+
+def embed(embedder, texts):
+    vecs = embedder.encode(texts, show_progress_bar=False)
+    return np.array(vecs).astype("float32")
+
+# ------------------------------------------------
+# INCREMENTAL UPDATE
+# ------------------------------------------------
+def update_index(embedder, embedding_model, index_file, meta_file, index_type, data_file=DATA_FILE):
+    """
+    Embed only added or changed chunks and remove deleted ones from the
+    existing index. Returns False when the existing build cannot be updated
+    in place and a full rebuild is needed.
+    """
+    index, previous = load_previous(index_file, meta_file)
+    if index is None:
+        print("[reindexer] No incremental state found, doing a full rebuild.")
+        return False
+    if index_kind(index) != index_type.lower():
+        print(f"[reindexer] Existing index is {index_kind(index)}, not {index_type}; doing a full rebuild.")
+        return False
+
+    metadata = build_chunks(load_docs(data_file), embedding_model)
+    print(f"[reindexer] Created {len(metadata)} chunks.")
+
+    old_ids = {m["hash"]: m["id"] for m in previous}
+    new_hashes = {m["hash"] for m in metadata}
+
+    stale = [i for h, i in old_ids.items() if h not in new_hashes]
+    try:
+        if stale:
+            index.remove_ids(np.array(stale, dtype="int64"))
+    except RuntimeError:
+        print(f"[reindexer] {index_kind(index)} index does not support removal; doing a full rebuild.")
+        return False
+
+    next_id = max(old_ids.values(), default=-1) + 1
+    added = []
+    for m in metadata:
+        if m["hash"] in old_ids:
+            m["id"] = old_ids[m["hash"]]
+        else:
+            m["id"] = next_id
+            next_id += 1
+            added.append(m)
+
+    if added:
+        print(f"[reindexer] Embedding {len(added)} new or changed chunks...")
+    for batch in batched(added, BATCH_SIZE):
+        arr = embed(embedder, [m["chunk"] for m in batch])
+        index.add_with_ids(arr, np.array([m["id"] for m in batch], dtype="int64"))
+
+    print(f"[reindexer] Embedded {len(added)} chunks, reused {len(metadata) - len(added)}, removed {len(stale)}.")
+    write_index(index, index_file)
+    write_chunks(meta_file, metadata)
+    return True
+
+# ------------------------------------------------
+# STREAMING FULL BUILD
+# ------------------------------------------------
+def _checkpoint_path(index_file):
+    return Path(f"{index_file}.checkpoint.json")
 
-    docs = load_docs()
-    chunks = []
-    metadata = []
-    for d in docs:
-        for c in chunk_text(d["text"]):
-            chunks.append(c)
-            metadata.append({"doc_id": d["id"], "title": d.get("title",""), "chunk": c})
+def _clear_checkpoint(index_file):
+    ckpt = _checkpoint_path(index_file)
+    if ckpt.exists():
+        state = json.loads(ckpt.read_text())
+        Path(state["index_partial"]).unlink(missing_ok=True)
+        ckpt.unlink()
 
-    print(f"[reindexer] Created {len(chunks)} chunks. Embedding...")
-    vecs = embedder.encode(chunks, show_progress_bar=True)
-    arr = np.array(vecs).astype("float32")
-    dim = arr.shape[1]
+def stream_build(embedder, embedding_model, index_file, meta_file, index_type=DEFAULT_INDEX,
+                 batch_size=BATCH_SIZE, resume=False, data_file=DATA_FILE):
+    """
+    Full rebuild as a bounded-memory pipeline: stream documents, chunk them,
+    embed fixed-size batches and append each batch to the index and the
+    chunk store as soon as it is embedded. Apart from the index itself,
+    memory is bounded by the batch size (and the training sample for
+    IVF/PQ indexes).
 
-    index = faiss.IndexFlatL2(dim)
-    index.add(arr)
-    faiss.write_index(index, persist_index_file)
+    Every CHECKPOINT_EVERY batches the partial index, the partial chunk
+    store and the input position are saved; with resume=True a crashed
+    build continues from the last checkpoint.
+    """
+    ckpt_path = _checkpoint_path(index_file)
+    st = os.stat(data_file)
+    source = {"data_file": str(data_file), "size": st.st_size, "mtime": st.st_mtime,
+              "embedding_model": embedding_model, "index_type": index_type}
 
-    with open(persist_meta_file, "w", encoding="utf-8") as f:
-        json.dump(metadata, f, indent=2)
+    state = json.loads(ckpt_path.read_text()) if resume and ckpt_path.exists() else None
+    if state is not None and state["source"] != source:
+        print("[reindexer] Checkpoint was taken for a different input or config; starting over.")
+        state = None
+
+    if state is not None:
+        index = faiss.read_index(state["index_partial"])
+        writer = ChunkStoreWriter(meta_file, state=state["writer"])
+        last_pos = tuple(state["position"])
+        next_id, seq = state["next_id"], state["seq"]
+        docs = iter_docs(data_file, start=last_pos[0])
+        print(f"[reindexer] Resuming from checkpoint at {next_id} chunks.")
+    else:
+        _clear_checkpoint(index_file)
+        index = None
+        writer = ChunkStoreWriter(meta_file)
+        last_pos = None
+        next_id, seq = 0, 0
+        docs = iter_docs(data_file)
+
+    chunks = iter_chunks(docs, embedding_model)
+    if last_pos is not None:
+        # the checkpointed document is re-read; skip its chunks already stored
+        chunks = (c for c in chunks if not (c[0][0] == last_pos[0] and c[0][1] <= last_pos[1]))
+
+    pending = []  # embedded batches waiting for the index to be trained
+    resumed_at = next_id
+    t0 = last_print = time.perf_counter()
+    batches_since_ckpt = 0
+
+    def add(records, vecs):
+        index.add_with_ids(vecs, np.array([r["id"] for r in records], dtype="int64"))
+        writer.add(records)
+
+    try:
+        for batch in batched(chunks, batch_size):
+            positions = [p for p, _ in batch]
+            records = [r for _, r in batch]
+            for r in records:
+                r["id"] = next_id
+                next_id += 1
+            vecs = embed(embedder, [r["chunk"] for r in records])
+            last_pos = positions[-1]
+
+            if index is None:
+                pending.append((records, vecs))
+                buffered = sum(len(v) for _, v in pending)
+                if needs_training(index_type, vecs.shape[1]) and buffered < TRAIN_SIZE:
+                    continue
+                # estimate the corpus size from how far into the file we are
+                n_hint = int(buffered * st.st_size / last_pos[0]) if last_pos[0] else None
+                index = create_index(index_type, vecs.shape[1],
+                                     train_vectors=np.concatenate([v for _, v in pending]), n_hint=n_hint)
+                for p in pending:
+                    add(*p)
+                pending = []
+            else:
+                add(records, vecs)
+
+            batches_since_ckpt += 1
+            if batches_since_ckpt >= CHECKPOINT_EVERY:
+                batches_since_ckpt = 0
+                seq += 1
+                partial = f"{index_file}.partial{seq}"
+                write_index(index, partial)
+                previous = json.loads(ckpt_path.read_text())["index_partial"] if ckpt_path.exists() else None
+                tmp = ckpt_path.with_name(ckpt_path.name + ".tmp")
+                tmp.write_text(json.dumps({
+                    "source": source, "index_partial": partial, "writer": writer.checkpoint(),
+                    "position": list(last_pos), "next_id": next_id, "seq": seq
+                }))
+                os.replace(tmp, ckpt_path)
+                if previous and previous != partial:
+                    Path(previous).unlink(missing_ok=True)
+
+            now = time.perf_counter()
+            if now - last_print >= 2.0:
+                last_print = now
+                rate = (next_id - resumed_at) / (now - t0)
+                print(f"[reindexer] {next_id} chunks, {rate:.1f} chunks/s")
+
+        if pending:
+            index = create_index(index_type, pending[0][1].shape[1],
+                                 train_vectors=np.concatenate([v for _, v in pending]))
+            for p in pending:
+                add(*p)
+        if index is None:
+            raise ValueError(f"no chunks found in {data_file}")
+
+        write_index(index, index_file)
+        writer.close()
+    except BaseException:
+        # keep the partial files for resume=True, but release the handles
+        for f in (writer.f, writer.ids, writer.offsets):
+            f.close()
+        raise
+
+    _clear_checkpoint(index_file)
+    elapsed = time.perf_counter() - t0
+    embedded = next_id - resumed_at
+    print(f"[reindexer] Embedded {embedded} chunks in {elapsed:.1f}s ({embedded / max(elapsed, 1e-9):.1f} chunks/s), {next_id} total.")
+
+def build_index(embedding_model="sentence-transformers/all-MiniLM-L6-v2", persist_index_file=INDEX_OUT, persist_meta_file=META_OUT,
+                incremental=False, index_type=DEFAULT_INDEX, batch_size=BATCH_SIZE, resume=False, workers=1,
+                persist_sparse_file=SPARSE_OUT, persist_attr_file=ATTR_OUT, shards=1):
+    print("[reindexer] Loading embedder:", embedding_model)
+    # chunk hashes and cached vectors are per backend (fp32 keeps the bare name)
+    model_id = model_key(embedding_model)
+    if workers > 1:
+        # shards each batch across a process pool; cache misses only
+        base = ParallelEmbedder(embedding_model, workers)
+        batch_size = max(batch_size, 64 * workers)
+    else:
+        # shared with a retriever in the same process (e.g. /reindex)
+        base = get_model("sentence-embedding", embedding_model)
+    embedder = CachedEmbedder(base, model_id)
+
+    try:
+        if not (incremental and update_index(embedder, model_id, persist_index_file, persist_meta_file, index_type)):
+            stream_build(embedder, model_id, persist_index_file, persist_meta_file,
+                         index_type=index_type, batch_size=batch_size, resume=resume)
+    finally:
+        if workers > 1:
+            base.report()
+            base.close()
+    print("[reindexer] Embedding cache:", embedder.cache.stats())
+
+    # BM25 index over the finished chunk store, for hybrid retrieval
+    build_sparse(load_chunks(persist_meta_file), persist_sparse_file)
+    # doc_id / title -> ids, for filtered search
+    build_attributes(load_chunks(persist_meta_file), persist_attr_file)
+    extra_files = {"sparse": persist_sparse_file, "attributes": persist_attr_file}
+    # the full index stays in place for Retriever; shards are for ShardedRetriever
+    if shards > 1:
+        extra_files.update(build_shards(persist_index_file, persist_meta_file, shards, SHARDS_OUT,
+                                        embedding_model=embedding_model))
+    else:
+        remove_shards(SHARDS_OUT)
 
     # Save version copy
-    tag = save_version(persist_index_file, persist_meta_file)
+    # a retriever refuses to load an index built with a model other than its own
+    tag = save_version(persist_index_file, persist_meta_file, extra_files=extra_files,
+                       info={"embedding_model": embedding_model})
     print("[reindexer] Reindex complete. saved version:", tag)
     return tag
 
+def extra_paths(tag=None):
+    """
+    Live paths of the extra files of a build, for rollback_to. Covers the
+    shards of version tag and of the live build, so switching between
+    shard counts leaves no stale shard behind.
+    """
+    n = 0
+    for v in list_versions():
+        if v["tag"] == tag:
+            n = sum(1 for role in v.get("blobs", {}) if role.endswith(".index") and role.startswith("shard"))
+    if os.path.exists(SHARDS_OUT):
+        n = max(n, read_shards(SHARDS_OUT)["n_shards"])
+    return {"sparse": SPARSE_OUT, "attributes": ATTR_OUT, "shards": SHARDS_OUT, **shard_roles(n)}
+
 if __name__ == "__main__":
     build_index()
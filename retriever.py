@@ -1,46 +1,245 @@
-import json
+import os
+import time
+import threading
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
 import faiss
 import numpy as np
-from sentence_transformers import SentenceTransformer
+from embedding_cache import CachedEmbedder
+from index_factory import search_params, filtered_search
+from chunk_store import load_chunks
+from sparse_index import SPARSE_FILE, SparseIndex
+from attr_index import ATTR_FILE, AttributeIndex
+from index_manager import active_version, version_info
+from model_registry import get_model, model_key
+import metrics
 
 INDEX_FILE = "vector.index"
-META_FILE = "metadata.json"
+META_FILE = None  # chunks.bin, or a legacy metadata.json
+EMBED_MODEL = "sentence-transformers/all-MiniLM-L6-v2"
 
-class Retriever:
-    def __init__(self, top_k=3):
-        self.top_k = top_k
+MODES = ("dense", "sparse", "hybrid")
+RRF_K = 60          # reciprocal-rank fusion constant
+HYBRID_FETCH = 4    # each leg fetches top_k * HYBRID_FETCH candidates before fusion
+TIMING_WINDOW = 1000
 
-        # Load embedding model
-        print("Loading embedding model for retriever...")
-        self.embedder = SentenceTransformer("sentence-transformers/all-MiniLM-L6-v2")
+# What a result's "score" is; it is returned with every result as "score_kind".
+# Only l2_distance ranks lower-is-better.
+SCORE_KINDS = ("l2_distance", "inner_product", "bm25", "rrf")
 
+def dense_score_kind(index):
+    return "inner_product" if index.metric_type == faiss.METRIC_INNER_PRODUCT else "l2_distance"
+
+class IndexSnapshot:
+    """An index, its chunk metadata, BM25 and attribute indexes, loaded together and never mutated."""
+
+    def __init__(self, index_file=INDEX_FILE, meta_file=META_FILE, version=None, sparse_file=SPARSE_FILE,
+                 attr_file=ATTR_FILE):
         # Load FAISS index
         print("Loading FAISS index...")
-        self.index = faiss.read_index(INDEX_FILE)
+        self.index = faiss.read_index(index_file)
 
         # Load metadata
         print("Loading metadata...")
-        with open(META_FILE, "r", encoding="utf-8") as f:
-            self.metadata = json.load(f)
+        # memory-mapped; rows are only decoded for the hits we return
+        self.metadata = load_chunks(meta_file)
+        # builds from before the sparse index only support dense search
+        self.sparse = SparseIndex(sparse_file) if sparse_file and os.path.exists(sparse_file) else None
+        # likewise, older builds cannot be filtered
+        self.attributes = AttributeIndex(attr_file) if attr_file and os.path.exists(attr_file) else None
+        self.version = version
+
+class Retriever:
+    def __init__(self, top_k=3, nprobe=None, ef_search=None, mode="dense"):
+        self.top_k = top_k
+        self.mode = mode
+        # defaults for IVF / HNSW indexes, overridable per query
+        self.nprobe = nprobe
+        self.ef_search = ef_search
+
+        # Load embedding model
+        print("Loading embedding model for retriever...")
+        # pinned: the retriever keeps it for its whole life
+        self.embedder = CachedEmbedder(get_model("sentence-embedding", EMBED_MODEL, pin=True), model_key(EMBED_MODEL))
+
+        self._swap_lock = threading.Lock()
+        self.snapshot = self._check_model(IndexSnapshot(version=active_version()))
+
+        # the dense leg of a hybrid search runs here while the sparse leg
+        # runs on the calling thread
+        self._legs = ThreadPoolExecutor(max_workers=4, thread_name_prefix="retriever_leg")
+        self._timing_lock = threading.Lock()
+        self.leg_ms = {leg: deque(maxlen=TIMING_WINDOW) for leg in ("embed", "dense", "sparse", "fuse", "total")}
 
         print("Retriever ready.")
 
-    def search(self, query):
-        # Embed query
-        query_vec = self.embedder.encode([query]).astype("float32")
+    @property
+    def index(self):
+        return self.snapshot.index
+
+    @property
+    def metadata(self):
+        return self.snapshot.metadata
+
+    @property
+    def version(self):
+        return self.snapshot.version
+
+    def reload(self, index_file=INDEX_FILE, meta_file=META_FILE, version=None, sparse_file=SPARSE_FILE,
+               attr_file=ATTR_FILE):
+        """
+        Load a new index/metadata snapshot and swap it in. Searches that
+        already picked up the old snapshot finish on it; the embedding
+        model is kept, so an index built with another model is refused.
+        """
+        with self._swap_lock:
+            snapshot = self._check_model(
+                IndexSnapshot(index_file, meta_file, version or active_version(), sparse_file, attr_file))
+            old = self.snapshot
+            self.snapshot = snapshot
+        print(f"[retriever] Swapped index {old.version} -> {snapshot.version}")
+        return snapshot.version
+
+    def _check_model(self, snapshot):
+        """
+        Refuse an index whose vectors come from another embedding model: the
+        dimensions can match while the results would be meaningless.
+        """
+        built_with = version_info(snapshot.version).get("embedding_model")
+        # versions saved before the model was recorded only get the dimension check
+        if built_with is not None and built_with != EMBED_MODEL:
+            raise ValueError(f"index version {snapshot.version} was built with {built_with}, "
+                             f"but queries are embedded with {EMBED_MODEL}")
+        dim = self.embedder.get_sentence_embedding_dimension()
+        if snapshot.index.d != dim:
+            raise ValueError(f"index dimension {snapshot.index.d} does not match embedder dimension {dim}")
+        return snapshot
+
+    def search(self, query, top_k=None, nprobe=None, ef_search=None, mode=None, filters=None):
+        return self.search_batch([query], top_k, nprobe, ef_search, mode, filters)[0]
+
+    def search_batch(self, queries, top_k=None, nprobe=None, ef_search=None, mode=None, filters=None):
+        """
+        Embed all queries in one encode call and search them in one FAISS
+        call. top_k is a single value or one value per query. nprobe and
+        ef_search tune recall vs latency on IVF and HNSW indexes.
+
+        mode is dense (FAISS), sparse (BM25) or hybrid: both legs run
+        concurrently and their rankings are merged with reciprocal-rank
+        fusion. Without a sparse index every mode falls back to dense.
+
+        filters, e.g. {"doc_id": ["3", "7"], "title": "Release notes"},
+        restricts every query of the batch to the matching chunks: values
+        of one field are OR-ed, fields are AND-ed. The allowed ids are
+        handed to FAISS as an ID selector, so only they are scanned and
+        each query still gets a full top_k when enough chunks match.
+        """
+        if not len(queries):
+            return []
+        t0 = time.perf_counter()
+        if isinstance(top_k, (list, tuple)):
+            ks = list(top_k)
+        else:
+            ks = [top_k or self.top_k] * len(queries)
+        mode = mode or self.mode
+        if mode not in MODES:
+            raise ValueError(f"unknown retrieval mode '{mode}', expected one of {MODES}")
+
+        # the whole batch uses one snapshot
+        snap = self.snapshot
+        if snap.sparse is None:
+            mode = "dense"
+        allowed = None
+        if filters:
+            if snap.attributes is None:
+                raise ValueError("this index was built without an attribute index, rebuild it to use filters")
+            allowed = snap.attributes.ids_for(filters)
+            if not len(allowed):
+                return [[] for _ in queries]
+        timings = {}
+
+        if mode == "dense":
+            distances, indices = self._dense(snap, queries, max(ks), nprobe, ef_search, timings, allowed)
+            kind = dense_score_kind(snap.index)
+            results = [self._results(snap, indices[i][:k], distances[i][:k], kind) for i, k in enumerate(ks)]
+        elif mode == "sparse":
+            hits = self._sparse(snap, queries, max(ks), timings, allowed)
+            results = [self._results(snap, ids[:k], scores[:k], "bm25") for (ids, scores), k in zip(hits, ks)]
+        else:
+            fetch = max(ks) * HYBRID_FETCH
+            dense = self._legs.submit(self._dense, snap, queries, fetch, nprobe, ef_search, timings, allowed)
+            hits = self._sparse(snap, queries, fetch, timings, allowed)
+            distances, indices = dense.result()
+            t = time.perf_counter()
+            results = [self._fuse(snap, indices[i], hits[i][0], k) for i, k in enumerate(ks)]
+            timings["fuse"] = time.perf_counter() - t
+
+        timings["total"] = time.perf_counter() - t0
+        with self._timing_lock:
+            for leg, secs in timings.items():
+                self.leg_ms[leg].append(secs * 1000.0)
+        for leg, secs in timings.items():
+            metrics.record("search" if leg == "total" else leg, secs)
+        return results
+
+    def _dense(self, snap, queries, k, nprobe, ef_search, timings, allowed=None):
+        t = time.perf_counter()
+        query_vecs = np.asarray(self.embedder.encode(list(queries)), dtype="float32")
+        timings["embed"] = time.perf_counter() - t
+
+        t = time.perf_counter()
+        nprobe, ef_search = nprobe or self.nprobe, ef_search or self.ef_search
+        if allowed is None:
+            params = search_params(snap.index, nprobe, ef_search)
+            distances, indices = snap.index.search(query_vecs, k, params=params)
+        else:
+            distances, indices = filtered_search(snap.index, query_vecs, k, allowed, nprobe, ef_search)
+        timings["dense"] = time.perf_counter() - t
+        return distances, indices
+
+    def _sparse(self, snap, queries, k, timings, allowed=None):
+        t = time.perf_counter()
+        hits = [snap.sparse.search(q, k, allowed) for q in queries]
+        timings["sparse"] = time.perf_counter() - t
+        return hits
+
+    def _fuse(self, snap, dense_ids, sparse_ids, k):
+        ranks = {}
+        for leg, ids in (("dense", dense_ids), ("sparse", sparse_ids)):
+            for rank, idx in enumerate(int(i) for i in ids if i != -1):
+                ranks.setdefault(idx, {})[leg] = rank + 1
+        fused = sorted(((sum(1.0 / (RRF_K + r) for r in legs.values()), idx, legs) for idx, legs in ranks.items()),
+                       key=lambda item: -item[0])[:k]
+        results = self._results(snap, [idx for _, idx, _ in fused], [score for score, _, _ in fused], "rrf")
+        for r, (_, _, legs) in zip(results, fused):
+            r["ranks"] = legs
+        return results
 
-        # Search in FAISS
-        distances, indices = self.index.search(query_vec, self.top_k)
+    def leg_stats(self):
+        """p50/p95 milliseconds per retrieval stage over the recent searches."""
+        with self._timing_lock:
+            return {
+                leg: {
+                    "n": len(ms),
+                    "p50_ms": float(np.percentile(ms, 50)),
+                    "p95_ms": float(np.percentile(ms, 95))
+                } for leg, ms in self.leg_ms.items() if ms
+            }
 
+    def _results(self, snap, indices, distances, score_kind):
         results = []
-        for idx, dist in zip(indices[0], distances[0]):
+        for idx, dist in zip(indices, distances):
             if idx == -1:
                 continue
+            meta = snap.metadata.get(int(idx))
             results.append({
                 "score": float(dist),
-                "chunk": self.metadata[idx]["chunk"],
-                "title": self.metadata[idx]["title"],
-                "doc_id": self.metadata[idx]["doc_id"]
+                "score_kind": score_kind,
+                "chunk": meta["chunk"],
+                "title": meta["title"],
+                "doc_id": meta["doc_id"],
+                # generator tokens, for context packing (absent in older builds)
+                "n_tokens": meta.get("n_tokens")
             })
 
         return results
@@ -56,5 +255,5 @@ if __name__ == "__main__":
     for r_ in results:
         print("\n---")
         print("Title :", r_["title"])
-        print("Score :", r_["score"])
+        print("Score :", r_["score"], f"({r_['score_kind']})")
         print("Chunk :", r_["chunk"])
@@ -1,6 +1,6 @@
 # self_debug_agent.py
 import json
-from transformers import pipeline
+from model_registry import get_model
 
 REPORT_FILE = "monitor_report.json"
 
@@ -10,7 +10,7 @@ def load_report():
 
 def summarize_and_suggest(report):
     # small model to keep it runnable; replace with larger if available
-    summarizer = pipeline("text2text-generation", model="google/flan-t5-small")
+    summarizer = get_model("text2text-generation", "google/flan-t5-small")
     prompt = f"""
 You are a system debug assistant. Given the system monitor report below, summarize the top 3 issues and give concrete step-by-step fixes for each.
 
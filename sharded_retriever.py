@@ -0,0 +1,376 @@
+# sharded_retriever.py
+import os
+import json
+import time
+import heapq
+import socket
+import secrets
+import argparse
+import ipaddress
+import threading
+import multiprocessing
+from itertools import islice
+from pathlib import Path
+from concurrent.futures import ThreadPoolExecutor
+from multiprocessing.connection import Listener, Client
+import faiss
+import numpy as np
+from embedding_cache import CachedEmbedder
+from index_factory import search_params, iter_index_vectors, write_index
+from chunk_store import ChunkStoreWriter, load_chunks
+from model_registry import get_model, model_key
+
+SHARDS_FILE = "shards.json"
+SHARD_INDEX = "vector.shard{}.index"
+SHARD_META = "chunks.shard{}.bin"
+EMBED_MODEL = "sentence-transformers/all-MiniLM-L6-v2"
+
+# local RPC stand-in: one process per shard listening on BASE_PORT + shard
+SHARD_HOST = os.getenv("RAG_SHARD_HOST", "127.0.0.1")
+BASE_PORT = int(os.getenv("RAG_SHARD_BASE_PORT", "6100"))
+# Connections exchange pickles, so the authkey is all that stands between a
+# peer and code execution on the shard server. There is no default: without
+# RAG_SHARD_AUTHKEY, start_shard_servers makes a random key per call and only
+# loopback hosts are served.
+AUTHKEY = os.getenv("RAG_SHARD_AUTHKEY", "").encode() or None
+CONNECT_TIMEOUT_S = 30
+
+# ------------------------------------------------
+# BUILD
+# ------------------------------------------------
+def shard_roles(n_shards):
+    """Version roles -> live paths of the files of n_shards shards."""
+    roles = {}
+    for s in range(n_shards):
+        roles[f"shard{s}.index"] = SHARD_INDEX.format(s)
+        roles[f"shard{s}.meta"] = SHARD_META.format(s)
+    return roles
+
+def read_shards(path=SHARDS_FILE):
+    with open(path, "r", encoding="utf-8") as f:
+        return json.load(f)
+
+def _empty_shard(index_file):
+    """A trained, empty copy of the index in index_file, without loading its vectors."""
+    shard = faiss.read_index(index_file, faiss.IO_FLAG_MMAP)
+    inner = faiss.downcast_index(shard.index)
+    if isinstance(inner, faiss.IndexIVF):
+        # memory-mapped lists cannot be reset; swap in empty in-memory ones
+        lists = faiss.ArrayInvertedLists(inner.nlist, inner.code_size)
+        inner.replace_invlists(lists, True)
+        lists.this.disown()  # owned by the index now
+    shard.reset()
+    return shard, inner
+
+def _fill_shard(shard, inner, ext_ids):
+    """Point the ID map of a shard whose inner index now holds len(ext_ids) vectors at their ids."""
+    faiss.copy_array_to_vector(np.asarray(ext_ids, dtype="int64"), shard.id_map)
+    shard.ntotal = inner.ntotal
+    shard.construct_rev_map()
+
+def _shard_index(source, index_file, n_shards, s):
+    """
+    Shard s of the ID-mapped source index. Stored codes are copied as they
+    are: PQ / SQ codes and IVF list entries are never decoded and encoded
+    again, so shard scores equal the unsharded index's. HNSW shards get a
+    new graph over their exactly stored vectors.
+    """
+    src = faiss.downcast_index(source.index)
+    ext = faiss.vector_to_array(source.id_map).astype("int64")
+    shard, inner = _empty_shard(index_file)
+    if isinstance(src, faiss.IndexIVF):
+        kept = []
+        for lst in range(src.nlist):
+            size = src.invlists.list_size(lst)
+            if not size:
+                continue
+            rows = faiss.rev_swig_ptr(src.invlists.get_ids(lst), size)
+            mask = ext[rows] % n_shards == s
+            if not mask.any():
+                continue
+            codes = faiss.rev_swig_ptr(src.invlists.get_codes(lst), size * src.code_size)
+            codes = np.ascontiguousarray(codes.reshape(size, src.code_size)[mask])
+            # shard-local row numbers, mapped to the chunk ids by the ID map
+            local = np.arange(inner.ntotal, inner.ntotal + int(mask.sum()), dtype="int64")
+            inner.invlists.add_entries(lst, len(local), faiss.swig_ptr(local), faiss.swig_ptr(codes))
+            inner.ntotal += len(local)
+            kept.append(ext[rows[mask]])
+        _fill_shard(shard, inner, np.concatenate(kept) if kept else [])
+    elif isinstance(src, faiss.IndexFlatCodes):
+        rows = np.flatnonzero(ext % n_shards == s)
+        codes = faiss.rev_swig_ptr(src.codes.data(), src.ntotal * src.code_size).reshape(src.ntotal, src.code_size)
+        codes = np.ascontiguousarray(codes[rows])
+        inner.add_sa_codes(codes)
+        _fill_shard(shard, inner, ext[rows])
+    else:
+        # graph indexes: rebuild the graph from the (for HNSW-Flat exact) vectors
+        for vecs, ids in iter_index_vectors(source):
+            mask = ids % n_shards == s
+            shard.add_with_ids(vecs[mask], ids[mask])
+    return shard
+
+def build_shards(index_file, meta_file, n_shards, path=SHARDS_FILE, embedding_model=None):
+    """
+    Split a built index and its chunk store into n_shards shards by
+    chunk id (id % n_shards), each with its own index and chunk store.
+    Shards copy the trained index of the full build, so IVF / PQ shards
+    share its centroids, and take over its codes as stored. The source is
+    memory-mapped and one shard is held at a time. Returns {role: path}
+    for save_version.
+    """
+    t0 = time.perf_counter()
+    source = faiss.read_index(index_file, faiss.IO_FLAG_MMAP)
+    if not isinstance(source, faiss.IndexIDMap2):
+        raise ValueError(f"{index_file} is not an ID-mapped index")
+    ntotal = []
+    for s in range(n_shards):
+        shard = _shard_index(source, index_file, n_shards, s)
+        write_index(shard, SHARD_INDEX.format(s))
+        ntotal.append(int(shard.ntotal))
+        del shard
+    metric_type = int(source.metric_type)
+    del source
+
+    roles = shard_roles(n_shards)
+    writers = [ChunkStoreWriter(SHARD_META.format(s)) for s in range(n_shards)]
+    try:
+        # records come out in id order, so each shard's store stays sorted
+        for r in load_chunks(meta_file):
+            writers[int(r["id"]) % n_shards].add([r])
+    except BaseException:
+        for w in writers:
+            w.abort()
+        raise
+    for w in writers:
+        w.close()
+
+    spec = {
+        "n_shards": n_shards,
+        "metric_type": metric_type,
+        # ShardedRetriever refuses shards built with another model
+        "embedding_model": embedding_model,
+        "shards": [{"index": SHARD_INDEX.format(s), "meta": SHARD_META.format(s), "ntotal": ntotal[s]}
+                   for s in range(n_shards)]
+    }
+    tmp = f"{path}.tmp"
+    with open(tmp, "w", encoding="utf-8") as f:
+        json.dump(spec, f, indent=2)
+    os.replace(tmp, path)
+    sizes = ", ".join(str(s["ntotal"]) for s in spec["shards"])
+    print(f"[sharded_retriever] Wrote {n_shards} shards ({sizes} vectors) in {time.perf_counter() - t0:.1f}s")
+    return {"shards": path, **roles}
+
+def remove_shards(path=SHARDS_FILE):
+    """Remove the live shard files, e.g. after an unsharded rebuild."""
+    if not os.path.exists(path):
+        return
+    for s in read_shards(path)["shards"]:
+        for f in (s["index"], s["meta"]):
+            Path(f).unlink(missing_ok=True)
+    os.unlink(path)
+
+# ------------------------------------------------
+# SHARDS
+# ------------------------------------------------
+class LocalShard:
+    """One shard's index and chunk store, searched in this process."""
+
+    def __init__(self, index_file, meta_file):
+        self.index = faiss.read_index(index_file)
+        self.metadata = load_chunks(meta_file)
+
+    def info(self):
+        return {"metric_type": int(self.index.metric_type), "ntotal": int(self.index.ntotal), "d": int(self.index.d)}
+
+    def search(self, query_vecs, k, nprobe=None, ef_search=None):
+        """Per query, [(score, id, record)] best first."""
+        params = search_params(self.index, nprobe, ef_search)
+        distances, indices = self.index.search(query_vecs, k, params=params)
+        return [
+            [(float(d), int(i), self.metadata.get(int(i))) for d, i in zip(drow, irow) if i != -1]
+            for drow, irow in zip(distances, indices)
+        ]
+
+class RemoteShard:
+    """Same interface as LocalShard, served by serve_shard in another process."""
+
+    def __init__(self, address, authkey=AUTHKEY, timeout_s=CONNECT_TIMEOUT_S):
+        self.address = address
+        deadline = time.monotonic() + timeout_s
+        while True:
+            # the server may still be loading its index
+            try:
+                self.conn = Client(address, authkey=authkey)
+                break
+            except ConnectionRefusedError:
+                if time.monotonic() > deadline:
+                    raise
+                time.sleep(0.2)
+        # one request in flight per connection
+        self._lock = threading.Lock()
+
+    def _call(self, *request):
+        with self._lock:
+            self.conn.send(request)
+            status, payload = self.conn.recv()
+        if status != "ok":
+            raise RuntimeError(f"shard {self.address}: {payload}")
+        return payload
+
+    def info(self):
+        return self._call("info")
+
+    def search(self, query_vecs, k, nprobe=None, ef_search=None):
+        return self._call("search", query_vecs, k, nprobe, ef_search)
+
+    def close(self):
+        self.conn.close()
+
+def _serve_connection(shard, conn):
+    with conn:
+        while True:
+            try:
+                method, *args = conn.recv()
+            except EOFError:
+                return
+            try:
+                conn.send(("ok", getattr(shard, method)(*args)))
+            except Exception as e:
+                conn.send(("error", repr(e)))
+
+def _is_loopback(host):
+    try:
+        return ipaddress.ip_address(socket.gethostbyname(host)).is_loopback
+    except (OSError, ValueError):
+        return False
+
+def serve_shard(index_file, meta_file, address, authkey=AUTHKEY):
+    """Serve one shard until killed; each client connection gets a thread."""
+    if not authkey:
+        raise ValueError("shard servers need an authkey: set RAG_SHARD_AUTHKEY")
+    if AUTHKEY is None and not _is_loopback(address[0]):
+        raise ValueError(f"refusing to serve on non-loopback host {address[0]} without RAG_SHARD_AUTHKEY")
+    shard = LocalShard(index_file, meta_file)
+    with Listener(address, authkey=authkey) as listener:
+        print(f"[sharded_retriever] Serving {index_file} ({shard.index.ntotal} vectors) on {address}")
+        while True:
+            conn = listener.accept()
+            threading.Thread(target=_serve_connection, args=(shard, conn), daemon=True).start()
+
+def start_shard_servers(shards_file=SHARDS_FILE, host=SHARD_HOST, base_port=BASE_PORT, authkey=AUTHKEY):
+    """
+    Start one server process per shard. Returns (processes, addresses,
+    authkey); without an authkey a random one is made for this call, to be
+    passed to ShardedRetriever.
+    """
+    authkey = authkey or secrets.token_bytes(32)
+    ctx = multiprocessing.get_context("spawn")
+    procs, addresses = [], []
+    for s, shard in enumerate(read_shards(shards_file)["shards"]):
+        address = (host, base_port + s)
+        p = ctx.Process(target=serve_shard, args=(shard["index"], shard["meta"], address, authkey), daemon=True)
+        p.start()
+        procs.append(p)
+        addresses.append(address)
+    return procs, addresses, authkey
+
+# ------------------------------------------------
+# RETRIEVER
+# ------------------------------------------------
+class ShardedRetriever:
+    """
+    Dense retrieval over shards written by build_shards. The query is
+    embedded once, every shard is searched concurrently (FAISS releases
+    the GIL, remote shards wait on their socket) and the per-shard top_k
+    lists are merged with a heap. Shards are loaded in this process, or
+    reached over RPC when addresses are given.
+    """
+
+    def __init__(self, shards_file=SHARDS_FILE, top_k=3, nprobe=None, ef_search=None, addresses=None,
+                 authkey=AUTHKEY):
+        self.top_k = top_k
+        self.nprobe = nprobe
+        self.ef_search = ef_search
+
+        print("Loading embedding model for sharded retriever...")
+        self.embedder = CachedEmbedder(get_model("sentence-embedding", EMBED_MODEL, pin=True), model_key(EMBED_MODEL))
+
+        # remote shards may run elsewhere; their shards.json is checked when present
+        spec = read_shards(shards_file) if not addresses or os.path.exists(shards_file) else {}
+        built_with = spec.get("embedding_model")
+        if built_with is not None and built_with != EMBED_MODEL:
+            raise ValueError(f"shards in {shards_file} were built with {built_with}, "
+                             f"but queries are embedded with {EMBED_MODEL}")
+
+        if addresses:
+            if not authkey:
+                raise ValueError("remote shards need the authkey from start_shard_servers or RAG_SHARD_AUTHKEY")
+            self.shards = [RemoteShard(tuple(a) if isinstance(a, list) else a, authkey) for a in addresses]
+        else:
+            self.shards = [LocalShard(s["index"], s["meta"]) for s in spec["shards"]]
+        infos = [s.info() for s in self.shards]
+        if len({i["metric_type"] for i in infos}) != 1:
+            raise ValueError("shards use different metrics")
+        dim = self.embedder.get_sentence_embedding_dimension()
+        if any(i["d"] != dim for i in infos):
+            raise ValueError(f"shard dimensions {sorted({i['d'] for i in infos})} do not match embedder dimension {dim}")
+        # L2 distances rank ascending, inner products descending
+        self.descending = infos[0]["metric_type"] == faiss.METRIC_INNER_PRODUCT
+        self.ntotal = sum(i["ntotal"] for i in infos)
+        self._pool = ThreadPoolExecutor(max_workers=len(self.shards), thread_name_prefix="shard")
+        print(f"Sharded retriever ready: {len(self.shards)} shards, {self.ntotal} vectors.")
+
+    def search(self, query, top_k=None, nprobe=None, ef_search=None):
+        return self.search_batch([query], top_k, nprobe, ef_search)[0]
+
+    def search_batch(self, queries, top_k=None, nprobe=None, ef_search=None):
+        """Same results as Retriever.search_batch in dense mode."""
+        if not len(queries):
+            return []
+        if isinstance(top_k, (list, tuple)):
+            ks = list(top_k)
+        else:
+            ks = [top_k or self.top_k] * len(queries)
+        query_vecs = np.asarray(self.embedder.encode(list(queries)), dtype="float32")
+        futures = [self._pool.submit(s.search, query_vecs, max(ks), nprobe or self.nprobe, ef_search or self.ef_search)
+                   for s in self.shards]
+        per_shard = [f.result() for f in futures]
+
+        results = []
+        for q, k in enumerate(ks):
+            # each shard's list is already sorted, so a k-way heap merge suffices
+            merged = heapq.merge(*(hits[q] for hits in per_shard), key=lambda h: h[0], reverse=self.descending)
+            results.append([{
+                "score": score,
+                "score_kind": "inner_product" if self.descending else "l2_distance",
+                "chunk": meta["chunk"],
+                "title": meta["title"],
+                "doc_id": meta["doc_id"],
+                "n_tokens": meta.get("n_tokens")
+            } for score, _, meta in islice(merged, k)])
+        return results
+
+    def close(self):
+        self._pool.shutdown()
+        for s in self.shards:
+            if isinstance(s, RemoteShard):
+                s.close()
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--serve", type=int, help="serve this shard on BASE_PORT + shard")
+    parser.add_argument("--serve-all", action="store_true", help="start a server process per shard")
+    parser.add_argument("--shards-file", default=SHARDS_FILE)
+    args = parser.parse_args()
+
+    if args.serve is not None:
+        shard = read_shards(args.shards_file)["shards"][args.serve]
+        serve_shard(shard["index"], shard["meta"], (SHARD_HOST, BASE_PORT + args.serve))
+    elif args.serve_all:
+        if AUTHKEY is None:
+            # clients in other processes could not know a random key
+            parser.error("set RAG_SHARD_AUTHKEY to the key the clients will use")
+        procs, addresses, _ = start_shard_servers(args.shards_file)
+        print("[sharded_retriever] Shard servers:", addresses)
+        for p in procs:
+            p.join()
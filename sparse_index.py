@@ -0,0 +1,128 @@
+# sparse_index.py
+import os
+import re
+import time
+from array import array
+from pathlib import Path
+import numpy as np
+
+SPARSE_FILE = "sparse_index.npz"
+K1 = 1.2
+B = 0.75
+
+# words, plus identifiers such as ERR-404, v1.2 or user_id kept whole
+_TOKEN_RE = re.compile(r"[a-z0-9]+(?:[._-][a-z0-9]+)*")
+_SPLIT_RE = re.compile(r"[._-]")
+
+def tokenize(text):
+    tokens = []
+    for tok in _TOKEN_RE.findall(text.lower()):
+        tokens.append(tok)
+        parts = _SPLIT_RE.split(tok)
+        if len(parts) > 1:
+            tokens.extend(p for p in parts if p)
+    return tokens
+
+def build_sparse(records, path=SPARSE_FILE, k1=K1, b=B):
+    """
+    Build a BM25 inverted index over chunk records (dicts with id, title
+    and chunk), e.g. a ChunkStore, and write it to path.
+
+    Postings are stored CSR-style: the rows of term t are
+    rows[term_ptr[t]:term_ptr[t + 1]], with their term frequencies in tf.
+    Row r is the chunk with FAISS id ids[r].
+    """
+    t0 = time.perf_counter()
+    vocab = {}
+    # flat typed buffers: a few bytes per posting, no per-chunk objects
+    term_ids, rows, tfs = array("i"), array("i"), array("i")
+    ids, lengths = array("q"), array("i")
+    for row, r in enumerate(records):
+        tokens = tokenize(f"{r.get('title', '')} {r['chunk']}")
+        counts = {}
+        for tok in tokens:
+            tid = vocab.setdefault(tok, len(vocab))
+            counts[tid] = counts.get(tid, 0) + 1
+        term_ids.extend(counts.keys())
+        tfs.extend(counts.values())
+        rows.extend([row] * len(counts))
+        ids.append(int(r["id"]))
+        lengths.append(len(tokens))
+
+    n = len(ids)
+    term_ids = np.frombuffer(term_ids, dtype="int32") if term_ids else np.zeros(0, dtype="int32")
+    rows = np.frombuffer(rows, dtype="int32") if rows else np.zeros(0, dtype="int32")
+    tfs = np.frombuffer(tfs, dtype="int32") if tfs else np.zeros(0, dtype="int32")
+    # group postings by term; stable so rows stay sorted within a term
+    order = np.argsort(term_ids, kind="stable")
+    df = np.bincount(term_ids, minlength=len(vocab))
+    term_ptr = np.zeros(len(vocab) + 1, dtype="int64")
+    np.cumsum(df, out=term_ptr[1:])
+    idf = np.log(1 + (n - df + 0.5) / (df + 0.5)).astype("float32")
+
+    # tokens never contain a newline; one blob is far smaller than a fixed-width string array
+    terms = np.frombuffer("\n".join(sorted(vocab, key=vocab.get)).encode("utf-8"), dtype="uint8")
+    tmp = f"{path}.tmp"
+    with open(tmp, "wb") as f:
+        np.savez(
+            f,
+            terms=terms,
+            term_ptr=term_ptr,
+            rows=rows[order],
+            tf=np.minimum(tfs[order], np.iinfo("uint16").max).astype("uint16"),
+            idf=idf,
+            ids=np.frombuffer(ids, dtype="int64") if ids else np.zeros(0, dtype="int64"),
+            doc_len=np.frombuffer(lengths, dtype="int32") if lengths else np.zeros(0, dtype="int32"),
+            params=np.asarray([k1, b], dtype="float32")
+        )
+    os.replace(tmp, path)
+    print(f"[sparse_index] Indexed {n} chunks, {len(vocab)} terms, {len(rows)} postings in {time.perf_counter() - t0:.1f}s")
+    return path
+
+class SparseIndex:
+    """BM25 search over an index written by build_sparse."""
+
+    def __init__(self, path=SPARSE_FILE):
+        self.path = Path(path)
+        with np.load(self.path) as z:
+            self.term_ptr = z["term_ptr"]
+            self.rows = z["rows"]
+            self.tf = z["tf"]
+            self.idf = z["idf"]
+            self.ids = z["ids"]
+            doc_len = z["doc_len"].astype("float32")
+            self.k1, self.b = (float(x) for x in z["params"])
+            terms = z["terms"].tobytes().decode("utf-8")
+        self.vocab = {t: i for i, t in enumerate(terms.split("\n"))} if terms else {}
+        avgdl = float(doc_len.mean()) if len(doc_len) else 1.0
+        # per-row part of the BM25 denominator
+        self.norm = self.k1 * (1 - self.b + self.b * doc_len / max(avgdl, 1e-9))
+
+    def __len__(self):
+        return len(self.ids)
+
+    def search(self, query, k=10, allowed=None):
+        """
+        (ids, scores) of the k best-scoring chunks, best first. allowed is
+        an optional sorted array of the ids that may be returned.
+        """
+        terms = [self.vocab[t] for t in set(tokenize(query)) if t in self.vocab]
+        if not terms:
+            return np.zeros(0, dtype="int64"), np.zeros(0, dtype="float32")
+        spans = [slice(self.term_ptr[t], self.term_ptr[t + 1]) for t in terms]
+        rows = np.concatenate([self.rows[s] for s in spans])
+        tf = np.concatenate([self.tf[s] for s in spans]).astype("float32")
+        weight = np.concatenate([np.full(s.stop - s.start, self.idf[t], dtype="float32") for s, t in zip(spans, terms)])
+        if allowed is not None:
+            keep = np.isin(self.ids[rows], allowed)
+            rows, tf, weight = rows[keep], tf[keep], weight[keep]
+            if not len(rows):
+                return np.zeros(0, dtype="int64"), np.zeros(0, dtype="float32")
+        contrib = weight * tf * (self.k1 + 1) / (tf + self.norm[rows])
+        # sum the contributions of each row
+        uniq, inv = np.unique(rows, return_inverse=True)
+        scores = np.bincount(inv, weights=contrib).astype("float32")
+        k = min(k, len(uniq))
+        top = np.argpartition(-scores, k - 1)[:k]
+        top = top[np.argsort(-scores[top], kind="stable")]
+        return self.ids[uniq[top]], scores[top]
@@ -0,0 +1,65 @@
+# tests/test_batcher.py
+import threading
+import pytest
+from batcher import MicroBatcher
+
+def submit_all(batcher, items):
+    """Submit items at once from separate threads; returns their futures in order."""
+    futures = [None] * len(items)
+    barrier = threading.Barrier(len(items))
+
+    def go(i):
+        barrier.wait()
+        futures[i] = batcher.submit(items[i])
+    threads = [threading.Thread(target=go, args=(i,)) for i in range(len(items))]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    return futures
+
+def test_concurrent_items_are_coalesced_and_answered_in_order():
+    seen = []
+    batcher = MicroBatcher(lambda items: seen.append(len(items)) or [x * 2 for x in items],
+                           max_batch_size=8, max_wait_ms=200)
+    futures = submit_all(batcher, list(range(8)))
+    assert [f.result(timeout=5) for f in futures] == [x * 2 for x in range(8)]
+    assert seen == [8]
+    batcher.close()
+
+def test_an_exception_result_fails_only_its_own_caller():
+    def handler(items):
+        return [ValueError(f"bad {x}") if x < 0 else x for x in items]
+    batcher = MicroBatcher(handler, max_batch_size=4, max_wait_ms=200)
+    futures = submit_all(batcher, [1, -1, 2, 3])
+    assert [futures[i].result(timeout=5) for i in (0, 2, 3)] == [1, 2, 3]
+    with pytest.raises(ValueError, match="bad -1"):
+        futures[1].result(timeout=5)
+    batcher.close()
+
+def test_a_failing_handler_fails_the_whole_batch_and_the_batcher_keeps_going():
+    calls = []
+
+    def handler(items):
+        calls.append(items)
+        if len(calls) == 1:
+            raise RuntimeError("model crashed")
+        return items
+    batcher = MicroBatcher(handler, max_batch_size=2, max_wait_ms=200)
+    for f in submit_all(batcher, ["a", "b"]):
+        with pytest.raises(RuntimeError, match="model crashed"):
+            f.result(timeout=5)
+    assert batcher("c") == "c"
+    batcher.close()
+
+def test_wrong_number_of_results_is_an_error():
+    batcher = MicroBatcher(lambda items: items[:-1], max_batch_size=1)
+    with pytest.raises(RuntimeError, match="returned 0 results for 1 items"):
+        batcher("x")
+    batcher.close()
+
+def test_closed_batcher_rejects_items():
+    batcher = MicroBatcher(lambda items: items)
+    batcher.close()
+    with pytest.raises(RuntimeError, match="closed"):
+        batcher.submit("x")
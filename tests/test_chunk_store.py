@@ -0,0 +1,63 @@
+# tests/test_chunk_store.py
+import json
+import pytest
+from chunk_store import ChunkStoreWriter, ChunkStore, write_chunks, load_chunks, convert_json
+
+def records(ids):
+    return [{"id": i, "chunk": f"chunk {i} ünïcode", "title": f"title {i % 3}", "doc_id": str(i // 4)} for i in ids]
+
+def test_round_trip_by_id_and_in_order(tmp_path):
+    path = tmp_path / "chunks.bin"
+    recs = records(range(0, 300, 3))
+    with ChunkStoreWriter(path) as w:
+        w.add(recs[:40])
+        w.add(recs[40:])
+    store = ChunkStore(path)
+    assert len(store) == len(recs)
+    assert list(store) == recs
+    assert store.get(9) == recs[3]
+    assert store.get(10) is None and store.get(-1) is None and store.get(10**9) is None
+    assert store.get_many([0, 297, 1]) == [recs[0], recs[-1], None]
+
+def test_ids_must_increase(tmp_path):
+    w = ChunkStoreWriter(tmp_path / "chunks.bin")
+    w.add(records([1, 2]))
+    with pytest.raises(ValueError):
+        w.add(records([2]))
+    w.abort()
+    assert list(tmp_path.iterdir()) == []
+
+def test_write_chunks_sorts_by_id(tmp_path):
+    write_chunks(tmp_path / "chunks.bin", records([5, 1, 3]))
+    assert [r["id"] for r in ChunkStore(tmp_path / "chunks.bin")] == [1, 3, 5]
+
+def test_nothing_replaces_the_store_until_close(tmp_path):
+    path = tmp_path / "chunks.bin"
+    write_chunks(path, records([1]))
+    w = ChunkStoreWriter(path)
+    w.add(records([7, 8]))
+    assert [r["id"] for r in ChunkStore(path)] == [1]
+    w.close()
+    assert [r["id"] for r in ChunkStore(path)] == [7, 8]
+
+def test_resume_from_checkpoint_drops_what_came_after_it(tmp_path):
+    path = tmp_path / "chunks.bin"
+    w = ChunkStoreWriter(path)
+    w.add(records(range(10)))
+    state = json.loads(json.dumps(w.checkpoint()))  # as stored in the checkpoint file
+    w.add(records(range(10, 15)))  # written, then the process dies
+    for f in (w.f, w.ids, w.offsets):
+        f.close()
+
+    w = ChunkStoreWriter(path, state=state)
+    w.add(records(range(10, 20)))
+    w.close()
+    assert list(ChunkStore(path)) == records(range(20))
+
+def test_legacy_json_converts_to_the_same_records(tmp_path):
+    legacy = tmp_path / "metadata.json"
+    legacy.write_text(json.dumps([{"chunk": "a", "title": "t", "doc_id": "1"}, {"chunk": "b", "title": "t", "doc_id": "2"}]))
+    assert load_chunks(str(legacy)).get(1)["chunk"] == "b"
+    convert_json(legacy, tmp_path / "chunks.bin")
+    store = load_chunks(str(tmp_path / "chunks.bin"))
+    assert isinstance(store, ChunkStore) and store.get(1) == {"chunk": "b", "title": "t", "doc_id": "2", "id": 1}
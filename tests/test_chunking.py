@@ -0,0 +1,106 @@
+# tests/test_chunking.py
+from chunking import split_chunks, chunk_text, pack_context
+
+class WhitespaceTokenizer:
+    """One token per whitespace-separated word; counts how many texts it was asked to encode."""
+
+    def __init__(self):
+        self.encoded = 0
+
+    def __call__(self, texts, **kwargs):
+        self.encoded += len(texts)
+        return {"input_ids": [t.split() for t in texts]}
+
+def sentences(n, words=5):
+    return [" ".join([f"s{i}"] + ["word"] * (words - 2) + [f"end{i}."]) for i in range(n)]
+
+# ------------------------------------------------
+# split_chunks
+# ------------------------------------------------
+def test_short_text_is_one_chunk():
+    text = " ".join(sentences(3))
+    assert split_chunks(text, 50, 10, WhitespaceTokenizer()) == [(text, 15)]
+
+def test_chunks_stay_within_budget_and_keep_every_sentence_in_order():
+    sents = sentences(40)
+    chunks = split_chunks(" ".join(sents), 22, 6, WhitespaceTokenizer())
+    assert len(chunks) > 1
+    for chunk, n in chunks:
+        assert n == len(chunk.split()) <= 22
+    seen = []
+    for chunk, _ in chunks:
+        for s in sents:
+            if s in chunk and s not in seen:
+                seen.append(s)
+    assert seen == sents
+
+def test_overlap_repeats_whole_trailing_sentences_up_to_the_limit():
+    sents = sentences(30)
+    chunks = [c for c, _ in split_chunks(" ".join(sents), 20, 10, WhitespaceTokenizer())]
+    for prev, cur in zip(chunks, chunks[1:]):
+        carried = [s for s in sents if s in prev and s in cur]
+        # two 5-token sentences fit in 10 tokens of overlap, a third would not
+        assert len(carried) == 2
+        assert prev.endswith(" ".join(carried)) and cur.startswith(" ".join(carried))
+
+def test_no_overlap():
+    sents = sentences(12)
+    chunks = [c for c, _ in split_chunks(" ".join(sents), 10, 0, WhitespaceTokenizer())]
+    assert chunks == [" ".join(sents[i:i + 2]) for i in range(0, 12, 2)]
+
+def test_overlong_sentence_is_cut_at_word_boundaries():
+    long_sentence = " ".join(f"w{i}" for i in range(45)) + "."
+    chunks = split_chunks(long_sentence, 20, 5, WhitespaceTokenizer())
+    assert all(n <= 20 for _, n in chunks)
+    words = [w for c, _ in chunks for w in c.split()]
+    # every word survives, in order; pieces of one sentence are not repeated as overlap
+    assert words == long_sentence.split()
+
+def test_chunk_text_returns_texts_only():
+    text = " ".join(sentences(10))
+    tok = WhitespaceTokenizer()
+    assert chunk_text(text, 20, 5, tok) == [c for c, _ in split_chunks(text, 20, 5, tok)]
+
+# ------------------------------------------------
+# pack_context
+# ------------------------------------------------
+def chunk(text, n_tokens=None):
+    c = {"chunk": text}
+    if n_tokens is not None:
+        c["n_tokens"] = n_tokens
+    return c
+
+def test_packs_best_first_within_budget_counting_separators():
+    chunks = [chunk(f"alpha{i} beta{i} gamma{i} delta{i}") for i in range(5)]
+    packed, stats = pack_context(chunks, 14, WhitespaceTokenizer())
+    # 4 + 1 + 4 + 1 + 4 = 14: three chunks and two separators
+    assert packed == chunks[:3]
+    assert stats == {"budget": 14, "tokens_used": 14, "tokens_dropped": 8, "chunks_used": 3,
+                     "chunks_dropped": 2, "duplicates": 0}
+
+def test_skips_a_chunk_that_does_not_fit_for_a_later_one_that_does():
+    chunks = [chunk("one two three four five six"), chunk("seven eight nine ten eleven twelve thirteen fourteen"),
+              chunk("fifteen sixteen")]
+    packed, stats = pack_context(chunks, 9, WhitespaceTokenizer())
+    assert packed == [chunks[0], chunks[2]]
+    assert stats["tokens_used"] == 9 and stats["tokens_dropped"] == 8
+
+def test_near_duplicates_are_skipped():
+    chunks = [chunk("photosynthesis converts sunlight into chemical energy"),
+              chunk("photosynthesis converts sunlight into chemical energy quickly"),
+              chunk("mitochondria produce cellular energy")]
+    packed, stats = pack_context(chunks, 100, WhitespaceTokenizer(), dedup_similarity=0.8)
+    assert packed == [chunks[0], chunks[2]]
+    assert stats["duplicates"] == 1 and stats["chunks_dropped"] == 1
+
+def test_stored_token_counts_are_not_recomputed():
+    tok = WhitespaceTokenizer()
+    chunks = [chunk("a b c", n_tokens=3), chunk("d e f g", n_tokens=4), chunk("h i")]
+    packed, stats = pack_context(chunks, 100, tok)
+    assert tok.encoded == 1  # only the chunk without n_tokens
+    assert stats["tokens_used"] == 3 + 1 + 4 + 1 + 2
+
+def test_zero_budget_packs_nothing():
+    chunks = [chunk("a b c", n_tokens=3)]
+    packed, stats = pack_context(chunks, 0, WhitespaceTokenizer())
+    assert packed == [] and stats["chunks_dropped"] == 1 and stats["tokens_dropped"] == 3
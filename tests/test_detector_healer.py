@@ -0,0 +1,75 @@
+# tests/test_detector_healer.py
+import pytest
+import detector_healer
+from detector_healer import DetectorHealer, HEAL_PROMPT
+from chunking import MAX_INPUT_TOKENS
+
+class WhitespaceTokenizer:
+    """One token per whitespace-separated word."""
+
+    def __call__(self, texts, **kwargs):
+        return {"input_ids": [t.split() for t in texts]}
+
+@pytest.fixture
+def healer(monkeypatch):
+    monkeypatch.setattr(DetectorHealer, "tokenizer", property(lambda self: WhitespaceTokenizer()))
+    return DetectorHealer()
+
+def words(prefix, n):
+    return " ".join(f"{prefix}{i}" for i in range(n))
+
+# ------------------------------------------------
+# healing prompts
+# ------------------------------------------------
+def test_long_answer_is_cut_to_leave_room_for_context(healer):
+    chunks = [{"chunk": words("ctx", 150)}, {"chunk": words("more", 150)}]
+    answer = words("ans", 600)
+    prompt = healer._heal_prompt("what is it?", answer, chunks)
+    assert len(prompt.split()) <= MAX_INPUT_TOKENS - 1
+    assert chunks[0]["chunk"] in prompt
+    # the start of the answer survives, the tail is cut
+    assert "ans0 ans1" in prompt and "ans599" not in prompt
+
+def test_short_answer_is_sent_whole(healer):
+    chunks = [{"chunk": words("ctx", 100)}]
+    prompt = healer._heal_prompt("what is it?", words("ans", 50), chunks)
+    assert words("ans", 50) in prompt and chunks[0]["chunk"] in prompt
+
+def test_answer_is_left_unhealed_when_no_context_fits(healer, monkeypatch):
+    sent = []
+    monkeypatch.setattr(healer, "_generate", lambda prompts, **kw: sent.extend(prompts) or ["healed"] * len(prompts))
+    chunks = [{"chunk": words("ctx", 100)}]
+    out = healer.heal_batch([words("q", 600), "short question?"], ["old answer", "other answer"], [chunks, chunks])
+    assert out == ["old answer", "healed"]
+    assert len(sent) == 1 and "short question?" in sent[0]
+
+def test_heal_prompt_template_is_filled(healer):
+    prompt = healer._heal_prompt("q?", "a.", [{"chunk": "c."}])
+    assert prompt == HEAL_PROMPT.format(question="q?", answer="a.", context="c.")
+
+# ------------------------------------------------
+# _parse_verdict
+# ------------------------------------------------
+@pytest.mark.parametrize("reply,expected", [
+    ('{"hallucination": true, "reason": "made up"}', {"hallucination": True, "reason": "made up"}),
+    ("Verdict: {'hallucination': False, 'reason': 'ok'} done", {"hallucination": False, "reason": "ok"}),
+    ('{"hallucination": "true"}', {"hallucination": True, "reason": ""}),
+])
+def test_parse_verdict_reads_json_and_python_literals(healer, reply, expected):
+    assert healer._parse_verdict(reply) == expected
+
+@pytest.mark.parametrize("reply", [
+    "no json here",
+    '{"reason": "no verdict key"}',
+    '["hallucination", true]',
+    "{" * 2000 + "}" * 2000,
+])
+def test_unparseable_verdict_counts_as_not_hallucinated(healer, reply):
+    verdict = healer._parse_verdict(reply)
+    assert verdict == {"hallucination": False, "reason": "Parsing failed -> assume OK"}
+
+def test_verdict_is_never_executed(healer, tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    verdict = healer._parse_verdict("{__import__('pathlib').Path('pwned').touch() or 'hallucination': 1}")
+    assert not (tmp_path / "pwned").exists()
+    assert verdict["hallucination"] is False
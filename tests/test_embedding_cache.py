@@ -0,0 +1,45 @@
+# tests/test_embedding_cache.py
+import threading
+import numpy as np
+from embedding_cache import EmbeddingCache
+from benchmarks.fakes import HashEmbedder
+
+def texts(n, start=0):
+    return [f"text number {i} about topic {i % 7}" for i in range(start, start + n)]
+
+def test_encode_misses_once_then_hits(tmp_path):
+    embedder = HashEmbedder(dim=16)
+    cache = EmbeddingCache("m", cache_dir=tmp_path)
+    first = cache.encode(embedder, texts(10))
+    again = cache.encode(embedder, texts(10))
+    np.testing.assert_array_equal(first, again)
+    np.testing.assert_allclose(first, embedder.encode(texts(10)), rtol=1e-6)
+    assert cache.misses == 10 and cache.n_rows == 10
+
+def test_reader_survives_compaction_by_another_process(tmp_path):
+    embedder = HashEmbedder(dim=16)
+    reader = EmbeddingCache("m", cache_dir=tmp_path, lru_size=1)
+    reader.encode(embedder, texts(20))
+    reader.lru.clear()
+    reader._mm = None  # rows are known, the vectors are not mapped yet
+
+    # a second cache on the same directory appends and compacts to fewer rows
+    writer = EmbeddingCache("m", cache_dir=tmp_path, max_entries=10)
+    writer.encode(embedder, texts(5, start=100))
+    assert writer.n_rows < 20
+
+    for t, vec in zip(texts(20), embedder.encode(texts(20))):
+        got = reader.get(t)
+        # either still cached and correct, or a miss; never another text's vector
+        assert got is None or np.allclose(got, vec, rtol=1e-6)
+
+def test_concurrent_encodes_do_not_duplicate_rows(tmp_path):
+    embedder = HashEmbedder(dim=16, latency_ms=1)
+    cache = EmbeddingCache("m", cache_dir=tmp_path)
+    threads = [threading.Thread(target=cache.encode, args=(embedder, texts(20))) for _ in range(4)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    assert cache.n_rows == 20
+    np.testing.assert_allclose(cache.encode(embedder, texts(20)), embedder.encode(texts(20)), rtol=1e-6)
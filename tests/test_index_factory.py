@@ -0,0 +1,72 @@
+# tests/test_index_factory.py
+import numpy as np
+import faiss
+import pytest
+import index_factory
+from index_factory import factory_string, create_index, index_kind, make_index, filtered_search
+from benchmarks.fakes import HashEmbedder
+
+def test_ivfpq_falls_back_to_ivf_flat_below_pq_training_size():
+    assert factory_string("ivfpq", 427, 384) == "IVF10,Flat"
+    assert factory_string("ivfpq", 9_983, 384).endswith(",Flat")
+    assert factory_string("ivfpq", 9_984, 384).endswith(",PQ48x8")
+
+def test_nlist_is_capped_by_the_training_sample():
+    # a large corpus estimate, but only 3900 vectors to train the coarse quantizer on
+    assert factory_string("ivf", 1_000_000, 16, n_train=3_900) == "IVF100,Flat"
+
+def test_create_index_sizes_nlist_from_the_sample_it_trains_on():
+    vecs = np.random.default_rng(0).normal(size=(2_000, 16)).astype("float32")
+    index = create_index("ivfpq", 16, train_vectors=vecs, n_hint=1_000_000)
+    assert index_kind(index) == "ivf"
+    assert faiss.downcast_index(index.index).nlist == 2_000 // 39
+
+# ------------------------------------------------
+# filtered_search
+# ------------------------------------------------
+TOPICS = ["solar panels", "river fishing", "tax returns", "jazz guitar", "bread baking"]
+
+@pytest.fixture(scope="module")
+def corpus():
+    texts = [f"note {i} about {TOPICS[i % 5]} and {TOPICS[(i * 3) % 5]} number {i % 17}" for i in range(2_000)]
+    vecs = HashEmbedder(dim=32).encode(texts)
+    queries = HashEmbedder(dim=32).encode([f"question about {t}" for t in TOPICS])
+    return vecs, np.arange(len(texts), dtype="int64") * 3 + 2, queries
+
+def exact(vecs, ids, queries, allowed, k):
+    """Brute-force (distances, ids) of the k nearest allowed vectors; equal distances may swap ids."""
+    keep = np.isin(ids, allowed)
+    d = ((queries[:, None, :] - vecs[keep][None]) ** 2).sum(-1)
+    order = np.argsort(d, axis=1, kind="stable")[:, :k]
+    return np.take_along_axis(d, order, axis=1), ids[keep][order]
+
+def test_ivf_probes_every_list_when_the_filter_empties_the_probed_ones(corpus):
+    vecs, ids, queries = corpus
+    index = make_index(vecs, ids, "ivf")
+    # 21 scattered ids: the one probed list holds fewer than k of them
+    allowed = ids[::97]
+    dist, got = filtered_search(index, queries, 10, allowed, nprobe=1)
+    want_dist, _ = exact(vecs, ids, queries, allowed, 10)
+    np.testing.assert_allclose(dist, want_dist, rtol=1e-4, atol=1e-5)
+    assert np.isin(got, allowed).all()
+
+def test_hnsw_falls_back_to_an_exact_scan_for_short_results(corpus, monkeypatch):
+    vecs, ids, queries = corpus
+    # several blocks, so the running top k is merged across them
+    monkeypatch.setattr(index_factory, "EXACT_FILTER_BLOCK", 3)
+    index = make_index(vecs, ids, "hnsw")
+    allowed = ids[::401]  # 5 ids scattered over the graph
+    dist, got = filtered_search(index, queries, 10, allowed, ef_search=1)
+    want_dist, _ = exact(vecs, ids, queries, allowed, 5)
+    # all five allowed ids, nearest first, and nothing else
+    np.testing.assert_allclose(dist[:, :5], want_dist, rtol=1e-4, atol=1e-5)
+    assert all(set(row[:5]) == set(allowed) for row in got)
+    assert (got[:, 5:] == -1).all()
+
+def test_filtered_results_only_hold_allowed_ids(corpus):
+    vecs, ids, queries = corpus
+    allowed = ids[5::7]
+    for spec in ("flat", "ivf", "hnsw"):
+        index = make_index(vecs, ids, spec)
+        _, got = filtered_search(index, queries, 10, allowed, nprobe=1, ef_search=16)
+        assert np.isin(got, allowed).all()
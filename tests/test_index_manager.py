@@ -0,0 +1,87 @@
+# tests/test_index_manager.py
+import os
+import stat
+import pytest
+import index_manager
+from chunk_store import ChunkStoreWriter
+from index_manager import save_version, rollback_to, blob_path, version_info
+
+@pytest.fixture
+def live(tmp_path, monkeypatch):
+    """Work in an empty directory with a live index and chunk store."""
+    monkeypatch.chdir(tmp_path)
+    (tmp_path / "vector.index").write_bytes(b"index v1")
+    writer = ChunkStoreWriter("chunks.bin")
+    writer.add([{"id": 0, "chunk": "first chunk", "title": "t", "doc_id": "d"}])
+    writer.close()
+    return tmp_path
+
+def test_live_files_stay_writable_and_unshared(live):
+    tag = save_version("vector.index", "chunks.bin")
+    for path in ("vector.index", "chunks.bin"):
+        st = os.stat(path)
+        assert st.st_nlink == 1 and st.st_mode & stat.S_IWUSR
+    assert os.stat(version_info(tag)["index_file"]).st_nlink == 1
+
+def test_writing_the_live_file_in_place_does_not_change_the_version(live):
+    tag = save_version("vector.index", "chunks.bin")
+    with open("vector.index", "r+b") as f:
+        f.write(b"CORRUPT!")
+    assert rollback_to(tag, "vector.index", "chunks.bin")
+    assert (live / "vector.index").read_bytes() == b"index v1"
+    # and the restored file is again independent of the blob
+    with open("vector.index", "wb") as f:
+        f.write(b"rewritten")
+    assert blob_path(index_manager.file_hash(version_info(tag)["index_file"])).read_bytes() == b"index v1"
+
+def rebuild(live, n):
+    (live / "vector.index").write_bytes(f"index v{n}".encode())
+
+def test_identical_files_are_stored_once(live):
+    first = save_version("vector.index", "chunks.bin")
+    second = save_version("vector.index", "chunks.bin")
+    assert first != second
+    assert version_info(first)["blobs"] == version_info(second)["blobs"]
+    assert len(list(index_manager.BLOB_DIR.iterdir())) == 2
+
+def test_save_records_info_and_marks_the_version_active(live):
+    tag = save_version("vector.index", "chunks.bin", info={"embedding_model": "m"})
+    assert version_info(tag)["embedding_model"] == "m"
+    assert index_manager.active_version() == tag
+
+def test_rollback_restores_extras_and_removes_roles_the_version_lacks(live):
+    (live / "sparse.npz").write_bytes(b"sparse v1")
+    old = save_version("vector.index", "chunks.bin", extra_files={"sparse": "sparse.npz"})
+    rebuild(live, 2)
+    (live / "sparse.npz").write_bytes(b"sparse v2")
+    (live / "shards.json").write_text("{}")
+    new = save_version("vector.index", "chunks.bin", extra_files={"sparse": "sparse.npz", "shards": "shards.json"})
+
+    assert rollback_to(old, "vector.index", "chunks.bin", {"sparse": "sparse.npz", "shards": "shards.json"})
+    assert (live / "vector.index").read_bytes() == b"index v1"
+    assert (live / "sparse.npz").read_bytes() == b"sparse v1"
+    assert not (live / "shards.json").exists()
+    assert index_manager.active_version() == old
+
+    assert rollback_to(new, "vector.index", "chunks.bin", {"sparse": "sparse.npz", "shards": "shards.json"})
+    assert (live / "shards.json").read_text() == "{}"
+    assert not rollback_to("no-such-tag", "vector.index", "chunks.bin")
+
+def test_gc_keeps_recent_pinned_and_active_versions(live):
+    tags = []
+    for n in range(1, 6):
+        rebuild(live, n)
+        tags.append(save_version("vector.index", "chunks.bin"))
+    index_manager.pin_version(tags[0])
+    rollback_to(tags[1], "vector.index", "chunks.bin")
+
+    would, _ = index_manager.gc_versions(keep_last=2, dry_run=True)
+    assert len(index_manager.list_versions()) == 5
+
+    removed, freed = index_manager.gc_versions(keep_last=2)
+    assert removed == would == [tags[2]]
+    assert freed == len(b"index v3")
+    assert [v["tag"] for v in index_manager.list_versions()] == [tags[0], tags[1], tags[3], tags[4]]
+    # the dropped version's index blob is gone, the shared chunk store blob is not
+    kept = {d for v in index_manager.list_versions() for d in v["blobs"].values()}
+    assert {p.name for p in index_manager.BLOB_DIR.iterdir()} == kept
@@ -0,0 +1,39 @@
+# tests/test_monitor.py
+import numpy as np
+import faiss
+import pytest
+import monitor
+from index_factory import make_index, write_index
+
+def corpus(n=300, dim=16, seed=0):
+    """Random vectors plus a few planted groups of near-copies; ids are sparse, as chunk ids are."""
+    rng = np.random.default_rng(seed)
+    vecs = rng.normal(size=(n, dim)).astype("float32")
+    for group, size in enumerate((2, 3, 4)):
+        base = vecs[group]
+        for j in range(1, size):
+            vecs[10 * group + 50 + j] = base * rng.uniform(0.5, 2.0) + rng.normal(0, 0.02, dim)
+    return vecs, np.arange(n, dtype="int64") * 7 + 3
+
+def brute_force(vecs, ids, threshold):
+    unit = vecs / np.linalg.norm(vecs, axis=1, keepdims=True)
+    sims = unit @ unit.T
+    clusters = monitor._Clusters()
+    i, j = np.nonzero(np.triu(sims >= threshold, 1))
+    clusters.add(ids[i].tolist(), ids[j].tolist(), sims[i, j].tolist())
+    return sorted(m for m, _ in clusters.groups())
+
+@pytest.mark.parametrize("spec,exact_limit", [("flat", 10**6), ("flat", 0), ("hnsw", 0)])
+def test_duplicate_clusters_match_brute_force(tmp_path, monkeypatch, spec, exact_limit):
+    monkeypatch.setattr(monitor, "load_meta", dict)
+    vecs, ids = corpus()
+    path = str(tmp_path / "vector.index")
+    write_index(make_index(vecs, ids, spec), path)
+
+    report = monitor.detect_duplicate_embeddings(sim_threshold=0.9, block_size=64, exact_limit=exact_limit,
+                                                 index_file=path)
+    expected = brute_force(vecs, ids, 0.9)
+    assert len(expected) == 3
+    assert sorted(c["ids"] for c in report["clusters"]) == expected
+    assert report["method"] == ("exact" if exact_limit else "neighbours")
+    assert report["n_redundant"] == 1 + 2 + 3
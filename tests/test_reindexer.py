@@ -0,0 +1,63 @@
+# tests/test_reindexer.py
+import json
+import numpy as np
+import faiss
+import pytest
+import reindexer
+from chunk_store import ChunkStore
+from benchmarks.fakes import HashEmbedder
+
+class WhitespaceTokenizer:
+    def __call__(self, texts, **kwargs):
+        return {"input_ids": [t.split() for t in texts]}
+
+class Crash(Exception):
+    pass
+
+class CrashingEmbedder(HashEmbedder):
+    """Fails on the n-th encode call, like a build killed halfway."""
+
+    def __init__(self, fail_at, **kwargs):
+        super().__init__(**kwargs)
+        self.calls = 0
+        self.fail_at = fail_at
+
+    def encode(self, sentences, **kwargs):
+        self.calls += 1
+        if self.calls == self.fail_at:
+            raise Crash()
+        return super().encode(sentences, **kwargs)
+
+@pytest.fixture
+def corpus(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    monkeypatch.setattr(reindexer, "get_tokenizer", WhitespaceTokenizer)
+    monkeypatch.setattr(reindexer, "CHECKPOINT_EVERY", 2)
+    with open("data.jsonl", "w") as f:
+        for d in range(30):
+            text = " ".join(f"Document {d} sentence {s} talks about topic {(d + s) % 5}." for s in range(40))
+            f.write(json.dumps({"id": str(d), "title": f"doc {d}", "text": text}) + "\n")
+    return tmp_path
+
+def build(embedder, out, resume=False):
+    reindexer.stream_build(embedder, "m", f"{out}.index", f"{out}.bin", batch_size=8, resume=resume)
+    index = faiss.read_index(f"{out}.index")
+    vecs, ids = index.reconstruct_n(0, index.ntotal), faiss.vector_to_array(index.id_map)
+    return vecs, ids, list(ChunkStore(f"{out}.bin"))
+
+def test_resumed_build_matches_an_uninterrupted_one(corpus):
+    full = CrashingEmbedder(fail_at=0, dim=32)
+    expected = build(full, "full")
+
+    with pytest.raises(Crash):
+        build(CrashingEmbedder(fail_at=7, dim=32), "crashed")
+    assert (corpus / "crashed.index.checkpoint.json").exists()
+    again = CrashingEmbedder(fail_at=0, dim=32)
+    resumed = build(again, "crashed", resume=True)
+    # only the batches after the last checkpoint are embedded again
+    assert again.calls == full.calls - 6
+
+    np.testing.assert_array_equal(resumed[1], expected[1])
+    np.testing.assert_allclose(resumed[0], expected[0], rtol=1e-6)
+    assert resumed[2] == expected[2]
+    assert not (corpus / "crashed.index.checkpoint.json").exists()
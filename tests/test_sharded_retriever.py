@@ -0,0 +1,32 @@
+# tests/test_sharded_retriever.py
+import numpy as np
+import faiss
+import pytest
+from index_factory import make_index, write_index
+from chunk_store import ChunkStoreWriter
+from sharded_retriever import build_shards, read_shards, SHARD_INDEX
+
+@pytest.mark.parametrize("spec", ["flat", "SQ8", "IVF16,PQ4x4"])
+def test_shards_keep_the_stored_codes(tmp_path, monkeypatch, spec):
+    monkeypatch.chdir(tmp_path)
+    rng = np.random.default_rng(0)
+    vecs = rng.normal(size=(2_000, 16)).astype("float32")
+    ids = np.arange(2_000, dtype="int64") * 5 + 1
+    index = make_index(vecs, ids, spec)
+    write_index(index, "vector.index")
+    writer = ChunkStoreWriter("chunks.bin")
+    writer.add([{"id": int(i), "chunk": f"chunk {i}", "title": "t", "doc_id": "d"} for i in ids])
+    writer.close()
+
+    build_shards("vector.index", "chunks.bin", 3, embedding_model="m")
+    assert read_shards()["embedding_model"] == "m"
+    shards = [faiss.read_index(SHARD_INDEX.format(s)) for s in range(3)]
+    for s, shard in enumerate(shards):
+        assert set(faiss.vector_to_array(shard.id_map) % 3) == {s}
+        # codes are copied, not re-encoded: same reconstructions as the full index
+        some = faiss.vector_to_array(shard.id_map)[:50]
+        if isinstance(faiss.downcast_index(shard.index), faiss.IndexIVF):
+            faiss.downcast_index(shard.index).make_direct_map()
+            faiss.downcast_index(index.index).make_direct_map()
+        np.testing.assert_array_equal(shard.reconstruct_batch(some), index.reconstruct_batch(some))
+    assert sum(s.ntotal for s in shards) == index.ntotal